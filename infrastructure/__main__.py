@@ -1,17 +1,56 @@
-import network
-import eks
-import s3
-import ec2
-import aws_config
-import k8s
 import pulumi
-from datetime import datetime
-from autotag import register_auto_tags
+import invoke_cache
+from autotag import register_auto_tags, stack_created
+from profiler import register_deploy_profiler
 
+# Stack transformations only apply to resources constructed after they are
+# registered, so auto tags are set up before any module creates resources.
 config = pulumi.Config()
 tags = config.require_object("tags")
 register_auto_tags({
     'user:name': tags.get("user_name"),
     'user:stack_name': tags.get("stack_name"),
-    'user:stack-created': datetime.today().strftime('%Y-%m-%d %H:%M:%S'),
-})
\ No newline at end of file
+    'user:stack-created': stack_created(tags.get("stack_created")),
+})
+
+# Opt-in deployment profiling (see profiler.py)
+profile_config = config.get_object("profile") or {}
+profiler = None
+if profile_config.get("enabled"):
+    profiler = register_deploy_profiler(profile_config.get("output", "deploy-profile.json"))
+
+from layers import LayerSet
+from network import NetworkLayer
+from db_secret import DbSecretLayer
+from ecr import EcrLayer
+from eks import EksLayer
+from ec2 import DatabaseLayer
+from s3 import BackupsLayer
+from aws_config import AwsConfigLayer
+from k8s import AppsLayer
+
+# Build the selected layers (see layers.py); the rest come from layer_stacks
+layers = LayerSet(config)
+layers.add("network", lambda: NetworkLayer("network"))
+layers.add("db_secret", lambda: DbSecretLayer("db-secret"))
+layers.add("ecr", lambda: EcrLayer("ecr"))
+layers.add("eks", lambda: EksLayer("eks", layers["network"]))
+layers.add("database", lambda: DatabaseLayer("database", layers["network"], layers["db_secret"]))
+layers.add("backups", lambda: BackupsLayer("backups"))
+layers.add("aws_config", lambda: AwsConfigLayer("aws-config"))
+layers.add("apps", lambda: AppsLayer("apps", layers["eks"], layers["ecr"], layers["db_secret"]))
+
+# Stack outputs kept from before the layers were introduced
+if "eks" in layers:
+    pulumi.export("eks_cluster_name", layers["eks"].cluster_name)
+    pulumi.export("eks_cluster_endpoint", layers["eks"].cluster_endpoint)
+if "ecr" in layers:
+    pulumi.export("ecr repo url", layers["ecr"].repository_url)
+if "database" in layers:
+    pulumi.export("db_instance_public_dns", layers["database"].db_instance_public_dns)
+if "apps" in layers:
+    pulumi.export("web-app lb dns", layers["apps"].web_app_lb_dns)
+
+invoke_cache.log_stats()
+if profiler:
+    profiler.write_report()
@@ -1,15 +1,91 @@
+import argparse
+import json
+import sys
 import pulumi
+from datetime import datetime
 from taggable import is_taggable
 
+# Name of the stack output that records when the stack was first deployed.
+STACK_CREATED_OUTPUT = "stack_created"
+
+# Properties that hold tags in the AWS provider; a diff limited to these is tag-only.
+TAG_PROPERTIES = {"tags", "tagsAll"}
+
 # registerAutoTags registers a global stack transformation that merges a set
 # of tags with whatever was also explicitly added to the resource definition.
+# Only resources constructed after registration are transformed.
 def register_auto_tags(auto_tags):
     pulumi.runtime.register_stack_transformation(lambda args: auto_tag(args, auto_tags))
 
 # auto_tag applies the given tags to the resource properties if applicable.
+# Keys the resource already carries with the same value are left alone, and
+# resources that need no change are passed through untransformed.
 def auto_tag(args, auto_tags):
-    # print(args.type_)
-    if is_taggable(args.type_):
-        # print("is_taggable")
-        args.props['tags'] = {**(args.props['tags'] or {}), **auto_tags}
-        return pulumi.ResourceTransformationResult(args.props, args.opts)
\ No newline at end of file
+    if not is_taggable(args.type_):
+        return None
+
+    tags = args.props.get('tags')
+    if isinstance(tags, pulumi.Output):
+        args.props['tags'] = tags.apply(lambda t: {**(t or {}), **auto_tags})
+        return pulumi.ResourceTransformationResult(args.props, args.opts)
+
+    tags = tags or {}
+    changed = {k: v for k, v in auto_tags.items() if k not in tags or tags[k] != v}
+    if not changed:
+        return None
+    args.props['tags'] = {**tags, **changed}
+    return pulumi.ResourceTransformationResult(args.props, args.opts)
+
+# stack_created returns a creation timestamp that stays the same across
+# updates. An explicit value (e.g. from the `tags.stack_created` config key)
+# wins; otherwise the value exported by this stack's previous update is reused,
+# and only the very first update records the current time.
+def stack_created(value=None):
+    if value:
+        return value
+
+    now = datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+    self_ref = pulumi.StackReference(
+        f"{pulumi.get_organization()}/{pulumi.get_project()}/{pulumi.get_stack()}"
+    )
+    created = self_ref.get_output(STACK_CREATED_OUTPUT).apply(lambda previous: previous or now)
+    pulumi.export(STACK_CREATED_OUTPUT, created)
+    return created
+
+# tag_only_diffs returns the resources in a `pulumi preview --json` document
+# whose pending update touches nothing but tags, along with the changed keys.
+def tag_only_diffs(preview):
+    diffs = []
+    for step in preview.get("steps", []):
+        if step.get("op") != "update":
+            continue
+        detailed = step.get("detailedDiff") or {}
+        reasons = set(step.get("diffReasons") or {key.split(".")[0].split("[")[0] for key in detailed})
+        if not reasons or not reasons <= TAG_PROPERTIES:
+            continue
+        keys = sorted(key for key in detailed if key.split(".")[0].split("[")[0] == "tags")
+        diffs.append({"urn": step["urn"], "keys": keys})
+    return diffs
+
+# Report mode: list the resources that would only get tag diffs.
+#   pulumi preview --json --diff > preview.json && python autotag.py preview.json
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report resources whose pending update is tag-only.")
+    parser.add_argument("preview", help="output of `pulumi preview --json --diff` ('-' for stdin)")
+    args = parser.parse_args(argv)
+
+    if args.preview == "-":
+        preview = json.load(sys.stdin)
+    else:
+        with open(args.preview) as f:
+            preview = json.load(f)
+
+    diffs = tag_only_diffs(preview)
+    for diff in diffs:
+        keys = f" ({', '.join(diff['keys'])})" if diff["keys"] else ""
+        print(f"{diff['urn']}{keys}")
+    print(f"{len(diffs)} resource(s) with tag-only diffs")
+
+
+if __name__ == "__main__":
+    main()
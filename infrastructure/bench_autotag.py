@@ -0,0 +1,80 @@
+import argparse
+import itertools
+import time
+import pulumi
+import taggable
+from autotag import auto_tag
+
+# bench_autotag drives auto_tag with synthetic ResourceTransformationArgs to
+# measure the per-resource cost of the stack transformation.
+#
+#   python bench_autotag.py --resources 10000
+
+# A mix of the types this stack registers, taggable and not.
+RESOURCE_TYPES = [
+    "aws:ec2/vpc:Vpc",
+    "aws:ec2/subnet:Subnet",
+    "aws:ec2/securityGroup:SecurityGroup",
+    "aws:ec2/securityGroupRule:SecurityGroupRule",
+    "aws:ec2/routeTableAssociation:RouteTableAssociation",
+    "aws:eks/addon:Addon",
+    "aws:eks/nodeGroup:NodeGroup",
+    "aws:iam/role:Role",
+    "aws:iam/rolePolicyAttachment:RolePolicyAttachment",
+    "aws:route53/record:Record",
+    "aws:secretsmanager/secretVersion:SecretVersion",
+    "kubernetes:apps/v1:Deployment",
+    "kubernetes:core/v1:Service",
+    "random:index/randomPassword:RandomPassword",
+]
+
+AUTO_TAGS = {
+    "user:name": "bench",
+    "user:stack_name": "bench-stack",
+    "user:stack-created": "2024-12-01 00:00:00",
+}
+
+
+def synthetic_args(count):
+    types = itertools.cycle(RESOURCE_TYPES)
+    return [
+        pulumi.ResourceTransformationArgs(
+            resource=None,
+            type_=next(types),
+            name=f"resource-{i}",
+            props={"tags": {"Name": f"resource-{i}"}},
+            opts=pulumi.ResourceOptions(),
+        )
+        for i in range(count)
+    ]
+
+
+def run(count, rounds):
+    best = None
+    for _ in range(rounds):
+        taggable.is_taggable.cache_clear()
+        args = synthetic_args(count)
+        start = time.perf_counter()
+        for a in args:
+            auto_tag(a, AUTO_TAGS)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark for autotag.auto_tag.")
+    parser.add_argument("--resources", type=int, default=10_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    # Load the index up front so the timed loop measures lookups only.
+    taggable.is_taggable(RESOURCE_TYPES[0])
+
+    elapsed = run(args.resources, args.rounds)
+    print(f"auto_tag: {args.resources} resources in {elapsed * 1e3:.2f} ms "
+          f"({elapsed / args.resources * 1e6:.2f} us/resource, best of {args.rounds})")
+
+
+if __name__ == "__main__":
+    main()
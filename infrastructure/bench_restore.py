@@ -0,0 +1,177 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(REPO, "playbooks", "files"))
+import pg_backup
+
+# bench_restore measures how long the ultratic database takes to restore (the
+# RTO of a logical backup) as it grows. It loads a synthetic dataset shaped
+# like ultra-tic/prisma/schema.prisma (users, their games and each game's
+# moves) into a local Postgres, then times:
+#
+#   plain        pg_dump | psql, the serial restore a pg_dumpall backup gets
+#   directory/N  pg_dump --format=directory --jobs N, pg_restore --jobs N,
+#                with the same commands as playbooks/files/pg_backup.py
+#   s3/N         with --bucket, pg_backup.py's upload and restore through S3
+#                (or a local stand-in with --endpoint-url), transfer included
+#
+# PG* environment variables select the server, e.g. the db service in
+# docker-compose.yml:
+#
+#   PGHOST=localhost PGUSER=user PGPASSWORD=password \
+#       python bench_restore.py --users 10000 --jobs 1,2,4 --history restore-bench.jsonl
+
+MIGRATIONS = os.path.join(REPO, "ultra-tic", "prisma", "migrations")
+SOURCE_DB = "ultratic_bench"
+TABLES = ["User", "Game", "Move"]
+
+
+def _psql(database, sql=None, path=None):
+    command = ["psql", "-qAtX", "-v", "ON_ERROR_STOP=1", f"--dbname={database}"]
+    command += ["-f", path] if path else ["-c", sql]
+    return subprocess.run(command, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def _recreate(database):
+    _psql("postgres", f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE)')
+    _psql("postgres", f'CREATE DATABASE "{database}"')
+
+
+# load_dataset creates the schema from the Prisma migrations and fills it:
+# users, games_per_user games each, and moves_per_game moves per game.
+def load_dataset(users, games_per_user, moves_per_game):
+    _recreate(SOURCE_DB)
+    for migration in sorted(glob.glob(os.path.join(MIGRATIONS, "*", "migration.sql"))):
+        _psql(SOURCE_DB, path=migration)
+    games = users * games_per_user
+    _psql(SOURCE_DB, f"""
+        INSERT INTO "User" (id, username, "ipAddress", "createdAt")
+        SELECT 'user' || i, 'player' || i, '10.' || (i / 65536 % 256) || '.' || (i / 256 % 256) || '.' || (i % 256),
+               now() - i * interval '1 minute'
+        FROM generate_series(1, {users}) i;
+
+        INSERT INTO "Game" (id, user_id, "createdAt", "wonAt", winner)
+        SELECT g, 'user' || (1 + g % {users}), now() - g * interval '1 second',
+               CASE WHEN g % 4 > 0 THEN now() - g * interval '1 second' + interval '5 minutes' END,
+               CASE WHEN g % 4 > 0 THEN g % 2 + 1 END
+        FROM generate_series(1, {games}) g;
+        SELECT setval(pg_get_serial_sequence('"Game"', 'id'), {games});
+
+        INSERT INTO "Move" (id, user_id, game_id, "boardIndex", "boxIndex", turn, "createdAt")
+        SELECT 'move' || g || '-' || t, 'user' || (1 + g % {users}), g, (g + t) % 9, (g * 7 + t) % 9, t % 2 + 1,
+               now() - g * interval '1 second' + t * interval '2 seconds'
+        FROM generate_series(1, {games}) g, generate_series(1, {moves_per_game}) t;
+        ANALYZE;
+    """)
+
+
+# row_counts returns the number of rows in each ultratic table of database.
+def row_counts(database):
+    return {table: int(_psql(database, f'SELECT count(*) FROM "{table}"')) for table in TABLES}
+
+
+def _timed(*commands, stdout=None):
+    started = time.monotonic()
+    for command in commands:
+        subprocess.run(command, check=True, stdout=stdout)
+    return round(time.monotonic() - started, 3)
+
+
+# bench_plain times a plain dump restored serially through psql.
+def bench_plain(scratch, target):
+    path = os.path.join(scratch, "plain.sql")
+    with open(path, "w") as out:
+        dump_seconds = _timed(["pg_dump", "--format=plain", SOURCE_DB], stdout=out)
+    _recreate(target)
+    restore_seconds = _timed(["psql", "-qX", "-v", "ON_ERROR_STOP=1", f"--dbname={target}", "-f", path],
+                             stdout=subprocess.DEVNULL)
+    return {"method": "plain", "jobs": 1, "dump_seconds": dump_seconds, "restore_seconds": restore_seconds}
+
+
+# bench_directory times a directory-format dump and restore, jobs at a time.
+def bench_directory(scratch, target, jobs):
+    path = os.path.join(scratch, f"directory-{jobs}")
+    dump_seconds = _timed(pg_backup.directory_dump_command(SOURCE_DB, path, jobs))
+    _recreate(target)
+    restore_seconds = _timed(pg_backup.restore_command(path, jobs, target))
+    shutil.rmtree(path)
+    return {"method": "directory", "jobs": jobs, "dump_seconds": dump_seconds, "restore_seconds": restore_seconds}
+
+
+# bench_s3 times pg_backup.py's directory-format backup to S3 and its restore
+# from there.
+def bench_s3(s3, bucket, scratch, target, jobs):
+    folder = pg_backup.backup_folder("bench", datetime.datetime.now(datetime.timezone.utc))
+    started = time.monotonic()
+    pg_backup.backup_directories(s3, bucket, folder, [SOURCE_DB], jobs, scratch,
+                                 ["zstd", "-q", "-c"], "zst")
+    dump_seconds = round(time.monotonic() - started, 3)
+    _psql("postgres", f'DROP DATABASE IF EXISTS "{target}" WITH (FORCE)')
+    metrics = pg_backup.restore(s3, bucket, f"{folder}/{SOURCE_DB}.dir.tar", jobs, scratch, target)
+    return {"method": "s3", "jobs": jobs, "dump_seconds": dump_seconds, "restore_seconds": metrics["duration_seconds"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Restore time (RTO) benchmark for the ultratic database.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--games-per-user", type=int, default=10)
+    parser.add_argument("--moves-per-game", type=int, default=30)
+    parser.add_argument("--jobs", default=f"1,{pg_backup.default_jobs()}", help="comma-separated pg_restore --jobs to try")
+    parser.add_argument("--bucket", help="also time a round trip through this bucket")
+    parser.add_argument("--endpoint-url", help="S3 endpoint, e.g. the minio service in docker-compose.yml")
+    parser.add_argument("--history", help="append the results to this JSON lines file")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark databases")
+    args = parser.parse_args(argv)
+    jobs = sorted({int(n) for n in args.jobs.split(",")})
+
+    started = time.monotonic()
+    load_dataset(args.users, args.games_per_user, args.moves_per_game)
+    expected = row_counts(SOURCE_DB)
+    size = int(_psql(SOURCE_DB, "SELECT pg_database_size(current_database())"))
+    print(f"loaded {expected} ({size / 2**20:.0f} MiB) in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+    target = f"{SOURCE_DB}_restored"
+    scratch = tempfile.mkdtemp(prefix="bench_restore-")
+    try:
+        runs = [lambda: bench_plain(scratch, target)]
+        runs += [lambda n=n: bench_directory(scratch, target, n) for n in jobs]
+        if args.bucket:
+            import boto3
+            s3 = boto3.client("s3", endpoint_url=args.endpoint_url)
+            runs += [lambda n=n: bench_s3(s3, args.bucket, scratch, target, n) for n in jobs]
+        results = []
+        for run in runs:
+            result = run()
+            if row_counts(target) != expected:
+                raise SystemExit(f"{result['method']} restore lost rows: {row_counts(target)} != {expected}")
+            print(f"  {result['method']:<10} jobs={result['jobs']:<3} dump {result['dump_seconds']:>8.2f}s"
+                  f"  restore {result['restore_seconds']:>8.2f}s")
+            results.append(result)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        if not args.keep:
+            for database in (target, SOURCE_DB):
+                _psql("postgres", f'DROP DATABASE IF EXISTS "{database}" WITH (FORCE)')
+
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps({
+                "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                "rows": expected,
+                "database_bytes": size,
+                "results": results,
+            }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
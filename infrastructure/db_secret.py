@@ -0,0 +1,84 @@
+import pulumi
+import pulumi_aws as aws
+import pulumi_random as random
+from layers import Layer
+
+# The database credentials are consumed by both the DB server (ec2.py) and the
+# web app (k8s.py). Keeping them in their own tier lets the DB instance and the
+# EKS cluster provision in parallel instead of the DB waiting on the cluster.
+
+
+# has_read_replicas reports whether the database (see ec2.py) has read
+# replicas behind <db_instance>-ro: EC2 streaming replicas or Aurora readers.
+def has_read_replicas():
+    config = pulumi.Config()
+    database_config = config.get_object("database") or {}
+    if database_config.get("engine", "ec2") == "aurora":
+        return database_config.get("aurora", {}).get("readers", 1) > 0
+    return (config.get_object("db_replicas") or {}).get("count", 0) > 0
+
+
+class DbSecretLayer(Layer):
+    def __init__(self, name, opts=None):
+        super().__init__("db_secret", name, opts)
+
+        # Load Pulumi configuration and needed variables
+        config = pulumi.Config()
+        internal_domain = config.require("internal_domain")
+        db_instance_name = config.require("db_instance")
+        web_app_config = config.require_object("web_app")
+
+        # Create random password for the db
+        random_password = random.RandomPassword("dbPassword",
+            length=16,
+            special=True,
+            keepers={
+                "keeper": "change-me-to-change-password"
+            },
+            opts=self.child_opts()
+        )
+
+        # Read replicas (see ec2.py) serve reads behind their own record. EC2
+        # replicas stream WAL from the primary as a dedicated replication user.
+        secret_properties = {}
+        if has_read_replicas():
+            secret_properties["read_host"] = f"{db_instance_name}-ro.{internal_domain}"
+        database_config = config.get_object("database") or {}
+        if database_config.get("engine", "ec2") == "ec2" and (config.get_object("db_replicas") or {}).get("count", 0):
+            replication_password = random.RandomPassword("dbReplicationPassword",
+                length=24,
+                special=False,
+                opts=self.child_opts()
+            )
+            secret_properties["replication_password"] = replication_password.result
+
+        # DB connection details secret
+        db_secret = aws.secretsmanager.Secret(
+            web_app_config.get("postgres_secret"),
+            name=web_app_config.get("postgres_secret"),
+            description="PostgreSQL connection details",
+            tags={
+                "Environment": "Production"
+            },
+            opts=self.child_opts()
+        )
+
+        # Create a Secrets Manager secret version with the generated secret string
+        secret_version = aws.secretsmanager.SecretVersion("dbSecretVersion",
+            secret_id=db_secret.id,
+            secret_string=pulumi.Output.json_dumps({
+                "username": web_app_config.get("name"),
+                "password": random_password.result,
+                "host": f"{db_instance_name}.{internal_domain}",
+                "port": 5432,
+                "db": web_app_config.get("name"),
+                **secret_properties
+            }),
+            opts=self.child_opts()
+        )
+
+        self.export(
+            secret_name=db_secret.name,
+            secret_arn=db_secret.arn,
+            secret_version_id=secret_version.version_id,
+        )
@@ -0,0 +1,217 @@
+import argparse
+import ast
+import json
+import os
+import sys
+
+# depcheck statically analyzes the program modules for dependencies that can
+# lengthen the deploy critical path without carrying any data:
+#
+#   ordering-only import  every name imported from X is only used in
+#                         depends_on, yet importing X drags X's tier and the
+#                         tiers it imports in front of this module.
+#   ordering-only edge    depends_on=r on a resource that takes no input from r.
+#                         Sometimes required (e.g. CRDs before custom
+#                         resources), but always worth a second look.
+#   redundant edge        depends_on=r on a resource that already takes an
+#                         input from r; the edge is implied and can be dropped.
+#
+# With --profile, findings whose resources lie on the critical path recorded by
+# profiler.py are marked, since those are the ones that actually cost time.
+#
+#   python depcheck.py [--profile deploy-profile.json]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOOLS = {"depcheck", "offline", "gen_taggable", "bench_autotag", "deploy", "pitr", "bench_restore", "rebuild_db", "stack_config"}
+
+
+def program_modules():
+    return sorted(
+        name[:-3] for name in os.listdir(HERE)
+        if name.endswith(".py") and name != "__main__.py" and name[:-3] not in TOOLS
+    )
+
+
+def _names(node):
+    # Names of called helpers (e.g. local_layers) are not dependencies.
+    if node is None:
+        return set()
+    called = {id(n.func) for n in ast.walk(node) if isinstance(n, ast.Call)}
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and id(n) not in called}
+
+
+def _keyword(call, name):
+    return next((k.value for k in call.keywords if k.arg == name), None)
+
+
+def _depends_on(call):
+    # depends_on is passed through opts=pulumi.ResourceOptions(depends_on=...)
+    opts = _keyword(call, "opts")
+    if isinstance(opts, ast.Call):
+        return _keyword(opts, "depends_on")
+    return None
+
+
+def _logical_name(call):
+    if call.args and isinstance(call.args[0], ast.Constant) and isinstance(call.args[0].value, str):
+        return call.args[0].value
+    return None
+
+
+class ModuleInfo:
+    def __init__(self, name, tree):
+        self.name = name
+        self.imports = {}        # local name -> (module, original name)
+        self.resources = {}      # variable -> logical resource name
+        self.targets = {}        # id(call) -> variable it is assigned to
+        self.edges = []          # (line, resource, dependency, redundant)
+        self.data_uses = set()   # imported names used outside depends_on
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module:
+                for alias in node.names:
+                    self.imports[alias.asname or alias.name] = (node.module, alias.name)
+            elif isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+                logical = _logical_name(node.value)
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        self.targets[id(node.value)] = target.id
+                        if logical:
+                            self.resources[target.id] = logical
+
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            depends_on = _depends_on(node)
+            if depends_on is None:
+                continue
+            data = set()
+            for arg in node.args:
+                data |= _names(arg)
+            for keyword in node.keywords:
+                if keyword.arg != "opts":
+                    data |= _names(keyword.value)
+            for dependency in sorted(_names(depends_on)):
+                resource = _logical_name(node) or self.targets.get(id(node))
+                self.edges.append((node.lineno, resource, dependency, dependency in data))
+
+        depends_on_nodes = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                value = _depends_on(node)
+                if value is not None:
+                    depends_on_nodes |= {id(n) for n in ast.walk(value)}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id in self.imports and id(node) not in depends_on_nodes:
+                self.data_uses.add(node.id)
+
+
+def load_modules():
+    modules = {}
+    for name in program_modules():
+        with open(os.path.join(HERE, f"{name}.py")) as f:
+            modules[name] = ModuleInfo(name, ast.parse(f.read(), filename=f"{name}.py"))
+    return modules
+
+
+def _transitive_imports(modules, module, seen=None):
+    seen = set() if seen is None else seen
+    for source, _ in modules[module].imports.values():
+        if source in modules and source not in seen:
+            seen.add(source)
+            _transitive_imports(modules, source, seen)
+    return seen
+
+
+def _resolve(modules, module, variable):
+    # Follow imports back to the module that defines the resource.
+    info = modules[module]
+    seen = set()
+    while variable in info.imports and (info.name, variable) not in seen:
+        seen.add((info.name, variable))
+        source, original = info.imports[variable]
+        if source not in modules:
+            break
+        info, variable = modules[source], original
+    return info.name, info.resources.get(variable)
+
+
+# analyze returns findings as dicts with kind, module, line and a message.
+def analyze(modules, critical=frozenset()):
+    findings = []
+
+    def on_path(*names):
+        return any(n in critical for n in names if n)
+
+    for module in modules.values():
+        by_source = {}
+        for local, (source, _) in module.imports.items():
+            if source in modules:
+                by_source.setdefault(source, []).append(local)
+        for source, names in sorted(by_source.items()):
+            if any(name in module.data_uses for name in names):
+                continue
+            # Tiers the importer would not evaluate first if it didn't import source.
+            others = set()
+            for other, other_names in by_source.items():
+                if other != source and any(n in module.data_uses for n in other_names):
+                    others |= {other} | _transitive_imports(modules, other)
+            dragged = sorted(
+                m for m in _transitive_imports(modules, source)
+                if m not in others and m != module.name and modules[m].resources
+            )
+            if not dragged:
+                continue
+            logical = [_resolve(modules, module.name, name)[1] for name in names]
+            findings.append({
+                "kind": "ordering-only import",
+                "module": module.name,
+                "line": None,
+                "critical": on_path(*logical),
+                "message": f"{module.name} imports {', '.join(sorted(names))} from {source} only for "
+                           f"depends_on, which also evaluates {', '.join(dragged)} first; "
+                           f"move it to a shared tier",
+            })
+
+        for line, resource, dependency, redundant in module.edges:
+            source, logical = _resolve(modules, module.name, dependency)
+            target = logical or dependency
+            findings.append({
+                "kind": "redundant edge" if redundant else "ordering-only edge",
+                "module": module.name,
+                "line": line,
+                "critical": on_path(resource, logical),
+                "message": f"{resource or '<resource>'} depends_on {target} ({source})"
+                           + (" but already takes an input from it" if redundant else " without any data dependency"),
+            })
+    return findings
+
+
+# critical_resources returns the logical names on a profiler.py critical path.
+def critical_resources(profile_path):
+    with open(profile_path) as f:
+        summary = json.load(f)["summary"]
+    return frozenset((entry["urn"] or "").rsplit("::", 1)[-1] for entry in summary["critical_path"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flag dependencies that lengthen the critical path without data.")
+    parser.add_argument("--profile", help="deploy profile written by profiler.py")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    critical = critical_resources(args.profile) if args.profile else frozenset()
+    findings = analyze(load_modules(), critical)
+
+    if args.json:
+        print(json.dumps(findings, indent=2))
+    else:
+        for finding in findings:
+            where = f"{finding['module']}.py:{finding['line']}" if finding["line"] else f"{finding['module']}.py"
+            marker = " [critical path]" if finding["critical"] else ""
+            print(f"{where}: {finding['kind']}{marker}: {finding['message']}")
+    return 1 if any(f["kind"] == "ordering-only import" for f in findings) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from layers import DEPENDENCIES, LAYERS
+from stack_config import PROJECT, load_stack_config, partial_config
+
+# deploy drives the program through the Pulumi Automation API instead of the
+# bare CLI. Every layer (see layers.py) is deployed as its own stack,
+# <stack>-<layer>, which reads the layers it depends on through stack
+# references. That lets a rollout target some layers only, and lets layers
+# that don't depend on each other (eks, backups, aws_config, ...) deploy
+# concurrently: each layer starts as soon as the layers it needs are done.
+#
+#   python deploy.py up                          # every layer
+#   python deploy.py up --layers apps            # only the app workloads
+#   python deploy.py refresh --layers eks,database
+#   python deploy.py up --backend file://~/.pulumi-state --parallel 32
+#   python deploy.py up --offline                # evaluate each step against mocks
+#
+# Per-layer stacks take their config from Pulumi.<stack>.yaml (secure values
+# excluded) and the driver's defaults from its `deploy` object:
+#
+# infrastructure:deploy:
+#   parallel: 32                  # pulumi --parallel for each step
+#   concurrency: 4                # layers deployed at the same time
+#   skip_refresh: [network, ecr]  # layers that are never refreshed before up
+#
+# `up` refreshes each layer first unless it is listed in skip_refresh. Layers
+# whose resources nothing outside Pulumi changes don't need the extra round
+# of reads. Each step's timing is written to the summary file.
+#
+# Stacks deployed before the split hold every layer in one stack, <stack>.
+# Deploying per-layer stacks next to it would create a second copy of each
+# resource under the same physical names (the backup bucket, the db secret,
+# ...), so the driver refuses to run while <stack> exists, and only creates
+# per-layer stacks that don't exist yet with --create-stacks. To migrate,
+# move each layer's component, with its children, into the layer's stack,
+# then remove the emptied stack but keep its settings file, which the
+# per-layer stacks take their config from:
+#
+#   pulumi stack init organization/infrastructure/dev-network
+#   pulumi state move --source organization/infrastructure/dev \
+#       --dest organization/infrastructure/dev-network \
+#       'urn:pulumi:dev::infrastructure::wiz:layers:network::network'
+#   ... the same for every layer in LAYERS ...
+#   pulumi stack rm --preserve-config organization/infrastructure/dev
+#   python deploy.py up                          # should only update outputs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SUMMARY_PATH = "deploy-summary.json"
+
+# Layers whose resources are not changed outside of Pulumi, so refreshing them
+# before an update only costs time.
+IMMUTABLE_LAYERS = ["network", "db_secret", "ecr", "backups", "aws_config"]
+
+
+# layer_stack returns the fully qualified name of a layer's stack.
+def layer_stack(org, stack, layer):
+    return f"{org}/{PROJECT}/{stack}-{layer}"
+
+
+# stack_resources returns the resource count of every stack of the project on
+# the backend, keyed by fully qualified name.
+def stack_resources(org, env_vars=None, work_dir=HERE):
+    from pulumi import automation as auto
+
+    workspace = auto.LocalWorkspace(work_dir=work_dir, env_vars=env_vars or {})
+    stacks = {}
+    for summary in workspace.list_stacks():
+        # Backends list stacks as stack, org/stack or org/project/stack
+        parts = summary.name.split("/")
+        name = {1: f"{org}/{PROJECT}/{summary.name}", 2: f"{parts[0]}/{PROJECT}/{parts[-1]}"}.get(len(parts), summary.name)
+        stacks[name] = summary.resource_count or 0
+    return stacks
+
+
+# stack_problems returns why the given layers can't be deployed to their
+# stacks: the monolithic stack still exists, or a stack they need is missing.
+# Missing stacks of the selected layers are created when create is set; the
+# layers they depend on must already be deployed.
+def stack_problems(org, stack, layers, stacks, create=False):
+    problems = []
+    monolithic = f"{org}/{PROJECT}/{stack}"
+    if monolithic in stacks:
+        problems.append(f"{monolithic} still exists with {stacks[monolithic]} resources; "
+                        f"move them into the per-layer stacks first (see deploy.py)")
+    needed = [*layers, *json.loads(partial_config(stack, layers, org)[f"{PROJECT}:layer_stacks"])]
+    for layer in needed:
+        name = layer_stack(org, stack, layer)
+        if name in stacks or (create and layer in layers):
+            continue
+        hint = "; pass --create-stacks to create it" if layer in layers else ", deploy that layer first"
+        problems.append(f"{name} does not exist{hint}")
+    return problems
+
+
+# AutomationRunner runs refresh and up on the per-layer stacks through the
+# Automation API. It needs the pulumi CLI and credentials for the backend.
+class AutomationRunner:
+    def __init__(self, stack, org, parallel=None, backend=None):
+        self.stack = stack
+        self.org = org
+        self.parallel = parallel
+        self.env_vars = {"PULUMI_BACKEND_URL": backend} if backend else {}
+        self.config = load_stack_config(stack)
+        self._lock = threading.Lock()
+
+    def check(self, layers, create):
+        return stack_problems(self.org, self.stack, layers, stack_resources(self.org, self.env_vars), create)
+
+    def _select(self, layer):
+        from pulumi import automation as auto
+
+        # Creating stacks and writing their settings files touches the shared
+        # workspace, so only do it one layer at a time.
+        with self._lock:
+            stack = auto.create_or_select_stack(
+                stack_name=layer_stack(self.org, self.stack, layer),
+                work_dir=HERE,
+                opts=auto.LocalWorkspaceOptions(env_vars=self.env_vars),
+            )
+            config = {**self.config, **partial_config(self.stack, [layer], self.org)}
+            stack.set_all_config({key: auto.ConfigValue(value=value) for key, value in config.items()})
+        return stack
+
+    def _output(self, layer):
+        return lambda line: print(f"[{layer}] {line}", end="" if line.endswith("\n") else "\n")
+
+    def refresh(self, layer):
+        result = self._select(layer).refresh(parallel=self.parallel, on_output=self._output(layer))
+        return result.summary.resource_changes or {}
+
+    def up(self, layer):
+        result = self._select(layer).up(parallel=self.parallel, on_output=self._output(layer))
+        return result.summary.resource_changes or {}
+
+
+# OfflineRunner evaluates each layer against the mocks in offline.py, in a
+# separate process per step, so the driver's scheduling and timing can be
+# checked without the pulumi CLI or cloud credentials. There is nothing to
+# refresh offline.
+class OfflineRunner:
+    def __init__(self, stack, org):
+        self.stack = stack
+        self.org = org
+
+    def check(self, layers, create):
+        return []
+
+    def refresh(self, layer):
+        return {}
+
+    def up(self, layer):
+        completed = subprocess.run(
+            [sys.executable, os.path.join(HERE, "offline.py"), "--stack", self.stack, "--layers", layer, "--json"],
+            cwd=HERE, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "offline evaluation failed")
+        return {"create": json.loads(completed.stdout)["resource_count"]}
+
+
+# plan returns the steps for each selected layer, in the order they appear in LAYERS.
+def plan(action, layers, skip_refresh):
+    steps = {}
+    for layer in layers:
+        if action == "refresh":
+            steps[layer] = ["refresh"]
+        elif layer in skip_refresh:
+            steps[layer] = ["up"]
+        else:
+            steps[layer] = ["refresh", "up"]
+    return steps
+
+
+# run_layers runs the steps of every layer, starting a layer once the selected
+# layers it depends on have finished. Layers that were not selected are
+# assumed to be deployed already. A failed layer skips the layers that need it.
+def run_layers(runner, steps, concurrency):
+    selected = list(steps)
+    pending = {layer: {dep for dep in DEPENDENCIES.get(layer, []) if dep in steps} for layer in selected}
+    records, failed, skipped = [], set(), set()
+    started = time.time()
+
+    def run(layer):
+        for action in steps[layer]:
+            record = {"layer": layer, "action": action, "start": round(time.time() - started, 3)}
+            records.append(record)
+            step_start = time.perf_counter()
+            try:
+                record["changes"] = getattr(runner, action)(layer)
+                record["status"] = "succeeded"
+            except Exception as e:
+                record["status"] = "failed"
+                record["error"] = str(e)
+                raise
+            finally:
+                record["seconds"] = round(time.perf_counter() - step_start, 3)
+
+    with ThreadPoolExecutor(max_workers=concurrency or len(selected) or 1) as pool:
+        running = {}
+        while pending or running:
+            blocked = [layer for layer, deps in pending.items() if deps & (failed | skipped)]
+            while blocked:
+                for layer in blocked:
+                    del pending[layer]
+                    skipped.add(layer)
+                blocked = [layer for layer, deps in pending.items() if deps & skipped]
+            for layer in [layer for layer, deps in pending.items() if not deps]:
+                del pending[layer]
+                running[pool.submit(run, layer)] = layer
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                layer = running.pop(future)
+                if future.exception():
+                    failed.add(layer)
+                    print(f"[{layer}] failed: {future.exception()}", file=sys.stderr)
+                    continue
+                for deps in pending.values():
+                    deps.discard(layer)
+
+    return {
+        "seconds": round(time.time() - started, 3),
+        "steps": sorted(records, key=lambda record: record["start"]),
+        "layers": {
+            layer: {
+                "status": "failed" if layer in failed else "skipped" if layer in skipped else "succeeded",
+                "seconds": round(sum(r["seconds"] for r in records if r["layer"] == layer), 3),
+            }
+            for layer in selected
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deploy the program layer by layer through the Automation API.")
+    parser.add_argument("action", choices=["up", "refresh"])
+    parser.add_argument("--stack", default="dev")
+    parser.add_argument("--org", default="organization", help="organization of the per-layer stacks")
+    parser.add_argument("--layers", help=f"comma-separated layers to deploy (default: all of {','.join(LAYERS)})")
+    parser.add_argument("--parallel", type=int, help="resource operations each step runs in parallel")
+    parser.add_argument("--concurrency", type=int, help="layers deployed at the same time (default: no limit)")
+    parser.add_argument("--backend", help="backend URL, e.g. file://~/.pulumi-state")
+    parser.add_argument("--refresh-all", action="store_true", help="refresh immutable layers too")
+    parser.add_argument("--create-stacks", action="store_true", help="create per-layer stacks that don't exist yet")
+    parser.add_argument("--offline", action="store_true", help="evaluate each step against mocks instead of deploying")
+    parser.add_argument("--summary", default=SUMMARY_PATH, help="where to write the per-step timing summary")
+    args = parser.parse_args(argv)
+
+    deploy_config = json.loads(load_stack_config(args.stack).get(f"{PROJECT}:deploy", "{}"))
+    layers = args.layers.split(",") if args.layers else LAYERS
+    unknown = set(layers) - set(LAYERS)
+    if unknown:
+        parser.error(f"unknown layers {sorted(unknown)}; expected some of {LAYERS}")
+    layers = [layer for layer in LAYERS if layer in layers]
+    skip_refresh = [] if args.refresh_all else deploy_config.get("skip_refresh", IMMUTABLE_LAYERS)
+    parallel = args.parallel or deploy_config.get("parallel")
+    concurrency = args.concurrency or deploy_config.get("concurrency")
+
+    if args.offline:
+        runner = OfflineRunner(args.stack, args.org)
+    else:
+        runner = AutomationRunner(args.stack, args.org, parallel, args.backend)
+    problems = runner.check(layers, args.create_stacks and args.action == "up")
+    if problems:
+        for problem in problems:
+            print(f"error: {problem}", file=sys.stderr)
+        return 1
+
+    summary = run_layers(runner, plan(args.action, layers, skip_refresh), concurrency)
+    summary.update(action=args.action, stack=args.stack, parallel=parallel, offline=args.offline)
+    with open(args.summary, "w") as f:
+        json.dump(summary, f, indent=2)
+        f.write("\n")
+
+    for layer, stats in summary["layers"].items():
+        print(f"  {layer:<12} {stats['status']:<10} {stats['seconds']:>8.2f}s")
+    print(f"{args.action} finished in {summary['seconds']:.2f}s; summary written to {args.summary}")
+    return 0 if all(stats["status"] == "succeeded" for stats in summary["layers"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
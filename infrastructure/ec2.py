@@ -1,31 +1,38 @@
 import pulumi
 import json
 import pulumi_aws as aws
-from network import public_subnet_a, vpc, private_zone
-from k8s import secret_version
+import invoke_cache
+from layers import Layer, local_layers
+from pg_tuning import tuning_profile
 
 # Load Pulumi configuration and needed variables
 config = pulumi.Config()
 git_repo_url = config.require("git_repo_url")
 s3_bucket_name = config.require("s3_bucket")
 vpc_cidr_block = config.require_object("vpc")["cidr_block"]
+pod_cidr_block = config.require_object("vpc").get("pod_cidr_block")
 internal_domain = config.require("internal_domain")
 db_instance_name = config.require("db_instance")
 web_app_config = config.require_object("web_app")
+db_replicas_config = config.get_object("db_replicas") or {}
+database_config = config.get_object("database") or {}
 
-# Get AWS caller identity
-caller_identity = aws.get_caller_identity()
+# Devices the dedicated data and WAL volumes are attached as. Amazon Linux
+# links them to their NVMe devices.
+VOLUME_DEVICES = {"data": "/dev/sdf", "wal": "/dev/sdg"}
 
-# AMI Lookup
-ami = aws.ec2.get_ami(
-    most_recent=True,
-    owners=["amazon"],
-    filters=[{"name": "name", "values": ["al2023-ami-2023*-x86_64"]}]
-)
+# Trust policy for the role Data Lifecycle Manager snapshots the db with
+DLM_ASSUME_ROLE_POLICY = json.dumps({
+    "Version": "2012-10-17",
+    "Statement": [{
+        "Effect": "Allow",
+        "Principal": {"Service": "dlm.amazonaws.com"},
+        "Action": "sts:AssumeRole",
+    }],
+})
 
-# Create an IAM Role for EC2
-role = aws.iam.Role("ec2InstanceRole",
-    assume_role_policy="""{
+# Trust policy for the db instance role
+EC2_ASSUME_ROLE_POLICY = """{
         "Version": "2012-10-17",
         "Statement": [
             {
@@ -37,110 +44,80 @@ role = aws.iam.Role("ec2InstanceRole",
             }
         ]
     }"""
-)
 
-# Create an IAM Policy that grants necessary permissions to db instance
-policy_object = {
-    "Version": "2012-10-17",
-    "Statement": [
-        {
-            "Effect": "Allow",
-            "Action": "ec2:*",
-            "Resource": "*"
-        },
-        {
-            "Effect": "Allow",
-            "Action": "s3:PutObject",
-            "Resource": f"arn:aws:s3:::{s3_bucket_name}/*"
-        },
-        {
-            "Effect": "Allow",
-            "Action": "s3:ListBucket",
-            "Resource": f"arn:aws:s3:::{s3_bucket_name}"
-        },
-        {
-            "Effect": "Allow",
-            "Action": "secretsmanager:GetSecretValue",
-            "Resource": f"arn:aws:secretsmanager:{aws.config.region}:{caller_identity.account_id}:secret:{web_app_config.get("name")}*"
-        }
-    ]
-}
-
-policy = aws.iam.Policy("db-instance-extra-perms",
-    description="Policy that allows instance to access S3 bucket for backups, needed secrets and all ec2",
-    policy=json.dumps(policy_object)
-)
-
-# Attach the policy to the role
-role_policy_attachment = aws.iam.RolePolicyAttachment("db-instance-extra-perms-rpa",
-    role=role.name,
-    policy_arn=policy.arn
-)
-
-# Create instance profile
-instance_profile = aws.iam.InstanceProfile("ec2-instance-profile",
-    role=role.name
-)
-
-# Security Group for db-instance
-db_instance_sg = aws.ec2.SecurityGroup(
-    "db-instance-sg",
-    vpc_id=vpc.id,
-    description="Security Group for db-instance",
-    egress=[
-        {
-            "protocol": "-1",  # This allows all protocols
-            "from_port": 0,    # Start of the port range
-            "to_port": 0,      # End of the port range
-            "cidr_blocks": ["0.0.0.0/0"]  # Allow all outbound traffic
-        }
-    ]
-)
-
-# Allow port 22 from anywhere
-aws.ec2.SecurityGroupRule(
-    "db-instance-ssh",
-    type="ingress",
-    from_port=22,
-    to_port=22,
-    protocol="tcp",
-    security_group_id=db_instance_sg.id,
-    cidr_blocks=["0.0.0.0/0"]
-)
-
-# Allow port 5432 from within the VPC
-aws.ec2.SecurityGroupRule(
-    "db-instance-postgres",
-    type="ingress",
-    from_port=5432,
-    to_port=5432,
-    protocol="tcp",
-    security_group_id=db_instance_sg.id,
-    cidr_blocks=[vpc.cidr_block]
-)
-
-# user_data Script
-user_data_script = f"""#!/bin/bash
-# Update packages and install Ansible
-yum update -y
-yum install -y ansible git
 
-# Fetch Ansible playbook from configured repo
-git clone {git_repo_url} /tmp/wiz-stack
+# Where the db instances keep their checkout of git_repo_url and the
+# dynamic-vars.yml the bootstrap renders. Not /tmp, which Amazon Linux 2023
+# mounts as tmpfs: a stop/start would leave the SSM associations without
+# playbooks.
+REPO_DIR = "/opt/wiz-stack"
 
-# CD and create dynamic vars file
-cd /tmp/wiz-stack/playbooks
-cat <<EOF > dynamic-vars.yml
----
-s3_bucket_name: {s3_bucket_name}
+
+# primary_vars returns the dynamic-vars.yml of the primary. With dedicated
+# volumes they name the devices postgres-storage.yml moves postgres onto; a
+# wal_archive config makes postgres-wal-archive.yml archive to the bucket.
+def primary_vars(tuning, volumes=False, wal_archive=None, restored_from=None):
+    extra_vars = {f"postgres_{name}_device": device for name, device in VOLUME_DEVICES.items()} if volumes else {}
+    if restored_from:
+        extra_vars["restored_from"] = restored_from
+    if wal_archive:
+        extra_vars.update(wal_archive=wal_archive)
+    extra_vars.update(backup_vars(wal_archive))
+    extra_vars = "".join(f"{name}: {json.dumps(value)}\n" for name, value in extra_vars.items())
+    return f"""s3_bucket_name: {s3_bucket_name}
 vpc_cidr: {vpc_cidr_block}
 postgres_secret_name: {web_app_config.get("postgres_secret")}
 aws_region: {aws.config.region}
-EOF
+postgres_tuning: {json.dumps(tuning)}
+{extra_vars}"""
+
+
+# replica_vars returns the dynamic-vars.yml of a read replica.
+def replica_vars(tuning):
+    return f"""vpc_cidr: {vpc_cidr_block}
+postgres_secret_name: {web_app_config.get("postgres_secret")}
+postgres_primary_host: {db_instance_name}.{internal_domain}
+aws_region: {aws.config.region}
+postgres_tuning: {json.dumps(tuning)}
+"""
+
+
+# checkout_commands clones git_repo_url into REPO_DIR (or updates the clone)
+# and renders dynamic-vars.yml when it is missing, so the playbooks can run
+# whether or not the instance still has its first boot's checkout.
+def checkout_commands(dynamic_vars):
+    return f"""[ -d {REPO_DIR}/.git ] || git clone {git_repo_url} {REPO_DIR}
+cd {REPO_DIR} && git pull
+cd {REPO_DIR}/playbooks
+[ -f dynamic-vars.yml ] || cat <<EOF > dynamic-vars.yml
+---
+{dynamic_vars}EOF"""
+
+
+# user_data Script. With dedicated volumes, postgres-storage.yml moves the
+# freshly initialized database onto them; with a wal_archive config,
+# postgres-wal-archive.yml starts archiving to the backup bucket.
+def user_data_script(tuning, volumes=False, wal_archive=None, restored_from=None):
+    dynamic_vars = primary_vars(tuning, volumes, wal_archive, restored_from)
+    storage = """
+# Move PGDATA and pg_wal onto the dedicated volumes
+ansible-playbook -e @dynamic-vars.yml postgres-storage.yml
+""" if volumes else ""
+    archive = """
+# Archive WAL and base backups to S3
+ansible-playbook -e @dynamic-vars.yml postgres-wal-archive.yml
+""" if wal_archive else ""
+    return f"""#!/bin/bash
+# Update packages and install Ansible
+yum update -y
+yum install -y ansible git
+
+# Fetch Ansible playbook from configured repo and create dynamic vars file
+{checkout_commands(dynamic_vars)}
 
 # Install postgres and other needed packages
 ansible-playbook -e @dynamic-vars.yml install-packages.yml
-
+{storage}
 # Install community.postgresql ansible collection
 ansible-galaxy collection install community.postgresql
 
@@ -149,35 +126,538 @@ ansible-playbook -e @dynamic-vars.yml s3-backup.yml
 
 # Setup postgres access rules and users
 ansible-playbook -e @dynamic-vars.yml postgres-access.yml
+{archive}
+# Size postgres for the instance
+ansible-playbook -e @dynamic-vars.yml postgres-tuning.yml
+"""
+
+
+# user_data Script for read replicas, which clone the primary instead of
+# setting up their own database, users and backups
+def replica_user_data_script(tuning):
+    return f"""#!/bin/bash
+# Update packages and install Ansible
+yum update -y
+yum install -y ansible git
+
+# Fetch Ansible playbook from configured repo and create dynamic vars file
+{checkout_commands(replica_vars(tuning))}
+
+# Install postgres and other needed packages
+ansible-playbook -e @dynamic-vars.yml install-packages.yml
+
+# Install community.postgresql ansible collection
+ansible-galaxy collection install community.postgresql
+
+# Replace the local database with a streaming copy of the primary
+ansible-playbook -e @dynamic-vars.yml -e postgres_role=replica postgres-replication.yml
+
+# Size postgres for the instance
+ansible-playbook -e @dynamic-vars.yml postgres-tuning.yml
 """
 
-db_instance = aws.ec2.Instance(
-    db_instance_name,
-    ami=ami.id,
-    instance_type="t3.medium",
-    root_block_device={
-        "volume_size": 20,  # Size in GiB
-        "volume_type": "gp2",  # General Purpose SSD
-        "delete_on_termination": True,  # Automatically delete the volume on instance termination
-    },
-    subnet_id=public_subnet_a.id,
-    vpc_security_group_ids=[db_instance_sg.id],
-    iam_instance_profile=instance_profile.name,
-    key_name="my-mbp",
-    user_data=user_data_script,
-    tags={"Name": "db-instance"},
-    opts=pulumi.ResourceOptions(depends_on=secret_version)
-)
-
-# Add an A record to the wiz.internal zone for this instance
-dns_record = aws.route53.Record("myInstanceRecord",
-    zone_id=private_zone.id,
-    name=f"{db_instance_name}.{internal_domain}",
-    type="A",
-    ttl=60,
-    records=[db_instance.private_ip],  # Use the instance's private IP
-    opts=pulumi.ResourceOptions(depends_on=[db_instance]),
-)
-
-pulumi.export("db_instance_public_dns", db_instance.public_dns)
-# pulumi.export("user-data", user_data_script)
\ No newline at end of file
+
+# playbook_commands returns the commands that run a playbook on an existing
+# db instance through SSM, after its bootstrap is done. extra_vars are part of
+# the association's parameters, so changing them runs the playbook again;
+# user_data only runs on first boot, and dynamic_vars (the instance's
+# dynamic-vars.yml) are only rendered again when the file is missing.
+def playbook_commands(dynamic_vars, playbook, extra_vars=None):
+    extra = f" -e '{json.dumps(extra_vars)}'" if extra_vars else ""
+    return f"""cloud-init status --wait
+{checkout_commands(dynamic_vars)}
+ansible-playbook -e @dynamic-vars.yml{extra} {playbook}"""
+
+
+# tuning_commands re-applies a tuning profile, so changing the instance type
+# tunes the resized instance.
+def tuning_commands(dynamic_vars, tuning):
+    return playbook_commands(dynamic_vars, "postgres-tuning.yml", {"postgres_tuning": tuning})
+
+
+# storage_commands moves postgres onto the dedicated volumes of an existing
+# instance and grows their filesystems. The volume sizes are part of the
+# commands, so resizing a volume runs them again.
+def storage_commands(dynamic_vars, sizes):
+    extra_vars = {f"postgres_{name}_device": device for name, device in VOLUME_DEVICES.items()}
+    extra_vars["postgres_volume_sizes"] = dict(zip(VOLUME_DEVICES, sizes))
+    return playbook_commands(dynamic_vars, "postgres-storage.yml", extra_vars)
+
+
+# backup_vars returns the s3-backup.yml settings: the dump format
+# (database.backup_format, plain unless directory is opted into) and, with
+# WAL archiving, the hours of the logical dumps. Point-in-time recovery then
+# comes from the archive, so they only need to run once a day.
+def backup_vars(wal_archive=None):
+    settings = {"backup_format": database_config.get("backup_format", "plain")}
+    if wal_archive:
+        settings["backup_hours"] = str(wal_archive.get("logical_backup_hours", "14"))
+    return settings
+
+
+class DatabaseLayer(Layer):
+    def __init__(self, name, network, db_secret, opts=None):
+        super().__init__("database", name, opts)
+
+        # Postgres runs either on a self-managed EC2 instance or on Aurora
+        # Serverless v2. Both answer on the internal host names the db secret
+        # points at, so the secret and everything reading it stay the same.
+        if database_config.get("engine", "ec2") == "aurora":
+            outputs = self._aurora(network, db_secret)
+        else:
+            outputs = self._ec2(network, db_secret)
+        self.export(**outputs)
+
+    # _ec2 runs Postgres on db_instance (and optional streaming replicas),
+    # bootstrapped by the playbooks.
+    def _ec2(self, network, db_secret):
+        # Get AWS account id
+        account_id = invoke_cache.account_id()
+
+        # AMI Lookup
+        ami_id = invoke_cache.ami_id("al2023-ami-2023*-x86_64")
+
+        # Create an IAM Role for EC2
+        role = aws.iam.Role("ec2InstanceRole",
+            assume_role_policy=EC2_ASSUME_ROLE_POLICY,
+            opts=self.child_opts()
+        )
+
+        # Create an IAM Policy that grants necessary permissions to db instance
+        policy_object = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Action": "ec2:*",
+                    "Resource": "*"
+                },
+                {
+                    "Effect": "Allow",
+                    "Action": ["s3:PutObject", "s3:AbortMultipartUpload"],
+                    "Resource": f"arn:aws:s3:::{s3_bucket_name}/*"
+                },
+                {
+                    "Effect": "Allow",
+                    "Action": "s3:ListBucket",
+                    "Resource": f"arn:aws:s3:::{s3_bucket_name}"
+                },
+                {
+                    # wal-g reads the archive back for restores and prunes it
+                    "Effect": "Allow",
+                    "Action": ["s3:GetObject", "s3:DeleteObject"],
+                    "Resource": f"arn:aws:s3:::{s3_bucket_name}/wal-g/*"
+                },
+                {
+                    "Effect": "Allow",
+                    "Action": "secretsmanager:GetSecretValue",
+                    "Resource": f"arn:aws:secretsmanager:{aws.config.region}:{account_id}:secret:{web_app_config.get("name")}*"
+                },
+                {
+                    "Effect": "Allow",
+                    "Action": "cloudwatch:PutMetricData",
+                    "Resource": "*",
+                    "Condition": {"StringEquals": {"cloudwatch:namespace": "PostgresBackups"}}
+                }
+            ]
+        }
+
+        policy = aws.iam.Policy("db-instance-extra-perms",
+            description="Policy that allows instance to access S3 bucket for backups, needed secrets and all ec2",
+            policy=json.dumps(policy_object),
+            opts=self.child_opts()
+        )
+
+        # Attach the policy to the role
+        role_policy_attachment = aws.iam.RolePolicyAttachment("db-instance-extra-perms-rpa",
+            role=role.name,
+            policy_arn=policy.arn,
+            opts=self.child_opts()
+        )
+
+        # Create instance profile
+        instance_profile = aws.iam.InstanceProfile("ec2-instance-profile",
+            role=role.name,
+            opts=self.child_opts()
+        )
+
+        # Security Group for db-instance
+        db_instance_sg = aws.ec2.SecurityGroup(
+            "db-instance-sg",
+            vpc_id=network.vpc_id,
+            description="Security Group for db-instance",
+            egress=[
+                {
+                    "protocol": "-1",  # This allows all protocols
+                    "from_port": 0,    # Start of the port range
+                    "to_port": 0,      # End of the port range
+                    "cidr_blocks": ["0.0.0.0/0"]  # Allow all outbound traffic
+                }
+            ],
+            opts=self.child_opts()
+        )
+
+        # Allow port 22 from anywhere
+        aws.ec2.SecurityGroupRule(
+            "db-instance-ssh",
+            type="ingress",
+            from_port=22,
+            to_port=22,
+            protocol="tcp",
+            security_group_id=db_instance_sg.id,
+            cidr_blocks=["0.0.0.0/0"],
+            opts=self.child_opts()
+        )
+
+        # Allow port 5432 from within the VPC
+        aws.ec2.SecurityGroupRule(
+            "db-instance-postgres",
+            type="ingress",
+            from_port=5432,
+            to_port=5432,
+            protocol="tcp",
+            security_group_id=db_instance_sg.id,
+            cidr_blocks=network.vpc_cidr_blocks,
+            opts=self.child_opts()
+        )
+
+        # Dedicated gp3 volumes for PGDATA and pg_wal, sized from config:
+        #   volumes: {data: {size: 50, iops: 3000, throughput: 125}, wal: {...}}
+        # Without them postgres stays on the root volume.
+        volumes_config = database_config.get("volumes") or {}
+
+        # WAL archiving and base backups with wal-g, e.g.
+        #   wal_archive: {base_backup_hours: "3", delta_max_steps: 6, retain_full: 2}
+        # Restore with pitr.py.
+        wal_archive_config = database_config.get("wal_archive") or {}
+
+        # Scheduled EBS snapshots of the instance's volumes, e.g.
+        #   snapshots: {interval_hours: 12, time: "03:00", retain: 14, fast_restore: true}
+        # rebuild_db.py rebuilds the instance from the latest ones by setting
+        #   restore: {timestamp: ..., data: snap-..., wal: snap-...}  (dedicated volumes)
+        #   restore: {timestamp: ..., ami: ami-...}                   (root volume only)
+        # Leave restore set afterwards: removing it would rebuild the instance
+        # again, from empty volumes.
+        snapshots_config = database_config.get("snapshots") or {}
+        restore_config = database_config.get("restore") or {}
+
+        # Postgres settings for the instance and volume type (see pg_tuning.py)
+        instance_type = database_config.get("instance_type", "t3.medium")
+        volume_type = "gp3" if volumes_config else "gp2"
+        tuning = tuning_profile(instance_type, volume_type, database_config.get("max_connections", 100))
+
+        root_block_device = {
+            "volume_size": 20,  # Size in GiB
+            "volume_type": "gp2",  # General Purpose SSD
+            "delete_on_termination": True,  # Automatically delete the volume on instance termination
+        }
+        if snapshots_config:
+            # Lets rebuild_db.py tell the snapshots of an instance apart
+            root_block_device["tags"] = {"Name": f"{db_instance_name}-root"}
+        # A restore replaces the instance (the new user_data marks it), so it
+        # boots from the restored root volume or mounts the restored ones.
+        restore_opts = {"user_data_replace_on_change": True} if restore_config else {}
+        dynamic_vars = primary_vars(tuning, volumes=bool(volumes_config), wal_archive=wal_archive_config,
+                                    restored_from=restore_config.get("timestamp"))
+        db_instance = aws.ec2.Instance(
+            db_instance_name,
+            ami=restore_config.get("ami", ami_id),
+            instance_type=instance_type,
+            root_block_device=root_block_device,
+            subnet_id=network.public_subnet_ids[0],
+            vpc_security_group_ids=[db_instance_sg.id],
+            iam_instance_profile=instance_profile.name,
+            key_name="my-mbp",
+            user_data=user_data_script(tuning, volumes=bool(volumes_config), wal_archive=wal_archive_config,
+                                       restored_from=restore_config.get("timestamp")),
+            # rebuild_db.py and pitr.py find the instance by this tag
+            tags={"Name": db_instance_name},
+            # The bootstrap reads the credentials from Secrets Manager, so wait for
+            # them when the secret is managed in this stack.
+            opts=self.child_opts(depends_on=local_layers(db_secret)),
+            **restore_opts
+        )
+
+        # Add an A record to the wiz.internal zone for this instance
+        dns_record = aws.route53.Record("myInstanceRecord",
+            zone_id=network.private_zone_id,
+            name=f"{db_instance_name}.{internal_domain}",
+            type="A",
+            ttl=60,
+            records=[db_instance.private_ip],  # Use the instance's private IP
+            opts=self.child_opts()
+        )
+
+        # Let SSM run playbooks on the db instances after their first boot
+        aws.iam.RolePolicyAttachment("db-instance-ssm-managed",
+            role=role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore",
+            opts=self.child_opts()
+        )
+
+        aws.ssm.Association("db-instance-tuning",
+            name="AWS-RunShellScript",
+            targets=[{"key": "InstanceIds", "values": [db_instance.id]}],
+            parameters={"commands": tuning_commands(dynamic_vars, tuning)},
+            opts=self.child_opts()
+        )
+
+        aws.ssm.Association("db-instance-backups",
+            name="AWS-RunShellScript",
+            targets=[{"key": "InstanceIds", "values": [db_instance.id]}],
+            parameters={"commands": playbook_commands(dynamic_vars, "s3-backup.yml", backup_vars(wal_archive_config))},
+            opts=self.child_opts()
+        )
+
+        # Pods on the VPC's secondary CIDR (vpc.pod_cidr_block) connect from
+        # outside vpc_cidr, the only range pg_hba.conf lets in otherwise
+        if pod_cidr_block:
+            aws.ssm.Association("db-instance-pod-access",
+                name="AWS-RunShellScript",
+                targets=[{"key": "InstanceIds", "values": [db_instance.id]}],
+                parameters={"commands": playbook_commands(dynamic_vars, "postgres-access.yml", {"pod_cidr": pod_cidr_block})},
+                opts=self.child_opts()
+            )
+
+        if wal_archive_config:
+            aws.ssm.Association("db-instance-wal-archive",
+                name="AWS-RunShellScript",
+                targets=[{"key": "InstanceIds", "values": [db_instance.id]}],
+                parameters={"commands": playbook_commands(dynamic_vars, "postgres-wal-archive.yml", {"wal_archive": wal_archive_config})},
+                opts=self.child_opts()
+            )
+
+        if volumes_config:
+            volumes = {}
+            attachments = []
+            for name, device in VOLUME_DEVICES.items():
+                volume_config = volumes_config.get(name) or {}
+                restore_snapshot = {"snapshot_id": restore_config[name]} if name in restore_config else {}
+                volumes[name] = aws.ebs.Volume(f"{db_instance_name}-{name}",
+                    availability_zone=db_instance.availability_zone,
+                    **restore_snapshot,
+                    type="gp3",
+                    size=volume_config.get("size", 50 if name == "data" else 20),
+                    iops=volume_config.get("iops", 3000),
+                    throughput=volume_config.get("throughput", 125),
+                    tags={"Name": f"{db_instance_name}-{name}"},
+                    opts=self.child_opts()
+                )
+                attachments.append(aws.ec2.VolumeAttachment(f"{db_instance_name}-{name}-attachment",
+                    device_name=device,
+                    volume_id=volumes[name].id,
+                    instance_id=db_instance.id,
+                    opts=self.child_opts()
+                ))
+
+            aws.ssm.Association("db-instance-storage",
+                name="AWS-RunShellScript",
+                targets=[{"key": "InstanceIds", "values": [db_instance.id]}],
+                parameters={"commands": pulumi.Output.all(*[volume.size for volume in volumes.values()]).apply(
+                    lambda sizes: storage_commands(dynamic_vars, sizes))},
+                opts=self.child_opts(depends_on=attachments)
+            )
+
+        if snapshots_config:
+            dlm_role = aws.iam.Role("db-snapshots-role",
+                assume_role_policy=DLM_ASSUME_ROLE_POLICY,
+                opts=self.child_opts()
+            )
+            aws.iam.RolePolicyAttachment("db-snapshots-role-policy",
+                role=dlm_role.name,
+                policy_arn="arn:aws:iam::aws:policy/service-role/AWSDataLifecycleManagerServiceRole",
+                opts=self.child_opts()
+            )
+
+            # Targets the instance rather than its data volume: DLM then
+            # snapshots all of its volumes at the same moment, so data and WAL
+            # are crash-consistent with each other and postgres recovers from
+            # them like from a power loss.
+            schedule = {
+                "name": f"{db_instance_name} every {snapshots_config.get('interval_hours', 24)}h",
+                "create_rule": {
+                    "interval": snapshots_config.get("interval_hours", 24),
+                    "interval_unit": "HOURS",
+                    "times": snapshots_config.get("time", "03:00"),
+                },
+                "retain_rule": {"count": snapshots_config.get("retain", 7)},
+                "copy_tags": True,
+                "tags_to_add": {"SnapshotOf": db_instance_name},
+                "variable_tags": {"timestamp": "$(timestamp)"},
+            }
+            if snapshots_config.get("fast_restore"):
+                # Volumes created from the newest snapshots come up at full
+                # performance instead of loading blocks from S3 on first read.
+                schedule["fast_restore_rule"] = {
+                    "availability_zones": [db_instance.availability_zone],
+                    "count": snapshots_config.get("fast_restore_count", 1),
+                }
+            aws.dlm.LifecyclePolicy("db-snapshots",
+                description=f"Snapshots of {db_instance_name}",
+                execution_role_arn=dlm_role.arn,
+                state="ENABLED",
+                policy_details={
+                    "resource_types": ["INSTANCE"],
+                    "target_tags": {"Name": db_instance_name},
+                    # With dedicated volumes the root volume holds no data
+                    "parameters": {"exclude_boot_volume": bool(volumes_config)},
+                    "schedules": [schedule],
+                },
+                opts=self.child_opts()
+            )
+
+        # Read replicas. The primary is in the first public subnet, so replica
+        # i goes into subnet i + 1, wrapping around: with n zones, the first
+        # n - 1 replicas each get a zone of their own, away from the primary's.
+        replica_count = db_replicas_config.get("count", 0)
+        read_host = dns_record.fqdn
+        if replica_count:
+            replica_type = db_replicas_config.get("instance_type", instance_type)
+            replica_tuning = tuning_profile(replica_type, "gp2", tuning["max_connections"], primary=tuning)
+
+            # Waits for the playbook to succeed, so the replicas' associations
+            # below only run once the primary streams WAL
+            primary_replication = aws.ssm.Association("db-instance-replication",
+                name="AWS-RunShellScript",
+                targets=[{"key": "InstanceIds", "values": [db_instance.id]}],
+                parameters={"commands": playbook_commands(dynamic_vars, "postgres-replication.yml", {"postgres_role": "primary"})},
+                wait_for_success_timeout_seconds=1800,
+                opts=self.child_opts()
+            )
+
+            replicas = []
+            for index in range(replica_count):
+                replicas.append(aws.ec2.Instance(
+                    f"{db_instance_name}-replica-{index + 1}",
+                    ami=ami_id,
+                    instance_type=replica_type,
+                    root_block_device={
+                        "volume_size": 20,
+                        "volume_type": "gp2",
+                        "delete_on_termination": True,
+                    },
+                    subnet_id=pulumi.Output.from_input(network.public_subnet_ids).apply(
+                        lambda subnet_ids, index=index: subnet_ids[(index + 1) % len(subnet_ids)]
+                    ),
+                    vpc_security_group_ids=[db_instance_sg.id],
+                    iam_instance_profile=instance_profile.name,
+                    key_name="my-mbp",
+                    user_data=replica_user_data_script(replica_tuning),
+                    tags={"Name": f"{db_instance_name}-replica-{index + 1}"},
+                    opts=self.child_opts(depends_on=local_layers(db_secret))
+                ))
+
+                aws.ssm.Association(f"{db_instance_name}-replica-{index + 1}-tuning",
+                    name="AWS-RunShellScript",
+                    targets=[{"key": "InstanceIds", "values": [replicas[-1].id]}],
+                    parameters={"commands": tuning_commands(replica_vars(replica_tuning), replica_tuning)},
+                    opts=self.child_opts(depends_on=[primary_replication])
+                )
+
+            # One record for all replicas; clients spread over them by DNS
+            read_record = aws.route53.Record("myReplicaRecord",
+                zone_id=network.private_zone_id,
+                name=f"{db_instance_name}-ro.{internal_domain}",
+                type="A",
+                ttl=60,
+                records=[replica.private_ip for replica in replicas],
+                opts=self.child_opts()
+            )
+            read_host = read_record.fqdn
+
+        return dict(
+            db_instance_public_dns=db_instance.public_dns,
+            db_host=dns_record.fqdn,
+            db_read_host=read_host,
+        )
+
+    # _aurora runs Postgres on an Aurora Serverless v2 cluster with a writer
+    # and `readers` reader instances that scale between min_acu and max_acu.
+    # The cluster takes its credentials from the db secret, and CNAMEs keep
+    # the secret's host (and the replicas' read host) pointing at it.
+    def _aurora(self, network, db_secret):
+        aurora_config = database_config.get("aurora", {})
+
+        # Read the credentials from the version the secret tier wrote
+        credentials = aws.secretsmanager.get_secret_version_output(
+            secret_id=db_secret.secret_arn,
+            version_id=db_secret.secret_version_id
+        ).secret_string.apply(json.loads)
+
+        subnet_group = aws.rds.SubnetGroup("aurora-subnet-group",
+            subnet_ids=network.private_subnet_ids,
+            opts=self.child_opts()
+        )
+
+        # Security Group for the cluster, allowing port 5432 from within the VPC
+        aurora_sg = aws.ec2.SecurityGroup(
+            "aurora-sg",
+            vpc_id=network.vpc_id,
+            description="Security Group for the Aurora cluster",
+            ingress=[{
+                "protocol": "tcp",
+                "from_port": 5432,
+                "to_port": 5432,
+                "cidr_blocks": network.vpc_cidr_blocks
+            }],
+            opts=self.child_opts()
+        )
+
+        cluster = aws.rds.Cluster("aurora-cluster",
+            engine="aurora-postgresql",
+            engine_mode="provisioned",
+            engine_version=aurora_config.get("engine_version", "15.4"),
+            database_name=credentials["db"],
+            master_username=credentials["username"],
+            master_password=pulumi.Output.secret(credentials["password"]),
+            port=5432,
+            db_subnet_group_name=subnet_group.name,
+            vpc_security_group_ids=[aurora_sg.id],
+            storage_encrypted=True,
+            serverlessv2_scaling_configuration={
+                "min_capacity": aurora_config.get("min_acu", 0.5),
+                "max_capacity": aurora_config.get("max_acu", 4),
+            },
+            backup_retention_period=aurora_config.get("backup_retention_days", 7),
+            skip_final_snapshot=aurora_config.get("skip_final_snapshot", True),
+            opts=self.child_opts()
+        )
+
+        instances = []
+        for index in range(1 + aurora_config.get("readers", 1)):
+            instances.append(aws.rds.ClusterInstance(
+                "aurora-writer" if index == 0 else f"aurora-reader-{index}",
+                cluster_identifier=cluster.id,
+                instance_class="db.serverless",
+                engine=cluster.engine,
+                engine_version=cluster.engine_version,
+                db_subnet_group_name=subnet_group.name,
+                # The writer fails over to readers in the first promotion tier
+                promotion_tier=0 if index == 0 else 1,
+                opts=self.child_opts()
+            ))
+
+        # The secret's host, now served by the cluster's writer endpoint
+        dns_record = aws.route53.Record("myInstanceRecord",
+            zone_id=network.private_zone_id,
+            name=f"{db_instance_name}.{internal_domain}",
+            type="CNAME",
+            ttl=60,
+            records=[cluster.endpoint],
+            opts=self.child_opts()
+        )
+
+        read_record = aws.route53.Record("myReplicaRecord",
+            zone_id=network.private_zone_id,
+            name=f"{db_instance_name}-ro.{internal_domain}",
+            type="CNAME",
+            ttl=60,
+            records=[cluster.reader_endpoint],
+            opts=self.child_opts(depends_on=instances)
+        )
+
+        return dict(
+            db_instance_public_dns=None,
+            db_host=dns_record.fqdn,
+            db_read_host=read_record.fqdn,
+        )
@@ -1,24 +1,8 @@
-import pulumi
 import pulumi_aws as aws
-
-# Create an ECR repository
-ecr_repository = aws.ecr.Repository(
-    "ultratic-redux",
-    image_tag_mutability="MUTABLE",  # Optional: Specify "IMMUTABLE" for immutable tags
-    image_scanning_configuration=aws.ecr.RepositoryImageScanningConfigurationArgs(
-        scan_on_push=True,  # Enable image scanning on push
-    ),
-    force_delete=True,
-    tags={
-        "Environment": "Development", 
-    }
-)
+from layers import Layer
 
 # Lifecycle policy to get rid of old images
-lifecycle_policy = aws.ecr.LifecyclePolicy(
-    "ecr-lifecycle-policy",
-    repository=ecr_repository.name,
-    policy="""{
+LIFECYCLE_POLICY = """{
         "rules": [
             {
                 "rulePriority": 1,
@@ -34,29 +18,56 @@ lifecycle_policy = aws.ecr.LifecyclePolicy(
             }
         ]
     }"""
-)
 
-# Apply the lifecycle policy
-# repository_policy = aws.ecr.RepositoryPolicy(
-#     "ecr-repository-policy",
-#     repository=ecr_repository.name,
-#     policy="""{
-#         "Version": "2012-10-17",
-#         "Statement": [
-#             {
-#                 "Effect": "Allow",
-#                 "Principal": {
-#                     "AWS": "arn:aws:iam::123456789012:role/MyRole"
-#                 },
-#                 "Action": [
-#                     "ecr:GetDownloadUrlForLayer",
-#                     "ecr:BatchGetImage",
-#                     "ecr:BatchCheckLayerAvailability"
-#                 ]
-#             }
-#         ]
-#     }"""
-# )
 
-# Export the ECR repository URL
-pulumi.export("ecr repo url", ecr_repository.repository_url)
\ No newline at end of file
+class EcrLayer(Layer):
+    def __init__(self, name, opts=None):
+        super().__init__("ecr", name, opts)
+
+        # Create an ECR repository
+        ecr_repository = aws.ecr.Repository(
+            "ultratic-redux",
+            image_tag_mutability="MUTABLE",  # Optional: Specify "IMMUTABLE" for immutable tags
+            image_scanning_configuration=aws.ecr.RepositoryImageScanningConfigurationArgs(
+                scan_on_push=True,  # Enable image scanning on push
+            ),
+            force_delete=True,
+            tags={
+                "Environment": "Development",
+            },
+            opts=self.child_opts()
+        )
+
+        # Expire old untagged images
+        lifecycle_policy = aws.ecr.LifecyclePolicy(
+            "ecr-lifecycle-policy",
+            repository=ecr_repository.name,
+            policy=LIFECYCLE_POLICY,
+            opts=self.child_opts()
+        )
+
+        # Apply the lifecycle policy
+        # repository_policy = aws.ecr.RepositoryPolicy(
+        #     "ecr-repository-policy",
+        #     repository=ecr_repository.name,
+        #     policy="""{
+        #         "Version": "2012-10-17",
+        #         "Statement": [
+        #             {
+        #                 "Effect": "Allow",
+        #                 "Principal": {
+        #                     "AWS": "arn:aws:iam::123456789012:role/MyRole"
+        #                 },
+        #                 "Action": [
+        #                     "ecr:GetDownloadUrlForLayer",
+        #                     "ecr:BatchGetImage",
+        #                     "ecr:BatchCheckLayerAvailability"
+        #                 ]
+        #             }
+        #         ]
+        #     }"""
+        # )
+
+        self.export(
+            repository_url=ecr_repository.repository_url,
+        )
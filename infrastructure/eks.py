@@ -1,171 +1,367 @@
+import base64
 import pulumi
 import pulumi_aws as aws
+import pulumi_kubernetes as k8s
 import json
-from network import private_subnet_a, private_subnet_b, public_subnet_a, public_subnet_b, vpc
+from layers import Layer
+from max_pods import max_pods
+from network import availability_zones
 
 # Load Pulumi configuration and needed variables
 config = pulumi.Config()
-git_repo_url = config.require("git_repo_url")
-
-# Retrieve the Amazon Linux 2 AMI for the us-east-1 region
-ami = aws.ec2.get_ami(
-    most_recent=True,
-    owners=["amazon"],  # Only consider Amazon-owned AMIs
-    filters=[
-        {"name": "name", "values": ["amzn2-ami-hvm-*-x86_64-gp2"]},  # Amazon Linux 2 AMIs
-    ]
-)
-
-# Security Group for EKS Nodes
-node_sg = aws.ec2.SecurityGroup("node-sg",
-    vpc_id=vpc.id,
-    egress=[
-        {
-            "protocol": "-1",
-            "from_port": 0,
-            "to_port": 0,
-            "cidr_blocks": ["0.0.0.0/0"]
-        }
-    ],
-    tags={"Name": "node-sg"})
-
-# Add ingress rule to allow inter security group access
-aws.ec2.SecurityGroupRule(
-    "allow-sg-ingress-access",
-    type="ingress",
-    from_port=0,
-    to_port=0,
-    protocol="-1",
-    security_group_id=node_sg.id,
-    source_security_group_id=node_sg.id
-)
-
-# Create EKS Role
-eks_role = aws.iam.Role(
-    "eks-role",
-    assume_role_policy=json.dumps({
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Action": "sts:AssumeRole",
-                "Effect": "Allow",
-                "Principal": {"Service": "eks.amazonaws.com"}
-            }
-        ]
-    }),
-    tags={"Name": "eks-role"}
-)
-
-# Attach EKS cluster policy to EKS Role
-aws.iam.RolePolicyAttachment("eks-cluster-eks-role",
-    role=eks_role.name,
-    policy_arn="arn:aws:iam::aws:policy/AmazonEKSClusterPolicy"
-)
-
-# Create EKS Cluster
-eks_cluster = aws.eks.Cluster(
-    "eks-cluster",
-    role_arn=eks_role.arn,
-    vpc_config=aws.eks.ClusterVpcConfigArgs(
-        subnet_ids=[private_subnet_a.id, private_subnet_b.id],
-        security_group_ids=[node_sg.id]
-    ),
-    tags={"Name": "eks-cluster"}
-)
-
-# Add CoreDNS add-on
-coredns_addon = aws.eks.Addon(
-    "coreDNSAddon",
-    cluster_name=eks_cluster.name,
-    addon_name="coredns",
-    resolve_conflicts_on_update="OVERWRITE",  # Options: OVERWRITE, NONE, PRESERVE
-)
-
-# Add kube-proxy add-on
-kube_proxy_addon = aws.eks.Addon(
-    "kubeProxyAddon",
-    cluster_name=eks_cluster.name,
-    addon_name="kube-proxy",
-    resolve_conflicts_on_update="OVERWRITE",
-)
-
-# Add VPC CNI add-on
-vpc_cni_addon = aws.eks.Addon(
-    "vpcCNIAddon",
-    cluster_name=eks_cluster.name,
-    addon_name="vpc-cni",
-    resolve_conflicts_on_update="OVERWRITE",
-)
-
-# Add EKS Pod Identity Agent add-on
-eks_pod_identity_agent = aws.eks.Addon(
-    "eks-pod-identity-agent",
-    cluster_name=eks_cluster.name,
-    addon_name="eks-pod-identity-agent",
-    resolve_conflicts_on_update="OVERWRITE"
-)
-
-# Create Node Role
-node_role = aws.iam.Role(
-    "eks-node-role",
-    assume_role_policy=json.dumps({
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Action": "sts:AssumeRole",
-                "Effect": "Allow",
-                "Principal": {"Service": "ec2.amazonaws.com"}
+autoscaler_config = config.get_object("autoscaler") or {}
+vpc_config = config.require_object("vpc")
+vpc_cni_config = config.get_object("vpc_cni") or {}
+
+# Instance types of the node group
+NODE_INSTANCE_TYPES = ["t3.medium"]
+
+# VPC CNI settings (see the vpc-cni add-on's configuration schema) that
+# vpc_cni sets, e.g.
+#   vpc_cni: {prefix_delegation: true, warm_prefix_target: 1}
+VPC_CNI_SETTINGS = {
+    "prefix_delegation": "ENABLE_PREFIX_DELEGATION",
+    "warm_prefix_target": "WARM_PREFIX_TARGET",
+    "warm_ip_target": "WARM_IP_TARGET",
+    "minimum_ip_target": "MINIMUM_IP_TARGET",
+}
+
+
+# cluster_kubeconfig returns a kubeconfig for the cluster that authenticates
+# through `aws eks get-token`. It also waits for the wait_for outputs.
+def cluster_kubeconfig(eks_cluster, **wait_for):
+    return pulumi.Output.all(
+        cluster_name=eks_cluster.name,
+        cluster_endpoint=eks_cluster.endpoint,
+        cluster_certificate=eks_cluster.certificate_authority.apply(lambda ca: ca["data"]),
+        **wait_for
+    ).apply(lambda args: json.dumps({
+        "apiVersion": "v1",
+        "clusters": [{
+            "cluster": {
+                "server": args["cluster_endpoint"],
+                "certificate-authority-data": args["cluster_certificate"]
+            },
+            "name": "kubernetes"
+        }],
+        "contexts": [{
+            "context": {
+                "cluster": "kubernetes",
+                "user": "aws"
+            },
+            "name": "aws"
+        }],
+        "current-context": "aws",
+        "kind": "Config",
+        "users": [{
+            "name": "aws",
+            "user": {
+                "exec": {
+                    "apiVersion": "client.authentication.k8s.io/v1beta1",
+                    "command": "aws",
+                    "args": [
+                        "eks",
+                        "get-token",
+                        "--cluster-name",
+                        args["cluster_name"]
+                    ]
+                }
             }
-        ]
-    }),
-    tags={"Name": "eks-node-role"}
-)
-
-# Attach policies to the node role
-# SSM
-aws.iam.RolePolicyAttachment("node-role-ssm-managed",
-    role=node_role.name,
-    policy_arn="arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore"
-)
-
-aws.iam.RolePolicyAttachment("eks-worker-node-policy",
-    role=node_role.name,
-    policy_arn="arn:aws:iam::aws:policy/AmazonEKSWorkerNodePolicy"
-)
-
-aws.iam.RolePolicyAttachment("eks-cni-policy",
-    role=node_role.name,
-    policy_arn="arn:aws:iam::aws:policy/AmazonEKS_CNI_Policy"
-)
-
-# ECR read-only access policy
-aws.iam.RolePolicyAttachment("ecr-readonly-policy",
-    role=node_role.name,
-    policy_arn="arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly"
-)
-
-# Create Node Group
-node_group = aws.eks.NodeGroup(
-    "eks-node-group",
-    cluster_name=eks_cluster.name,
-    node_role_arn=node_role.arn,
-    subnet_ids=[private_subnet_a.id, private_subnet_b.id],
-    scaling_config=aws.eks.NodeGroupScalingConfigArgs(
-        desired_size=2,
-        max_size=2,
-        min_size=1
-    ),
-    instance_types=["t3.medium"]
-)
-
-# Load Balancer for EKS
-load_balancer = aws.lb.LoadBalancer(
-    "eks-load-balancer",
-    internal=False,
-    security_groups=[node_sg.id],
-    subnets=[public_subnet_a.id, public_subnet_b.id]
-)
-
-# Export cluster info
-pulumi.export("eks_cluster_name", eks_cluster.name)
-pulumi.export("eks_cluster_endpoint", eks_cluster.endpoint)
\ No newline at end of file
+        }]
+    }))
+
+
+# node_user_data returns launch template user data that sets the kubelet's
+# max pods. nodeadm on the node group's AL2023 nodes (the default AMI from
+# Kubernetes 1.30) merges it into the NodeConfig EKS generates.
+def node_user_data(node_max_pods):
+    return base64.b64encode(f"""MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="//"
+
+--//
+Content-Type: application/node.eks.aws
+
+apiVersion: node.eks.aws/v1alpha1
+kind: NodeConfig
+spec:
+  kubelet:
+    config:
+      maxPods: {node_max_pods}
+
+--//--
+""".encode()).decode()
+
+
+class EksLayer(Layer):
+    def __init__(self, name, network, opts=None):
+        super().__init__("eks", name, opts)
+
+        # Security Group for EKS Nodes
+        node_sg = aws.ec2.SecurityGroup("node-sg",
+            vpc_id=network.vpc_id,
+            egress=[
+                {
+                    "protocol": "-1",
+                    "from_port": 0,
+                    "to_port": 0,
+                    "cidr_blocks": ["0.0.0.0/0"]
+                }
+            ],
+            tags={"Name": "node-sg"},
+            opts=self.child_opts())
+
+        # Add ingress rule to allow inter security group access
+        aws.ec2.SecurityGroupRule(
+            "allow-sg-ingress-access",
+            type="ingress",
+            from_port=0,
+            to_port=0,
+            protocol="-1",
+            security_group_id=node_sg.id,
+            source_security_group_id=node_sg.id,
+            opts=self.child_opts()
+        )
+
+        # Create EKS Role
+        eks_role = aws.iam.Role(
+            "eks-role",
+            assume_role_policy=json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Action": "sts:AssumeRole",
+                        "Effect": "Allow",
+                        "Principal": {"Service": "eks.amazonaws.com"}
+                    }
+                ]
+            }),
+            tags={"Name": "eks-role"},
+            opts=self.child_opts()
+        )
+
+        # Attach EKS cluster policy to EKS Role
+        aws.iam.RolePolicyAttachment("eks-cluster-eks-role",
+            role=eks_role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonEKSClusterPolicy",
+            opts=self.child_opts()
+        )
+
+        # Create EKS Cluster
+        eks_cluster = aws.eks.Cluster(
+            "eks-cluster",
+            role_arn=eks_role.arn,
+            vpc_config=aws.eks.ClusterVpcConfigArgs(
+                subnet_ids=network.private_subnet_ids,
+                security_group_ids=[node_sg.id]
+            ),
+            tags={"Name": "eks-cluster"},
+            opts=self.child_opts()
+        )
+
+        # Add CoreDNS add-on
+        coredns_addon = aws.eks.Addon(
+            "coreDNSAddon",
+            cluster_name=eks_cluster.name,
+            addon_name="coredns",
+            resolve_conflicts_on_update="OVERWRITE",  # Options: OVERWRITE, NONE, PRESERVE
+            opts=self.child_opts()
+        )
+
+        # Add kube-proxy add-on
+        kube_proxy_addon = aws.eks.Addon(
+            "kubeProxyAddon",
+            cluster_name=eks_cluster.name,
+            addon_name="kube-proxy",
+            resolve_conflicts_on_update="OVERWRITE",
+            opts=self.child_opts()
+        )
+
+        # Add VPC CNI add-on. With pod subnets (vpc.pod_cidr_block) it uses
+        # custom networking: pods get their IPs from the ENIConfig named after
+        # their node's zone. With prefix delegation every secondary address
+        # slot of a node's ENIs holds a /28, so a node fits many more pods and
+        # a new pod rarely waits for an ENI or address to be attached; the
+        # warm/minimum targets size the pool kept ready on each node.
+        pod_networking = bool(vpc_config.get("pod_cidr_block"))
+        prefix_delegation = bool(vpc_cni_config.get("prefix_delegation"))
+        cni_env = {}
+        if pod_networking:
+            cni_env["AWS_VPC_K8S_CNI_CUSTOM_NETWORK_CFG"] = "true"
+            cni_env["ENI_CONFIG_LABEL_DEF"] = "topology.kubernetes.io/zone"
+        for key, name in VPC_CNI_SETTINGS.items():
+            if key in vpc_cni_config:
+                cni_env[name] = str(vpc_cni_config[key]).lower()
+        vpc_cni_addon = aws.eks.Addon(
+            "vpcCNIAddon",
+            cluster_name=eks_cluster.name,
+            addon_name="vpc-cni",
+            resolve_conflicts_on_update="OVERWRITE",
+            configuration_values=json.dumps({"env": cni_env}) if cni_env else None,
+            opts=self.child_opts()
+        )
+
+        # Nodes only pick up custom networking when they start, so the
+        # ENIConfigs are created before the node group, through a provider
+        # that doesn't wait for nodes. Nodes that were running before it was
+        # turned on have to be replaced.
+        node_depends_on = [vpc_cni_addon] if cni_env else []
+        if pod_networking:
+            k8s_provider = k8s.Provider(
+                "eks-k8s-provider",
+                kubeconfig=cluster_kubeconfig(eks_cluster),
+                opts=self.child_opts()
+            )
+
+            # One per zone the network layer spans. A network layer read from
+            # another stack only has Outputs, which can't decide what to
+            # create, so then the zones come from the vpc config the network
+            # layer picked them from.
+            zones = network.availability_zones if isinstance(network, Layer) else availability_zones(vpc_config)
+            eni_configs = [k8s.apiextensions.CustomResource(
+                f"eni-config-{zone}",
+                api_version="crd.k8s.amazonaws.com/v1alpha1",
+                kind="ENIConfig",
+                metadata={"name": zone},
+                spec={
+                    "subnet": pulumi.Output.from_input(network.pod_subnet_ids).apply(
+                        lambda subnet_ids, index=index: subnet_ids[index]
+                    ),
+                    # The groups the nodes' own interfaces are in: the
+                    # cluster's for the node group, node-sg for Karpenter's
+                    "securityGroups": [
+                        eks_cluster.vpc_config.cluster_security_group_id,
+                        node_sg.id,
+                    ],
+                },
+                opts=self.child_opts(provider=k8s_provider, depends_on=[vpc_cni_addon])
+            ) for index, zone in enumerate(zones)]
+            node_depends_on = [vpc_cni_addon, *eni_configs]
+
+        # Add EKS Pod Identity Agent add-on
+        eks_pod_identity_agent = aws.eks.Addon(
+            "eks-pod-identity-agent",
+            cluster_name=eks_cluster.name,
+            addon_name="eks-pod-identity-agent",
+            resolve_conflicts_on_update="OVERWRITE",
+            opts=self.child_opts()
+        )
+
+        # Add metrics-server add-on, which HorizontalPodAutoscalers read
+        # pod CPU and memory usage from
+        metrics_server_addon = aws.eks.Addon(
+            "metricsServerAddon",
+            cluster_name=eks_cluster.name,
+            addon_name="metrics-server",
+            resolve_conflicts_on_update="OVERWRITE",
+            opts=self.child_opts()
+        )
+
+        # Create Node Role
+        node_role = aws.iam.Role(
+            "eks-node-role",
+            assume_role_policy=json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Action": "sts:AssumeRole",
+                        "Effect": "Allow",
+                        "Principal": {"Service": "ec2.amazonaws.com"}
+                    }
+                ]
+            }),
+            tags={"Name": "eks-node-role"},
+            opts=self.child_opts()
+        )
+
+        # Attach policies to the node role
+        # SSM
+        aws.iam.RolePolicyAttachment("node-role-ssm-managed",
+            role=node_role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore",
+            opts=self.child_opts()
+        )
+
+        aws.iam.RolePolicyAttachment("eks-worker-node-policy",
+            role=node_role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonEKSWorkerNodePolicy",
+            opts=self.child_opts()
+        )
+
+        aws.iam.RolePolicyAttachment("eks-cni-policy",
+            role=node_role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonEKS_CNI_Policy",
+            opts=self.child_opts()
+        )
+
+        # ECR read-only access policy
+        aws.iam.RolePolicyAttachment("ecr-readonly-policy",
+            role=node_role.name,
+            policy_arn="arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly",
+            opts=self.child_opts()
+        )
+
+        # Create Node Group. With an autoscaler (see k8s.py) managing the
+        # group, it owns desired_size and finds the group through the same
+        # discovery tags EKS puts on the group's Auto Scaling group.
+        autoscaler_enabled = autoscaler_config.get("enabled", False)
+
+        # Both modes change how many pods fit on a node, which kubelet only
+        # learns from its max-pods. The node group then launches from a
+        # template that sets it for the smallest of its instance types.
+        # Managed node groups can't gain (or drop) a launch template in place:
+        # turning either mode on or off replaces the node group, draining and
+        # recreating its nodes.
+        launch_template = None
+        if prefix_delegation or pod_networking:
+            node_max_pods = min(
+                max_pods(instance_type, prefix_delegation, pod_networking) for instance_type in NODE_INSTANCE_TYPES
+            )
+            launch_template = aws.ec2.LaunchTemplate(
+                "eks-node-launch-template",
+                user_data=node_user_data(node_max_pods),
+                update_default_version=True,
+                tags={"Name": "eks-node-launch-template"},
+                opts=self.child_opts()
+            )
+
+        node_group = aws.eks.NodeGroup(
+            "eks-node-group",
+            cluster_name=eks_cluster.name,
+            node_role_arn=node_role.arn,
+            subnet_ids=network.private_subnet_ids,
+            scaling_config=aws.eks.NodeGroupScalingConfigArgs(
+                desired_size=autoscaler_config.get("desired_size", 2),
+                max_size=autoscaler_config.get("max_size", 2),
+                min_size=autoscaler_config.get("min_size", 1)
+            ),
+            instance_types=NODE_INSTANCE_TYPES,
+            launch_template={
+                "id": launch_template.id,
+                "version": launch_template.latest_version.apply(str),
+            } if launch_template else None,
+            tags=eks_cluster.name.apply(lambda cluster_name: {
+                "k8s.io/cluster-autoscaler/enabled": "true",
+                f"k8s.io/cluster-autoscaler/{cluster_name}": "owned",
+            }) if autoscaler_enabled else None,
+            opts=self.child_opts(
+                depends_on=node_depends_on,
+                ignore_changes=["scalingConfig.desiredSize"] if autoscaler_enabled else None
+            )
+        )
+
+        # Generate the kubeconfig. It also takes the node group status so that
+        # anything using it (the k8s provider) waits for nodes to be ready,
+        # whether or not the EKS layer lives in the same stack.
+        kubeconfig = cluster_kubeconfig(eks_cluster, node_group_status=node_group.status)
+
+        self.export(
+            cluster_name=eks_cluster.name,
+            cluster_endpoint=eks_cluster.endpoint,
+            oidc_issuer=eks_cluster.identities.apply(lambda identities: identities[0].oidcs[0].issuer),
+            node_security_group_id=node_sg.id,
+            node_role_arn=node_role.arn,
+            node_role_name=node_role.name,
+            node_subnet_ids=network.private_subnet_ids,
+            vpc_id=network.vpc_id,
+            kubeconfig=kubeconfig,
+        )
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+
+# gen_taggable regenerates taggable_types.txt, the prebuilt index read by
+# taggable.py. By default the type tokens come from the installed pulumi_aws
+# SDK, which is generated from the provider schema: a resource is taggable when
+# its constructor accepts a `tags` input. Pass --schema with the output of
+# `pulumi package get-schema aws` to read the schema JSON directly instead.
+#
+#   python gen_taggable.py
+#   pulumi package get-schema aws > aws-schema.json && python gen_taggable.py --schema aws-schema.json
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "taggable_types.txt")
+
+_RESOURCE_MODULES = re.compile(r'resource_modules="""(.*?)"""', re.S)
+_INTERNAL_INIT = re.compile(r"def _internal_init\((.*?)\):", re.S)
+_TAGS_PARAM = re.compile(r"^\s*tags:", re.M)
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+
+
+# tokens_from_schema returns the taggable type tokens declared in a provider schema.
+def tokens_from_schema(schema):
+    return sorted(
+        token for token, resource in schema.get("resources", {}).items()
+        if "tags" in resource.get("inputProperties", {})
+    )
+
+
+# _module_file returns the SDK source file defining the given camelCase resource.
+def _module_file(package_dir, resource):
+    path = os.path.join(package_dir, _CAMEL.sub("_", resource).lower() + ".py")
+    if os.path.exists(path):
+        return path
+    # A few names (mLTransform, iPSet) don't snake_case predictably.
+    flat = resource.lower() + ".py"
+    for name in os.listdir(package_dir):
+        if name.replace("_", "") == flat:
+            return os.path.join(package_dir, name)
+    return None
+
+
+# tokens_from_sdk returns the taggable type tokens of the installed pulumi_aws SDK.
+def tokens_from_sdk():
+    import pulumi_aws
+
+    root = os.path.dirname(pulumi_aws.__file__)
+    with open(os.path.join(root, "__init__.py")) as f:
+        modules = json.loads(_RESOURCE_MODULES.search(f.read()).group(1))
+
+    tokens = []
+    for module in modules:
+        package = module["fqn"].split(".")[1:]
+        resource = module["mod"].split("/", 1)[1]
+        path = _module_file(os.path.join(root, *package), resource)
+        if path is None:
+            continue
+        with open(path) as f:
+            init = _INTERNAL_INIT.search(f.read())
+        if init and _TAGS_PARAM.search(init.group(1)):
+            tokens.extend(module["classes"])
+    return sorted(tokens)
+
+
+# write_index writes tokens grouped per service, one line each:
+#   eks addon:Addon cluster:Cluster ...
+def write_index(tokens, path=INDEX_PATH, version=None):
+    services = defaultdict(list)
+    for token in tokens:
+        _, rest = token.split(":", 1)
+        service, resource = rest.split("/", 1)
+        services[service].append(resource)
+
+    with open(path, "w") as f:
+        f.write("# Generated by gen_taggable.py")
+        f.write(f" from pulumi_aws {version}\n" if version else "\n")
+        for service in sorted(services):
+            f.write(" ".join([service, *sorted(services[service])]) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate the taggable AWS resource type index.")
+    parser.add_argument("--schema", help="path to a provider schema from `pulumi package get-schema aws`")
+    parser.add_argument("--output", default=INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.schema:
+        with open(args.schema) as f:
+            schema = json.load(f)
+        tokens, version = tokens_from_schema(schema), schema.get("version")
+    else:
+        from importlib.metadata import version as package_version
+        tokens, version = tokens_from_sdk(), package_version("pulumi_aws")
+
+    write_index(tokens, args.output, version)
+    print(f"wrote {len(tokens)} taggable types to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import json
+import os
+import time
+import pulumi
+import pulumi_aws as aws
+
+# Shared cache for data-source invokes made while the program is evaluated.
+# Identical invokes are made once per run, and slow-changing lookups (AMI IDs,
+# instance types, zones) are also kept on disk between runs for `ttl_seconds`.
+#
+# infrastructure:invoke_cache:
+#   enabled: true        # disk cache on/off; in-run dedup always applies
+#   ttl_seconds: 86400
+#   refresh: false       # ignore disk entries and re-fetch (or INVOKE_CACHE_REFRESH=1)
+#   path: .invoke-cache.json
+config = pulumi.Config()
+cache_config = config.get_object("invoke_cache") or {}
+
+CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    cache_config.get("path", ".invoke-cache.json"),
+)
+TTL_SECONDS = cache_config.get("ttl_seconds", 24 * 60 * 60)
+ENABLED = cache_config.get("enabled", True)
+REFRESH = cache_config.get("refresh", False) or os.environ.get("INVOKE_CACHE_REFRESH") == "1"
+
+# CACHE_VERSION is written into the cache file. Bump it whenever a persisted
+# projection changes shape: files written with another version are discarded
+# rather than handing old values to new code.
+CACHE_VERSION = 2
+
+stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+_memo = {}
+_disk = None
+
+
+def _load_disk():
+    global _disk
+    if _disk is None:
+        _disk = {}
+        if ENABLED and os.path.exists(CACHE_PATH):
+            try:
+                with open(CACHE_PATH) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                pulumi.log.warn(f"invoke cache: ignoring unreadable {CACHE_PATH}")
+            else:
+                if isinstance(data, dict) and data.get("version") == CACHE_VERSION:
+                    _disk = data["entries"]
+                else:
+                    pulumi.log.info(f"invoke cache: discarding {CACHE_PATH}, written by another version")
+    return _disk
+
+
+def _save_disk():
+    tmp = f"{CACHE_PATH}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": CACHE_VERSION, "entries": _disk}, f, indent=2, sort_keys=True)
+    os.replace(tmp, CACHE_PATH)
+
+
+# cached_invoke calls fn(**kwargs) once per distinct set of arguments. When
+# persist is set, project(result) must be JSON serializable; that projection is
+# what gets returned and stored on disk. Disk entries are scoped to the AWS
+# region and the account of the current credentials, so credentials for
+# another account never see its results, whichever way they are configured.
+def cached_invoke(fn, persist=False, project=None, **kwargs):
+    scope = {
+        "invoke": f"{fn.__module__}.{fn.__qualname__}",
+        "args": kwargs,
+        "region": aws.config.region,
+    }
+    if persist and ENABLED:
+        scope["account"] = account_id()
+    key = json.dumps(scope, sort_keys=True, default=str)
+
+    if key in _memo:
+        stats["hits"] += 1
+        return _memo[key]
+
+    disk = _load_disk() if persist and ENABLED else None
+    if disk is not None and not REFRESH:
+        entry = disk.get(key)
+        if entry and time.time() - entry["at"] < TTL_SECONDS:
+            stats["disk_hits"] += 1
+            _memo[key] = entry["value"]
+            return entry["value"]
+
+    stats["misses"] += 1
+    result = fn(**kwargs)
+    value = project(result) if project else result
+    _memo[key] = value
+    if disk is not None:
+        disk[key] = {"at": time.time(), "value": value}
+        _save_disk()
+    return value
+
+
+# account_id returns the AWS account ID of the current credentials. It scopes
+# the disk entries, so it is looked up once per run rather than persisted.
+def account_id():
+    return cached_invoke(aws.get_caller_identity, project=lambda r: r.account_id)
+
+
+# ami_id returns the most recent AMI matching the given name pattern.
+def ami_id(name, owners=("amazon",)):
+    return cached_invoke(
+        aws.ec2.get_ami,
+        persist=True,
+        project=lambda r: r.id,
+        most_recent=True,
+        owners=list(owners),
+        filters=[{"name": "name", "values": [name]}],
+    )
+
+
+# available_zones returns the names of the region's available availability
+# zones, leaving out local and wavelength zones.
+def available_zones():
+    return cached_invoke(
+        aws.get_availability_zones,
+        persist=True,
+        project=lambda r: sorted(r.names),
+        state="available",
+        filters=[{"name": "opt-in-status", "values": ["opt-in-not-required"]}],
+    )
+
+
+# instance_type_info returns the vCPUs, memory (MiB), network interfaces and
+# IPv4 addresses per interface of an instance type. Callers share the one
+# projection, since its cache entry is keyed by the invoke's arguments alone.
+def instance_type_info(instance_type):
+    return cached_invoke(
+        aws.ec2.get_instance_type,
+        persist=True,
+        project=lambda r: {
+            "vcpus": r.default_vcpus,
+            "memory_mib": r.memory_size,
+            "enis": r.maximum_network_interfaces,
+            "ipv4_per_eni": r.maximum_ipv4_addresses_per_interface,
+        },
+        instance_type=instance_type,
+    )
+
+
+# ecr_authorization_token returns a registry token. Tokens expire, so they are
+# only shared within a run and never written to disk.
+def ecr_authorization_token():
+    return cached_invoke(aws.ecr.get_authorization_token)
+
+
+# log_stats reports cache effectiveness for this run.
+def log_stats():
+    pulumi.log.info(
+        f"invoke cache: {stats['hits'] + stats['disk_hits']} hits "
+        f"({stats['disk_hits']} from disk), {stats['misses']} misses"
+    )
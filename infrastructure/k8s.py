@@ -1,441 +1,979 @@
+import os
 import pulumi
 import json
 import pulumi_kubernetes as k8s
 import pulumi_aws as aws
 import pulumi_std as std
 import pulumi_tls as tls
-import pulumi_random as random
 import pulumi_docker_build as docker_build
-from eks import eks_cluster, node_group
-from ecr import ecr_repository
-from urllib.parse import quote
-
-# Get AWS caller identity
-caller_identity = aws.get_caller_identity()
+import invoke_cache
+from layers import Layer
+from db_secret import has_read_replicas
 
 # Load Pulumi configuration and needed variables
 config = pulumi.Config()
-git_repo_url = config.require("git_repo_url")
 es_config = config.require_object("external_secrets")
-internal_domain = config.require("internal_domain")
-db_instance_name = config.require("db_instance")
 web_app_config = config.require_object("web_app")
+autoscaler_config = config.get_object("autoscaler") or {}
+pgbouncer_config = config.get_object("pgbouncer") or {}
+vpc_cni_config = config.get_object("vpc_cni") or {}
+load_balancer_config = config.get_object("load_balancer") or {}
 
-# Generate the kubeconfig
-kubeconfig = pulumi.Output.all(
-    cluster_name=eks_cluster.name,
-    cluster_endpoint=eks_cluster.endpoint,
-    cluster_certificate=eks_cluster.certificate_authority.apply(lambda ca: ca["data"])
-).apply(lambda args: json.dumps({
-    "apiVersion": "v1",
-    "clusters": [{
-        "cluster": {
-            "server": args["cluster_endpoint"],
-            "certificate-authority-data": args["cluster_certificate"]
-        },
-        "name": "kubernetes"
-    }],
-    "contexts": [{
-        "context": {
-            "cluster": "kubernetes",
-            "user": "aws"
-        },
-        "name": "aws"
-    }],
-    "current-context": "aws",
-    "kind": "Config",
-    "users": [{
-        "name": "aws",
-        "user": {
-            "exec": {
-                "apiVersion": "client.authentication.k8s.io/v1beta1",
-                "command": "aws",
-                "args": [
-                    "eks",
-                    "get-token",
-                    "--cluster-name",
-                    args["cluster_name"]
-                ]
-            }
-        }
-    }]
-}))
-
-# Add k8s bootstrap components to cluster
-k8s_provider = k8s.Provider(
-    "k8s-provider",
-    kubeconfig=kubeconfig,
-    opts=(pulumi.ResourceOptions(depends_on=node_group))
+# IAM policy of the AWS Load Balancer Controller, as published with the
+# controller (docs/install/iam_policy.json); update it with the chart.
+LOAD_BALANCER_CONTROLLER_POLICY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "load_balancer_controller_policy.json"
 )
 
-########################################
-########## External secrets ############
-########################################
-# Namespace
-namespace = k8s.core.v1.Namespace(
-    "external-secrets",
-    metadata={"name": "external-secrets"},
-    opts=pulumi.ResourceOptions(provider=k8s_provider)
-)
+# Direct connection URL in postgres-url-secret, rendered by External Secrets
+# from the Secrets Manager secret's properties
+POSTGRES_URL = "postgres://{{ .username }}:{{ .password | urlquery }}@{{ .host }}:{{ .port }}/{{ .db }}"
+POSTGRES_READ_URL = "postgres://{{ .username }}:{{ .password | urlquery }}@{{ .read_host }}:{{ .port }}/{{ .db }}"
 
-# Helm Chart
-external_secrets_chart = k8s.helm.v4.Chart(
-    es_config.get("helm_chart"),
-    chart=es_config.get("helm_chart"),
-    version=es_config.get("helm_chart_version"),
-    repository_opts=k8s.helm.v4.RepositoryOptsArgs(
-        repo=es_config.get("helm_repo")
-    ),
-    namespace=namespace.metadata["name"],
-    opts=pulumi.ResourceOptions(
-        provider=k8s_provider,
-        depends_on=[namespace]
-    )
-)
 
-########################################
-############## Web App #################
-########################################
-# Namespace
-namespace = k8s.core.v1.Namespace(
-    web_app_config.get("name"),
-    metadata={"name": web_app_config.get("name")},
-    opts=pulumi.ResourceOptions(provider=k8s_provider)
-)
+# pgbouncer_connection_limit returns the Prisma pool size for each web app
+# pod. With every pod the app can scale to holding that many connections,
+# the transactions they run at once fit in the server-side pools of all
+# PgBouncer replicas, so queries don't queue inside PgBouncer.
+def pgbouncer_connection_limit():
+    if "connection_limit" in pgbouncer_config:
+        return pgbouncer_config["connection_limit"]
+    hpa_config = web_app_config.get("hpa") or {}
+    max_app_replicas = hpa_config.get("max_replicas", web_app_config.get("replicas", 1))
+    server_connections = pgbouncer_config.get("default_pool_size", 20) * pgbouncer_config.get("replicas", 2)
+    return max(1, server_connections // max_app_replicas)
 
-# Create random password for the db
-random_password = random.RandomPassword("dbPassword",
-    length=16,
-    special=True,
-    keepers={
-        "keeper": "change-me-to-change-password"
-    }
-)
 
-# DB connection details secret
-db_secret = aws.secretsmanager.Secret(
-    web_app_config.get("postgres_secret"),
-    name=web_app_config.get("postgres_secret"),
-    description="PostgreSQL connection details",
-    tags={
-        "Environment": "Production"
+# postgres_secret_template returns the keys of postgres-url-secret. Read-only
+# traffic goes straight to the replicas (or the primary without any). With
+# PgBouncer enabled, postgres-url points the web app at it and the secret also
+# carries the credentials PgBouncer and its metrics exporter connect with.
+def postgres_secret_template():
+    template = {"postgres-url": POSTGRES_URL, "postgres-read-url": POSTGRES_READ_URL}
+    if not pgbouncer_config.get("enabled", False):
+        return template
+    return template | {
+        "postgres-url": (
+            "postgres://{{ .username }}:{{ .password | urlquery }}"
+            f"@pgbouncer.{web_app_config.get("name")}.svc.cluster.local:5432/{{{{ .db }}}}"
+            f"?pgbouncer=true&connection_limit={pgbouncer_connection_limit()}"
+        ),
+        "username": "{{ .username }}",
+        "password": "{{ .password }}",
+        "host": "{{ .host }}",
+        "port": "{{ .port }}",
+        "pgbouncer-exporter-url": "postgres://{{ .username }}:{{ .password | urlquery }}@localhost:5432/pgbouncer?sslmode=disable",
     }
-)
 
-# Create a Secrets Manager secret version with the generated secret string
-secret_version = aws.secretsmanager.SecretVersion("dbSecretVersion",
-    secret_id=db_secret.id,
-    secret_string=pulumi.Output.json_dumps({
-        "username": web_app_config.get("name"),
-        "password": random_password.result,
-        "host": f"{db_instance_name}.{internal_domain}",
-        "port": 5432,
-        "db": web_app_config.get("name")
-    })
-)
 
-# Set up IRSA role using eks oidc provider
-oidc_issuer = eks_cluster.identities.apply(lambda identities: tls.get_certificate_output(url=identities[0].oidcs[0].issuer))
-
-open_id_connect_provider = aws.iam.OpenIdConnectProvider("oidc-provider",
-    client_id_lists=["sts.amazonaws.com"],
-    thumbprint_lists=[oidc_issuer.certificates[0].sha1_fingerprint],
-    url=oidc_issuer.url)
-
-assume_role_policy = aws.iam.get_policy_document_output(statements=[{
-    "actions": ["sts:AssumeRoleWithWebIdentity"],
-    "effect": "Allow",
-    "conditions": [{
-        "test": "StringEquals",
-        "variable": std.replace_output(text=open_id_connect_provider.url,
-            search="https://",
-            replace="").apply(lambda invoke: f"{invoke.result}:sub"),
-        "values": [namespace.metadata.name.apply(lambda ns_name: f"system:serviceaccount:{ns_name}:{ns_name}-sa")]
-    }],
-    "principals": [{
-        "identifiers": [open_id_connect_provider.arn],
-        "type": "Federated"
-    }]
-}])
-
-web_app_role = aws.iam.Role("web-app-irsa",
-    assume_role_policy=assume_role_policy.json,
-    name="web-app-irsa")
-
-# Create IAM policy for the service account allowing access to web-app* secrets
-iam_policy = aws.iam.Policy("web-app-allow-secrets-manager-policy",
-    policy=json.dumps({
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Effect": "Allow",
-                "Action": "secretsmanager:GetSecretValue",
-                "Resource": f"arn:aws:secretsmanager:{aws.config.region}:{caller_identity.account_id}:secret:{web_app_config.get("name")}*"
-            }
-        ]
-    })
-)
+# irsa_assume_role_policy returns the trust policy that lets a service account
+# (subject "system:serviceaccount:<namespace>:<name>") assume a role through
+# the cluster's OIDC provider.
+def irsa_assume_role_policy(open_id_connect_provider, subject):
+    return aws.iam.get_policy_document_output(statements=[{
+        "actions": ["sts:AssumeRoleWithWebIdentity"],
+        "effect": "Allow",
+        "conditions": [{
+            "test": "StringEquals",
+            "variable": std.replace_output(text=open_id_connect_provider.url,
+                search="https://",
+                replace="").apply(lambda invoke: f"{invoke.result}:sub"),
+            "values": [subject]
+        }],
+        "principals": [{
+            "identifiers": [open_id_connect_provider.arn],
+            "type": "Federated"
+        }]
+    }])
 
-# Attach the policy to the irsa role
-aws.iam.RolePolicyAttachment("irsa-policy-attachment",
-    role=web_app_role.name,
-    policy_arn=iam_policy.arn
-)
 
-# Service Account
-service_account = k8s.core.v1.ServiceAccount(
-    "web-app-sa",
-    metadata={
-        "name": pulumi.Output.concat(namespace.metadata.name, "-sa"),
-        "namespace": namespace.metadata.name,
-        "annotations": {
-            # Annotations for IRSA
-            "eks.amazonaws.com/role-arn": web_app_role.arn
-        },
-    },
-    opts=pulumi.ResourceOptions(provider=k8s_provider)
-)
+class AppsLayer(Layer):
+    def __init__(self, name, eks, ecr, db_secret, opts=None):
+        super().__init__("apps", name, opts)
+
+        # Get AWS account id
+        account_id = invoke_cache.account_id()
+
+        # Add k8s bootstrap components to cluster
+        k8s_provider = k8s.Provider(
+            "k8s-provider",
+            kubeconfig=eks.kubeconfig,
+            opts=self.child_opts()
+        )
+
+        ########################################
+        ########## External secrets ############
+        ########################################
+        # Namespace
+        namespace = k8s.core.v1.Namespace(
+            "external-secrets",
+            metadata={"name": "external-secrets"},
+            opts=self.child_opts(provider=k8s_provider)
+        )
 
-# AWS SecretStore
-css = k8s.yaml.v2.ConfigGroup(
-    "aws-css",
-    objs=[{
-        "apiVersion": "external-secrets.io/v1beta1",
-        "kind": "SecretStore",
-        "metadata": {
-            "name": "aws",
-            "namespace": namespace.metadata.name
-        },
-        "spec": {
-            "provider": {
-                "aws": {
-                    "service": "SecretsManager",
-                    "region": aws.config.region,
-                    "auth": {
-                        "jwt": {
-                            "serviceAccountRef": {
-                                "name": service_account.metadata.name
+        # Helm Chart
+        external_secrets_chart = k8s.helm.v4.Chart(
+            es_config.get("helm_chart"),
+            chart=es_config.get("helm_chart"),
+            version=es_config.get("helm_chart_version"),
+            repository_opts=k8s.helm.v4.RepositoryOptsArgs(
+                repo=es_config.get("helm_repo")
+            ),
+            namespace=namespace.metadata["name"],
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=[namespace]
+            )
+        )
+
+        ########################################
+        ############## Web App #################
+        ########################################
+        # Namespace. With the load balancer controller, its pods only count as
+        # ready once the NLB sees them healthy, so rollouts don't outrun it.
+        lb_controller_enabled = load_balancer_config.get("controller", False)
+        namespace_metadata = {"name": web_app_config.get("name")}
+        if lb_controller_enabled:
+            namespace_metadata["labels"] = {"elbv2.k8s.aws/pod-readiness-gate-inject": "enabled"}
+        namespace = k8s.core.v1.Namespace(
+            web_app_config.get("name"),
+            metadata=namespace_metadata,
+            opts=self.child_opts(provider=k8s_provider)
+        )
+
+        # Set up IRSA role using eks oidc provider
+        oidc_issuer = tls.get_certificate_output(url=eks.oidc_issuer)
+
+        open_id_connect_provider = aws.iam.OpenIdConnectProvider("oidc-provider",
+            client_id_lists=["sts.amazonaws.com"],
+            thumbprint_lists=[oidc_issuer.certificates[0].sha1_fingerprint],
+            url=oidc_issuer.url,
+            opts=self.child_opts())
+
+        assume_role_policy = irsa_assume_role_policy(
+            open_id_connect_provider,
+            namespace.metadata.name.apply(lambda ns_name: f"system:serviceaccount:{ns_name}:{ns_name}-sa")
+        )
+
+        web_app_role = aws.iam.Role("web-app-irsa",
+            assume_role_policy=assume_role_policy.json,
+            name="web-app-irsa",
+            opts=self.child_opts())
+
+        # Create IAM policy for the service account allowing access to web-app* secrets
+        iam_policy = aws.iam.Policy("web-app-allow-secrets-manager-policy",
+            policy=json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": "secretsmanager:GetSecretValue",
+                        "Resource": f"arn:aws:secretsmanager:{aws.config.region}:{account_id}:secret:{web_app_config.get("name")}*"
+                    }
+                ]
+            }),
+            opts=self.child_opts()
+        )
+
+        # Attach the policy to the irsa role
+        aws.iam.RolePolicyAttachment("irsa-policy-attachment",
+            role=web_app_role.name,
+            policy_arn=iam_policy.arn,
+            opts=self.child_opts()
+        )
+
+        # Service Account
+        service_account = k8s.core.v1.ServiceAccount(
+            "web-app-sa",
+            metadata={
+                "name": pulumi.Output.concat(namespace.metadata.name, "-sa"),
+                "namespace": namespace.metadata.name,
+                "annotations": {
+                    # Annotations for IRSA
+                    "eks.amazonaws.com/role-arn": web_app_role.arn
+                },
+            },
+            opts=self.child_opts(provider=k8s_provider)
+        )
+
+        # AWS SecretStore
+        css = k8s.yaml.v2.ConfigGroup(
+            "aws-css",
+            objs=[{
+                "apiVersion": "external-secrets.io/v1beta1",
+                "kind": "SecretStore",
+                "metadata": {
+                    "name": "aws",
+                    "namespace": namespace.metadata.name
+                },
+                "spec": {
+                    "provider": {
+                        "aws": {
+                            "service": "SecretsManager",
+                            "region": aws.config.region,
+                            "auth": {
+                                "jwt": {
+                                    "serviceAccountRef": {
+                                        "name": service_account.metadata.name
+                                    }
+                                }
                             }
                         }
                     }
                 }
-            }
-        }
-    }],
-    opts=pulumi.ResourceOptions(
-        provider=k8s_provider,
-        depends_on=external_secrets_chart
-    )
-)
+            }],
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=external_secrets_chart
+            )
+        )
 
-# Create externalsecret resource to generate the db connection url from aws secret
-postgres_external_secret = k8s.apiextensions.CustomResource("postgres-external-secret",
-    api_version="external-secrets.io/v1beta1",
-    kind="ExternalSecret",
-    metadata={
-        "name": "postgres-url-secret",
-        "namespace": namespace.metadata.name
-    },
-    spec={
-        "secretStoreRef": {
-            "kind": "SecretStore",
-            "name": "aws"
-        },
-        "target": {
-            "name": "postgres-url-secret",
-            "template": {
-                "data": {
-                    "postgres-url": "postgres://{{ .username }}:{{ .password | urlquery }}@{{ .host }}:{{ .port }}/{{ .db }}"
+        # Create externalsecret resource to generate the db connection url from aws secret
+        postgres_external_secret = k8s.apiextensions.CustomResource("postgres-external-secret",
+            api_version="external-secrets.io/v1beta1",
+            kind="ExternalSecret",
+            metadata={
+                "name": "postgres-url-secret",
+                "namespace": namespace.metadata.name
+            },
+            spec={
+                "secretStoreRef": {
+                    "kind": "SecretStore",
+                    "name": "aws"
+                },
+                "target": {
+                    "name": "postgres-url-secret",
+                    "template": {
+                        "data": postgres_secret_template(),
+                    },
                 },
+                "data": [
+                    {
+                        "secretKey": "username", 
+                        "remoteRef": {
+                            "key": db_secret.secret_name,
+                            "property": "username"
+                        }
+                    },
+                    {
+                        "secretKey": "password",
+                        "remoteRef": {
+                            "key": db_secret.secret_name,
+                            "property": "password"
+                        }
+                    },
+                    {
+                        "secretKey": "host", 
+                        "remoteRef": {
+                            "key": db_secret.secret_name,
+                            "property": "host"
+                        }
+                    },
+                    {
+                        "secretKey": "port", 
+                        "remoteRef": {
+                            "key": db_secret.secret_name,
+                            "property": "port"
+                        }
+                    },
+                    {
+                        "secretKey": "db", 
+                        "remoteRef": {
+                            "key": db_secret.secret_name,
+                            "property": "db"
+                        }
+                    },
+                    {
+                        "secretKey": "read_host",
+                        "remoteRef": {
+                            "key": db_secret.secret_name,
+                            "property": "read_host" if has_read_replicas() else "host"
+                        }
+                    }
+                ]
             },
-        },
-        "data": [
-            {
-                "secretKey": "username", 
-                "remoteRef": {
-                    "key": db_secret.name,
-                    "property": "username"
-                }
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=external_secrets_chart
+            )
+        )
+
+        ########################################
+        ############## PgBouncer ###############
+        ########################################
+        if pgbouncer_config.get("enabled", False):
+            self._pgbouncer(namespace, k8s_provider, postgres_external_secret)
+
+        # Build the web app from Dockerfile
+        auth_token = invoke_cache.ecr_authorization_token()
+
+        my_image = docker_build.Image("my-image",
+            cache_from=[{
+                "registry": {
+                    "ref": ecr.repository_url.apply(lambda repository_url: f"{repository_url}:cache")
+                },
+            }],
+            cache_to=[{
+                "registry": {
+                    "image_manifest": True,
+                    "oci_media_types": True,
+                    "ref": ecr.repository_url.apply(lambda repository_url: f"{repository_url}:cache")
+                },
+            }],
+            context={
+                "location": "../ultra-tic/"
             },
-            {
-                "secretKey": "password",
-                "remoteRef": {
-                    "key": db_secret.name,
-                    "property": "password"
-                }
+            platforms=[docker_build.Platform.LINUX_AMD64],
+            push=True,
+            registries=[{
+                "address": ecr.repository_url,
+                "password": auth_token.password,
+                "username": auth_token.user_name
+            }],
+            tags=[ecr.repository_url.apply(lambda repository_url: f"{repository_url}:latest")],
+            opts=self.child_opts())
+
+        # Create overly permissive service account for deployment to use
+        service_account = k8s.core.v1.ServiceAccount(
+            "i-have-the-power",
+            metadata={
+                "name": "i-have-the-power",
+                "namespace": namespace.metadata.name
+            },
+            opts=self.child_opts(provider=k8s_provider)
+        )
+
+        # Create a ClusterRoleBinding to grant cluster-admin role to the ServiceAccount
+        cluster_role_binding = k8s.rbac.v1.ClusterRoleBinding(
+            "my-cluster-role-binding",
+            metadata={
+                "name": "my-cluster-role-binding"
             },
-            {
-                "secretKey": "host", 
-                "remoteRef": {
-                    "key": db_secret.name,
-                    "property": "host"
+            role_ref={
+                "apiGroup": "rbac.authorization.k8s.io",
+                "kind": "ClusterRole",
+                "name": "cluster-admin"
+            },
+            subjects=[
+                {
+                    "kind": "ServiceAccount",
+                    "name": service_account.metadata["name"],
+                    "namespace": namespace.metadata.name
                 }
+            ],
+            opts=self.child_opts(provider=k8s_provider)
+        )
+
+        # Web app deployment
+        app_labels = {"app": web_app_config.get("name")}
+        hpa_config = web_app_config.get("hpa")
+
+        deployment = k8s.apps.v1.Deployment(
+            web_app_config.get("name"),
+            metadata={
+                "name": web_app_config.get("name"),
+                "namespace": namespace.metadata.name
             },
-            {
-                "secretKey": "port", 
-                "remoteRef": {
-                    "key": db_secret.name,
-                    "property": "port"
+            spec={
+                "replicas": web_app_config.get("replicas", 1),
+                "selector": {
+                    "matchLabels": app_labels
+                },
+                "template": {
+                    "metadata": {
+                        "labels": app_labels
+                    },
+                    "spec": {
+                        "serviceAccountName": service_account.metadata.name,
+                        # "initContainers": [{
+                        #     "name": f"{web_app_config.get("name")}-init",
+                        #     "image": my_image.ref,
+                        #     "command": ["npx", "--y", "prisma", "migrate", "deploy"],
+                        #     "env": [{
+                        #         "name": "DATABASE_URL",
+                        #         "valueFrom": {
+                        #             "secretKeyRef": {
+                        #                 "name": "postgres-url-secret",
+                        #                 "key": "postgres-url"
+                        #             }
+                        #         }
+                        #     }]
+                        # }],
+                        "containers": [{
+                            "name": web_app_config.get("name"),
+                            "image": my_image.ref,
+                            "resources": web_app_config.get("resources"),
+                            "env": [{
+                                "name": "DATABASE_URL",
+                                "valueFrom": {
+                                    "secretKeyRef": {
+                                        "name": "postgres-url-secret",
+                                        "key": "postgres-url"
+                                    }
+                                }
+                            }, {
+                                "name": "DATABASE_READ_URL",
+                                "valueFrom": {
+                                    "secretKeyRef": {
+                                        "name": "postgres-url-secret",
+                                        "key": "postgres-read-url"
+                                    }
+                                }
+                            }]
+                        }]
+                    }
                 }
             },
-            {
-                "secretKey": "db", 
-                "remoteRef": {
-                    "key": db_secret.name,
-                    "property": "db"
+            opts=self.child_opts(
+                provider=k8s_provider,
+                # The HorizontalPodAutoscaler owns the replica count
+                ignore_changes=["spec.replicas"] if hpa_config else None
+            )
+        )
+
+        # Scale the Deployment on CPU utilization (relative to the container's
+        # CPU request) and, optionally, a per-pod custom metric, which needs a
+        # custom metrics API adapter such as prometheus-adapter in the cluster.
+        if hpa_config:
+            metrics = [{
+                "type": "Resource",
+                "resource": {
+                    "name": "cpu",
+                    "target": {
+                        "type": "Utilization",
+                        "averageUtilization": hpa_config.get("cpu_utilization", 70)
+                    }
                 }
+            }]
+            custom_metric = hpa_config.get("custom_metric")
+            if custom_metric:
+                metrics.append({
+                    "type": "Pods",
+                    "pods": {
+                        "metric": {"name": custom_metric["name"]},
+                        "target": {
+                            "type": "AverageValue",
+                            "averageValue": str(custom_metric["target_average_value"])
+                        }
+                    }
+                })
+
+            k8s.autoscaling.v2.HorizontalPodAutoscaler(
+                web_app_config.get("name"),
+                metadata={
+                    "name": web_app_config.get("name"),
+                    "namespace": namespace.metadata.name
+                },
+                spec={
+                    "scaleTargetRef": {
+                        "apiVersion": "apps/v1",
+                        "kind": "Deployment",
+                        "name": deployment.metadata.name
+                    },
+                    "minReplicas": hpa_config.get("min_replicas", 1),
+                    "maxReplicas": hpa_config.get("max_replicas", 4),
+                    "metrics": metrics
+                },
+                opts=self.child_opts(provider=k8s_provider)
+            )
+
+        # Keep a minimum of pods running through voluntary disruptions such as
+        # node drains during scale-down. The budget takes one of min_available
+        # and max_unavailable.
+        pdb_config = web_app_config.get("pdb")
+        if pdb_config:
+            budgets = [key for key in ("min_available", "max_unavailable") if pdb_config.get(key) is not None]
+            if len(budgets) != 1:
+                raise pulumi.RunError(
+                    f"web_app.pdb needs exactly one of min_available and max_unavailable, got {budgets or 'neither'}"
+                )
+            k8s.policy.v1.PodDisruptionBudget(
+                web_app_config.get("name"),
+                metadata={
+                    "name": web_app_config.get("name"),
+                    "namespace": namespace.metadata.name
+                },
+                spec={
+                    "selector": {
+                        "matchLabels": app_labels
+                    },
+                    "minAvailable": pdb_config.get("min_available"),
+                    "maxUnavailable": pdb_config.get("max_unavailable")
+                },
+                opts=self.child_opts(provider=k8s_provider)
+            )
+
+        # Create a LoadBalancer Service for the Deployment. With the AWS Load
+        # Balancer Controller (load_balancer.controller) it gets an NLB that
+        # sends traffic straight to the pods' IPs, instead of the in-tree
+        # provider's classic ELB and its extra hop through a NodePort. The
+        # load balancer class can't change on a live Service, so switching
+        # replaces the Service and its load balancer.
+        service_annotations = None
+        load_balancer_class = None
+        service_depends_on = [deployment]
+        if lb_controller_enabled:
+            service_depends_on.append(self._load_balancer_controller(eks, open_id_connect_provider, k8s_provider))
+            load_balancer_class = "service.k8s.aws/nlb"
+            cross_zone = str(load_balancer_config.get("cross_zone", False)).lower()
+            service_annotations = {
+                "service.beta.kubernetes.io/aws-load-balancer-nlb-target-type": "ip",
+                "service.beta.kubernetes.io/aws-load-balancer-scheme": load_balancer_config.get("scheme", "internet-facing"),
+                # Off keeps each zone's traffic on that zone's pods
+                "service.beta.kubernetes.io/aws-load-balancer-attributes": f"load_balancing.cross_zone.enabled={cross_zone}",
             }
-        ]
-    },
-    opts=pulumi.ResourceOptions(
-        provider=k8s_provider,
-        depends_on=external_secrets_chart
-    )
-)
+        service = k8s.core.v1.Service(
+            web_app_config.get("name"),
+            metadata=k8s.meta.v1.ObjectMetaArgs(
+                name=web_app_config.get("name"),
+                namespace=namespace.metadata.name,
+                annotations=service_annotations
+            ),
+            spec=k8s.core.v1.ServiceSpecArgs(
+                load_balancer_class=load_balancer_class,
+                selector=app_labels,
+                ports=[
+                    k8s.core.v1.ServicePortArgs(
+                        port=80,
+                        target_port=web_app_config.get("target_port"),
+                        protocol="TCP"
+                    )
+                ],
+                type="LoadBalancer"  # Expose via LoadBalancer
+            ),
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=service_depends_on,
+                replace_on_changes=["spec.loadBalancerClass"],
+                delete_before_replace=True
+            )
+        )
 
-# Build the web app from Dockerfile
-auth_token = aws.ecr.get_authorization_token()
-
-my_image = docker_build.Image("my-image",
-    cache_from=[{
-        "registry": {
-            "ref": ecr_repository.repository_url.apply(lambda repository_url: f"{repository_url}:cache")
-        },
-    }],
-    cache_to=[{
-        "registry": {
-            "image_manifest": True,
-            "oci_media_types": True,
-            "ref": ecr_repository.repository_url.apply(lambda repository_url: f"{repository_url}:cache")
-        },
-    }],
-    context={
-        "location": "../ultra-tic/"
-    },
-    platforms=[docker_build.Platform.LINUX_AMD64],
-    push=True,
-    registries=[{
-        "address": ecr_repository.repository_url,
-        "password": auth_token.password,
-        "username": auth_token.user_name
-    }],
-    tags=[ecr_repository.repository_url.apply(lambda repository_url: f"{repository_url}:latest")])
-
-# Create overly permissive service account for deployment to use
-service_account = k8s.core.v1.ServiceAccount(
-    "i-have-the-power",
-    metadata={
-        "name": "i-have-the-power",
-        "namespace": namespace.metadata.name
-    },
-    opts=pulumi.ResourceOptions(provider=k8s_provider)
-)
+        ########################################
+        ########## Cluster autoscaler ##########
+        ########################################
+        if autoscaler_config.get("enabled", False):
+            if autoscaler_config.get("kind", "cluster-autoscaler") == "karpenter":
+                self._karpenter(eks, open_id_connect_provider, k8s_provider)
+            else:
+                self._cluster_autoscaler(eks, open_id_connect_provider, k8s_provider)
+            self._scale_out_alarm(eks)
 
-# Create a ClusterRoleBinding to grant cluster-admin role to the ServiceAccount
-cluster_role_binding = k8s.rbac.v1.ClusterRoleBinding(
-    "my-cluster-role-binding",
-    metadata={
-        "name": "my-cluster-role-binding"
-    },
-    role_ref={
-        "apiGroup": "rbac.authorization.k8s.io",
-        "kind": "ClusterRole",
-        "name": "cluster-admin"
-    },
-    subjects=[
-        {
-            "kind": "ServiceAccount",
-            "name": service_account.metadata["name"],
-            "namespace": namespace.metadata.name
-        }
-    ],
-    opts=pulumi.ResourceOptions(provider=k8s_provider)
-)
+        # Export the LoadBalancer's DNS name or IP
+        dns_name = service.status.apply(
+            lambda status: status.load_balancer.ingress[0].hostname
+            if status.load_balancer.ingress and "hostname" in status.load_balancer.ingress[0]
+            else status.load_balancer.ingress[0].ip
+            if status.load_balancer.ingress
+            else None
+        )
+
+        self.export(
+            web_app_lb_dns=dns_name,
+        )
+
+    # _pgbouncer runs PgBouncer in the web app namespace. Each replica keeps
+    # up to default_pool_size connections to Postgres and multiplexes the web
+    # app pods' connections onto them per transaction (or per pool_mode). With
+    # metrics enabled, a pgbouncer-exporter sidecar serves pool metrics on
+    # :9127 for Prometheus.
+    def _pgbouncer(self, namespace, k8s_provider, postgres_external_secret):
+        labels = {"app": "pgbouncer"}
+
+        def secret_env(name, key):
+            return {
+                "name": name,
+                "valueFrom": {
+                    "secretKeyRef": {
+                        "name": "postgres-url-secret",
+                        "key": key
+                    }
+                }
+            }
+
+        containers = [{
+            "name": "pgbouncer",
+            "image": pgbouncer_config.get("image", "edoburu/pgbouncer:v1.23.1-p2"),
+            "ports": [{"containerPort": 5432, "name": "postgres"}],
+            "env": [
+                secret_env("DB_HOST", "host"),
+                secret_env("DB_PORT", "port"),
+                secret_env("DB_USER", "username"),
+                secret_env("DB_PASSWORD", "password"),
+                # Postgres 15 stores passwords as SCRAM verifiers, which an md5
+                # userlist entry can't log in with; scram-sha-256 keeps the plain
+                # password in userlist.txt so PgBouncer can do SCRAM to the server
+                {"name": "AUTH_TYPE", "value": "scram-sha-256"},
+                {"name": "POOL_MODE", "value": pgbouncer_config.get("pool_mode", "transaction")},
+                {"name": "DEFAULT_POOL_SIZE", "value": str(pgbouncer_config.get("default_pool_size", 20))},
+                {"name": "MAX_CLIENT_CONN", "value": str(pgbouncer_config.get("max_client_conn", 500))},
+                {"name": "MAX_DB_CONNECTIONS", "value": str(pgbouncer_config.get("max_db_connections", pgbouncer_config.get("default_pool_size", 20)))},
+                {"name": "SERVER_RESET_QUERY", "value": ""},
+                {"name": "IGNORE_STARTUP_PARAMETERS", "value": "extra_float_digits"},
+            ],
+            "readinessProbe": {"tcpSocket": {"port": 5432}, "periodSeconds": 5},
+            "resources": pgbouncer_config.get("resources", {
+                "requests": {"cpu": "50m", "memory": "32Mi"},
+                "limits": {"memory": "128Mi"}
+            }),
+        }]
+        annotations = {}
+        if pgbouncer_config.get("metrics", True):
+            # The exporter logs in as the database user, which PgBouncer
+            # lets read its SHOW STATS/POOLS admin views
+            containers[0]["env"].append(secret_env("STATS_USERS", "username"))
+            containers.append({
+                "name": "pgbouncer-exporter",
+                "image": "prometheuscommunity/pgbouncer-exporter:v0.9.0",
+                "ports": [{"containerPort": 9127, "name": "metrics"}],
+                "env": [secret_env("PGBOUNCER_EXPORTER_CONNECTION_STRING", "pgbouncer-exporter-url")],
+                "resources": {
+                    "requests": {"cpu": "10m", "memory": "16Mi"},
+                    "limits": {"memory": "64Mi"}
+                },
+            })
+            annotations = {
+                "prometheus.io/scrape": "true",
+                "prometheus.io/port": "9127",
+            }
 
-# Web app deployment
-app_labels = {"app": web_app_config.get("name")}
-
-deployment = k8s.apps.v1.Deployment(
-    web_app_config.get("name"),
-    metadata={
-        "name": web_app_config.get("name"),
-        "namespace": namespace.metadata.name
-    },
-    spec={
-        "replicas": 1,
-        "selector": {
-            "matchLabels": app_labels
-        },
-        "template": {
-            "metadata": {
-                "labels": app_labels
+        pgbouncer = k8s.apps.v1.Deployment(
+            "pgbouncer",
+            metadata={
+                "name": "pgbouncer",
+                "namespace": namespace.metadata.name
             },
-            "spec": {
-                "serviceAccountName": service_account.metadata.name,
-                # "initContainers": [{
-                #     "name": f"{web_app_config.get("name")}-init",
-                #     "image": my_image.ref,
-                #     "command": ["npx", "--y", "prisma", "migrate", "deploy"],
-                #     "env": [{
-                #         "name": "DATABASE_URL",
-                #         "valueFrom": {
-                #             "secretKeyRef": {
-                #                 "name": "postgres-url-secret",
-                #                 "key": "postgres-url"
-                #             }
-                #         }
-                #     }]
-                # }],
-                "containers": [{
-                    "name": web_app_config.get("name"),
-                    "image": my_image.ref,
-                    "env": [{
-                        "name": "DATABASE_URL",
-                        "valueFrom": {
-                            "secretKeyRef": {
-                                "name": "postgres-url-secret",
-                                "key": "postgres-url"
+            spec={
+                "replicas": pgbouncer_config.get("replicas", 2),
+                "selector": {
+                    "matchLabels": labels
+                },
+                "template": {
+                    "metadata": {
+                        "labels": labels,
+                        "annotations": annotations
+                    },
+                    "spec": {
+                        "containers": containers
+                    }
+                }
+            },
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=postgres_external_secret
+            )
+        )
+
+        k8s.core.v1.Service(
+            "pgbouncer",
+            metadata={
+                "name": "pgbouncer",
+                "namespace": namespace.metadata.name
+            },
+            spec={
+                "selector": labels,
+                "ports": [{"name": "postgres", "port": 5432, "targetPort": 5432, "protocol": "TCP"}]
+            },
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=pgbouncer
+            )
+        )
+
+    # _load_balancer_controller installs the AWS Load Balancer Controller,
+    # which provisions NLBs for LoadBalancer Services (and ALBs for Ingresses)
+    # and registers pod IPs as their targets. It returns the Helm chart.
+    def _load_balancer_controller(self, eks, open_id_connect_provider, k8s_provider):
+        role = aws.iam.Role("load-balancer-controller-irsa",
+            assume_role_policy=irsa_assume_role_policy(
+                open_id_connect_provider, "system:serviceaccount:kube-system:aws-load-balancer-controller"
+            ).json,
+            opts=self.child_opts())
+
+        with open(LOAD_BALANCER_CONTROLLER_POLICY_PATH) as f:
+            policy = aws.iam.Policy("load-balancer-controller-policy",
+                policy=f.read(),
+                opts=self.child_opts())
+
+        # The controller needs its permissions as soon as it starts
+        policy_attachment = aws.iam.RolePolicyAttachment("load-balancer-controller-policy-attachment",
+            role=role.name,
+            policy_arn=policy.arn,
+            opts=self.child_opts())
+
+        return k8s.helm.v4.Chart(
+            "aws-load-balancer-controller",
+            chart="aws-load-balancer-controller",
+            version=load_balancer_config.get("helm_chart_version", "1.10.1"),
+            repository_opts=k8s.helm.v4.RepositoryOptsArgs(
+                repo="https://aws.github.io/eks-charts"
+            ),
+            namespace="kube-system",
+            values={
+                "clusterName": eks.cluster_name,
+                "region": aws.config.region,
+                "vpcId": eks.vpc_id,
+                "serviceAccount": {
+                    "name": "aws-load-balancer-controller",
+                    "annotations": {"eks.amazonaws.com/role-arn": role.arn},
+                },
+                # Services opt in with their load balancer class; the webhook
+                # would take over every LoadBalancer Service and fail their
+                # creation whenever the controller is down
+                "enableServiceMutatorWebhook": False,
+            },
+            opts=self.child_opts(provider=k8s_provider, depends_on=[policy_attachment])
+        )
+
+    # _cluster_autoscaler installs the Cluster Autoscaler, which resizes the
+    # node group within its min/max when pods are Pending or nodes are idle.
+    # It exposes cluster_autoscaler_function_duration_seconds{function="scaleUp"}
+    # on an annotated Service for a Prometheus, if the cluster runs one;
+    # _scale_out_alarm watches scale-out latency in CloudWatch either way.
+    def _cluster_autoscaler(self, eks, open_id_connect_provider, k8s_provider):
+        role = aws.iam.Role("cluster-autoscaler-irsa",
+            assume_role_policy=irsa_assume_role_policy(
+                open_id_connect_provider, "system:serviceaccount:kube-system:cluster-autoscaler"
+            ).json,
+            opts=self.child_opts())
+
+        # Scaling actions are limited to Auto Scaling groups tagged as owned by this cluster
+        policy = aws.iam.Policy("cluster-autoscaler-policy",
+            policy=eks.cluster_name.apply(lambda cluster_name: json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "autoscaling:DescribeAutoScalingGroups",
+                            "autoscaling:DescribeAutoScalingInstances",
+                            "autoscaling:DescribeLaunchConfigurations",
+                            "autoscaling:DescribeScalingActivities",
+                            "autoscaling:DescribeTags",
+                            "ec2:DescribeImages",
+                            "ec2:DescribeInstanceTypes",
+                            "ec2:DescribeLaunchTemplateVersions",
+                            "ec2:GetInstanceTypesFromInstanceRequirements",
+                            "eks:DescribeNodegroup"
+                        ],
+                        "Resource": "*"
+                    },
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "autoscaling:SetDesiredCapacity",
+                            "autoscaling:TerminateInstanceInAutoScalingGroup"
+                        ],
+                        "Resource": "*",
+                        "Condition": {
+                            "StringEquals": {
+                                f"aws:ResourceTag/k8s.io/cluster-autoscaler/{cluster_name}": "owned"
                             }
                         }
-                    }]
-                }]
-            }
-        }
-    },
-    opts=pulumi.ResourceOptions(provider=k8s_provider)
-)
+                    }
+                ]
+            })),
+            opts=self.child_opts())
 
-# Create a LoadBalancer Service for the Deployment
-service = k8s.core.v1.Service(
-    web_app_config.get("name"),
-    metadata=k8s.meta.v1.ObjectMetaArgs(
-        name=web_app_config.get("name"),
-        namespace=namespace.metadata.name
-    ),
-    spec=k8s.core.v1.ServiceSpecArgs(
-        selector=app_labels,
-        ports=[
-            k8s.core.v1.ServicePortArgs(
-                port=80,
-                target_port=web_app_config.get("target_port"),
-                protocol="TCP"
-            )
-        ],
-        type="LoadBalancer"  # Expose via LoadBalancer
-    ),
-    opts=pulumi.ResourceOptions(
-        provider=k8s_provider,
-        depends_on=deployment
-    )
-)
+        aws.iam.RolePolicyAttachment("cluster-autoscaler-policy-attachment",
+            role=role.name,
+            policy_arn=policy.arn,
+            opts=self.child_opts())
 
-# Export the LoadBalancer's DNS name or IP
-dns_name = service.status.apply(
-    lambda status: status.load_balancer.ingress[0].hostname
-    if status.load_balancer.ingress and "hostname" in status.load_balancer.ingress[0]
-    else status.load_balancer.ingress[0].ip
-    if status.load_balancer.ingress
-    else None
-)
+        k8s.helm.v4.Chart(
+            "cluster-autoscaler",
+            chart="cluster-autoscaler",
+            version=autoscaler_config.get("helm_chart_version", "9.43.2"),
+            repository_opts=k8s.helm.v4.RepositoryOptsArgs(
+                repo="https://kubernetes.github.io/autoscaler"
+            ),
+            namespace="kube-system",
+            values={
+                "autoDiscovery": {"clusterName": eks.cluster_name},
+                "awsRegion": aws.config.region,
+                "rbac": {
+                    "serviceAccount": {
+                        "name": "cluster-autoscaler",
+                        "annotations": {"eks.amazonaws.com/role-arn": role.arn},
+                    },
+                },
+                "extraArgs": {
+                    "balance-similar-node-groups": True,
+                    "skip-nodes-with-system-pods": False,
+                    "scale-down-delay-after-add": autoscaler_config.get("scale_down_delay_after_add", "10m"),
+                    "scale-down-unneeded-time": autoscaler_config.get("scale_down_unneeded_time", "10m"),
+                },
+                "service": {
+                    "annotations": {
+                        "prometheus.io/scrape": "true",
+                        "prometheus.io/port": "8085",
+                    },
+                },
+            },
+            opts=self.child_opts(provider=k8s_provider)
+        )
 
-pulumi.export("web-app lb dns", dns_name)
\ No newline at end of file
+    # _scale_out_alarm ships pod metrics to CloudWatch Container Insights with
+    # the amazon-cloudwatch-observability add-on and alarms when pods stay
+    # Pending for autoscaler.pending_alarm_minutes (default 5): how long a pod
+    # waits for a node is the scale-out latency, and Pending pods that outlast
+    # the threshold mean nodes came up too slowly or not at all.
+    def _scale_out_alarm(self, eks):
+        # The add-on's CloudWatch agent runs on the nodes with their role
+        agent_policy = aws.iam.RolePolicyAttachment("cloudwatch-agent-node-policy",
+            role=eks.node_role_name,
+            policy_arn="arn:aws:iam::aws:policy/CloudWatchAgentServerPolicy",
+            opts=self.child_opts())
+
+        aws.eks.Addon("amazon-cloudwatch-observability",
+            cluster_name=eks.cluster_name,
+            addon_name="amazon-cloudwatch-observability",
+            resolve_conflicts_on_update="OVERWRITE",
+            opts=self.child_opts(depends_on=[agent_policy]))
+
+        # The lowest pending count of each minute stays above zero only while
+        # some pod waits the whole minute
+        minutes = autoscaler_config.get("pending_alarm_minutes", 5)
+        aws.cloudwatch.MetricAlarm("pods-pending",
+            alarm_description=f"Pods have waited over {minutes} minutes for a node",
+            namespace="ContainerInsights",
+            metric_name="pod_status_pending",
+            dimensions={"ClusterName": eks.cluster_name},
+            statistic="Minimum",
+            period=60,
+            evaluation_periods=minutes,
+            comparison_operator="GreaterThanThreshold",
+            threshold=0,
+            treat_missing_data="notBreaching",
+            opts=self.child_opts())
+
+    # _karpenter installs Karpenter, which launches right-sized nodes for
+    # Pending pods directly instead of resizing the node group (the node group
+    # stays as baseline capacity). Nodes reuse the node group's role, subnets
+    # and security group. karpenter_pods_startup_duration_seconds is exposed on
+    # an annotated Service for a Prometheus, if the cluster runs one.
+    def _karpenter(self, eks, open_id_connect_provider, k8s_provider):
+        role = aws.iam.Role("karpenter-irsa",
+            assume_role_policy=irsa_assume_role_policy(
+                open_id_connect_provider, "system:serviceaccount:kube-system:karpenter"
+            ).json,
+            opts=self.child_opts())
+
+        policy = aws.iam.Policy("karpenter-policy",
+            policy=pulumi.Output.all(
+                cluster_name=eks.cluster_name,
+                node_role_arn=eks.node_role_arn
+            ).apply(lambda args: json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "ec2:CreateFleet",
+                            "ec2:CreateLaunchTemplate",
+                            "ec2:CreateTags",
+                            "ec2:DeleteLaunchTemplate",
+                            "ec2:Describe*",
+                            "ec2:RunInstances",
+                            "ec2:TerminateInstances",
+                            "iam:AddRoleToInstanceProfile",
+                            "iam:CreateInstanceProfile",
+                            "iam:DeleteInstanceProfile",
+                            "iam:GetInstanceProfile",
+                            "iam:RemoveRoleFromInstanceProfile",
+                            "iam:TagInstanceProfile",
+                            "pricing:GetProducts",
+                            "ssm:GetParameter"
+                        ],
+                        "Resource": "*"
+                    },
+                    {
+                        "Effect": "Allow",
+                        "Action": "iam:PassRole",
+                        "Resource": args["node_role_arn"]
+                    },
+                    {
+                        "Effect": "Allow",
+                        "Action": "eks:DescribeCluster",
+                        "Resource": f"arn:aws:eks:{aws.config.region}:*:cluster/{args['cluster_name']}"
+                    }
+                ]
+            })),
+            opts=self.child_opts())
+
+        aws.iam.RolePolicyAttachment("karpenter-policy-attachment",
+            role=role.name,
+            policy_arn=policy.arn,
+            opts=self.child_opts())
+
+        karpenter_chart = k8s.helm.v4.Chart(
+            "karpenter",
+            chart="oci://public.ecr.aws/karpenter/karpenter",
+            version=autoscaler_config.get("helm_chart_version", "1.0.8"),
+            namespace="kube-system",
+            values={
+                "settings": {
+                    "clusterName": eks.cluster_name,
+                    "clusterEndpoint": eks.cluster_endpoint,
+                },
+                "serviceAccount": {
+                    "name": "karpenter",
+                    "annotations": {"eks.amazonaws.com/role-arn": role.arn},
+                },
+                "service": {
+                    "annotations": {
+                        "prometheus.io/scrape": "true",
+                        "prometheus.io/port": "8080",
+                    },
+                },
+            },
+            opts=self.child_opts(provider=k8s_provider)
+        )
+
+        # Where and how Karpenter launches nodes, and when it removes them
+        k8s.yaml.v2.ConfigGroup(
+            "karpenter-node-pool",
+            objs=[
+                {
+                    "apiVersion": "karpenter.k8s.aws/v1",
+                    "kind": "EC2NodeClass",
+                    "metadata": {"name": "default"},
+                    "spec": {
+                        # Karpenter sizes max pods from ENI addresses, which
+                        # prefix delegation (vpc_cni, see eks.py) lifts
+                        **({"kubelet": {"maxPods": 110}} if vpc_cni_config.get("prefix_delegation") else {}),
+                        "amiSelectorTerms": [{"alias": "al2023@latest"}],
+                        "role": eks.node_role_name,
+                        "subnetSelectorTerms": pulumi.Output.from_input(eks.node_subnet_ids).apply(
+                            lambda subnet_ids: [{"id": subnet_id} for subnet_id in subnet_ids]
+                        ),
+                        "securityGroupSelectorTerms": [{"id": eks.node_security_group_id}],
+                    },
+                },
+                {
+                    "apiVersion": "karpenter.sh/v1",
+                    "kind": "NodePool",
+                    "metadata": {"name": "default"},
+                    "spec": {
+                        "template": {
+                            "spec": {
+                                "nodeClassRef": {"group": "karpenter.k8s.aws", "kind": "EC2NodeClass", "name": "default"},
+                                "requirements": [
+                                    {"key": "kubernetes.io/arch", "operator": "In", "values": ["amd64"]},
+                                    {"key": "karpenter.sh/capacity-type", "operator": "In", "values": ["on-demand"]},
+                                ],
+                            },
+                        },
+                        "limits": {"cpu": autoscaler_config.get("cpu_limit", 16)},
+                        "disruption": {
+                            "consolidationPolicy": "WhenEmptyOrUnderutilized",
+                            "consolidateAfter": autoscaler_config.get("scale_down_unneeded_time", "10m"),
+                        },
+                    },
+                },
+            ],
+            opts=self.child_opts(
+                provider=k8s_provider,
+                depends_on=karpenter_chart
+            )
+        )
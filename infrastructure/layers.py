@@ -0,0 +1,113 @@
+import pulumi
+
+# Each tier of the stack (network, eks, apps, ...) is a Layer: a
+# ComponentResource with explicit inputs (other layers) and outputs. __main__.py
+# instantiates the layers listed in the `layers` config value; a layer that is
+# not instantiated can instead be read from another stack's outputs through
+# `layer_stacks`, which lets tiers live in separate stacks:
+#
+# infrastructure:layers: [apps]
+# infrastructure:layer_stacks:
+#   network: organization/infrastructure/dev-network
+#   eks: organization/infrastructure/dev-eks
+#
+# Dropping a layer from `layers` in a stack that already deployed it deletes
+# its resources from that stack, so only do that when another stack owns them.
+
+# LAYERS lists every layer in dependency order.
+LAYERS = ["network", "db_secret", "ecr", "eks", "database", "backups", "aws_config", "apps"]
+
+# DEPENDENCIES maps each layer to the layers it takes as inputs.
+DEPENDENCIES = {
+    "eks": ["network"],
+    "database": ["network", "db_secret"],
+    "apps": ["eks", "ecr", "db_secret"],
+}
+
+
+class Layer(pulumi.ComponentResource):
+    def __init__(self, layer, name, opts=None):
+        # Resources used to live at the root of the stack. Aliasing direct
+        # children to the root keeps their URNs, so existing stacks don't
+        # replace anything when the layer is introduced.
+        opts = pulumi.ResourceOptions.merge(opts, pulumi.ResourceOptions(
+            transformations=[self._alias_to_root],
+        ))
+        super().__init__(f"wiz:layers:{layer}", name, None, opts)
+        self.layer = layer
+        self.outputs = {}
+
+    def _alias_to_root(self, args):
+        if args.opts.parent is not self:
+            return None
+        args.opts.aliases = [*(args.opts.aliases or []), pulumi.Alias(parent=pulumi.ROOT_STACK_RESOURCE)]
+        return pulumi.ResourceTransformationResult(args.props, args.opts)
+
+    # child_opts returns resource options parenting a resource to this layer.
+    def child_opts(self, **kwargs):
+        return pulumi.ResourceOptions(parent=self, **kwargs)
+
+    # export sets the layer's outputs as attributes and registers them.
+    def export(self, **outputs):
+        for key, value in outputs.items():
+            setattr(self, key, value)
+        self.outputs = outputs
+        self.register_outputs(outputs)
+
+
+# local_layers returns the given layers that are built in this stack, for use
+# in depends_on; layers read from other stacks are already deployed.
+def local_layers(*layers):
+    return [layer for layer in layers if isinstance(layer, Layer)]
+
+
+# RemoteLayer exposes the outputs another stack exported for a layer under the
+# same attribute names as the Layer itself. The stack reference is only read
+# once a layer built here actually uses one of the outputs.
+class RemoteLayer:
+    def __init__(self, layer, stack):
+        self.layer = layer
+        self.stack = stack
+        self._outputs = None
+
+    def __getattr__(self, key):
+        if key.startswith("_"):
+            raise AttributeError(key)
+        if self._outputs is None:
+            self._outputs = pulumi.StackReference(f"{self.layer}-ref", stack_name=self.stack).get_output(self.layer)
+        return self._outputs.apply(lambda outputs: outputs[key])
+
+
+# LayerSet builds the selected layers and resolves the others remotely.
+class LayerSet:
+    def __init__(self, config):
+        self.selected = set(config.get_object("layers") or LAYERS)
+        self.stacks = config.get_object("layer_stacks") or {}
+        unknown = (self.selected | set(self.stacks)) - set(LAYERS)
+        if unknown:
+            raise pulumi.RunError(f"unknown layers {sorted(unknown)}; expected some of {LAYERS}")
+        self._layers = {}
+
+    # add builds the layer when selected and exports its outputs under the
+    # layer name, so other stacks can reference it.
+    def add(self, layer, build):
+        if layer in self.selected:
+            instance = build()
+            pulumi.export(layer, instance.outputs)
+        elif layer in self.stacks:
+            instance = RemoteLayer(layer, self.stacks[layer])
+        else:
+            instance = None
+        self._layers[layer] = instance
+        return instance
+
+    def __getitem__(self, layer):
+        instance = self._layers.get(layer)
+        if instance is None:
+            raise pulumi.RunError(
+                f"layer {layer!r} is needed but neither selected in `layers` nor mapped in `layer_stacks`"
+            )
+        return instance
+
+    def __contains__(self, layer):
+        return self._layers.get(layer) is not None
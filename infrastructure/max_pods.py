@@ -0,0 +1,71 @@
+import argparse
+import invoke_cache
+
+# max_pods computes the kubelet max-pods of EKS nodes the way
+# amazon-eks-ami's max-pods-calculator.sh does: from the network interfaces
+# (ENIs) and IPv4 addresses per ENI of the instance type, whether the VPC CNI
+# assigns prefixes instead of single addresses, and whether pods get their
+# addresses from custom networking (see eks.py).
+#
+#   python max_pods.py t3.medium --prefix-delegation   # print max-pods for a type
+
+# vCPUs, ENIs and IPv4 addresses per ENI of the instance types the nodes are
+# expected to run on. Other types are looked up with ec2:DescribeInstanceTypes.
+INSTANCE_TYPES = {
+    "t3.small": (2, 3, 4),
+    "t3.medium": (2, 3, 6),
+    "t3.large": (2, 3, 12),
+    "t3.xlarge": (4, 4, 15),
+    "t3.2xlarge": (8, 4, 15),
+    "m5.large": (2, 3, 10),
+    "m5.xlarge": (4, 4, 15),
+    "m5.2xlarge": (8, 4, 15),
+    "m5.4xlarge": (16, 8, 30),
+    "m6i.large": (2, 3, 10),
+    "m6i.xlarge": (4, 4, 15),
+    "m6i.2xlarge": (8, 4, 15),
+    "m6i.4xlarge": (16, 8, 30),
+    "c6i.large": (2, 3, 10),
+    "c6i.xlarge": (4, 4, 15),
+    "c6i.2xlarge": (8, 4, 15),
+}
+
+# Addresses in each /28 prefix the VPC CNI assigns with prefix delegation
+PREFIX_ADDRESSES = 16
+
+
+# instance_limits returns the vCPUs, ENIs and IPv4 addresses per ENI of an
+# instance type.
+def instance_limits(instance_type):
+    if instance_type in INSTANCE_TYPES:
+        return INSTANCE_TYPES[instance_type]
+    info = invoke_cache.instance_type_info(instance_type)
+    return info["vcpus"], info["enis"], info["ipv4_per_eni"]
+
+
+# max_pods returns the kubelet max-pods for an instance type. Each ENI's
+# first address belongs to the ENI itself; the 2 are host-network pods
+# (aws-node, kube-proxy) that take no address.
+def max_pods(instance_type, prefix_delegation=False, custom_networking=False):
+    vcpus, enis, addresses = instance_limits(instance_type)
+    if custom_networking:
+        enis -= 1  # the primary ENI stays in the node subnet
+    if prefix_delegation:
+        # Addresses stop being the limit; kubelet's are 110 pods, or 250
+        # on nodes with 30 or more vCPUs
+        return min(enis * (addresses - 1) * PREFIX_ADDRESSES + 2, 110 if vcpus < 30 else 250)
+    return enis * (addresses - 1) + 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the kubelet max-pods for EKS node instance types.")
+    parser.add_argument("instance_types", nargs="*", default=sorted(INSTANCE_TYPES))
+    parser.add_argument("--prefix-delegation", action="store_true")
+    parser.add_argument("--custom-networking", action="store_true")
+    args = parser.parse_args(argv)
+    for instance_type in args.instance_types:
+        print(f"{instance_type:<12} {max_pods(instance_type, args.prefix_delegation, args.custom_networking)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,125 +1,274 @@
+import ipaddress
 import pulumi
 import pulumi_aws as aws
+import invoke_cache
+from layers import Layer
 
-# Load Pulumi configuration and needed variables
-config = pulumi.Config()
-vpc_config = config.require_object("vpc")
-internal_domain = config.require("internal_domain")
-
-# Create a VPC
-vpc = aws.ec2.Vpc(
-    "vpc",
-    cidr_block=vpc_config["cidr_block"],
-    enable_dns_hostnames=True,
-    enable_dns_support=True
-)
-
-# Create Public Subnets in two different AZs
-public_subnet_a = aws.ec2.Subnet(
-    "public-subnet-a",
-    vpc_id=vpc.id,
-    cidr_block=vpc_config["public_subnet_a"],
-    map_public_ip_on_launch=True,
-    availability_zone="us-east-1a",
-    tags={"Name": "public-subnet-a"}
-)
-
-public_subnet_b = aws.ec2.Subnet(
-    "public-subnet-b",
-    vpc_id=vpc.id,
-    cidr_block=vpc_config["public_subnet_b"],
-    map_public_ip_on_launch=True,
-    availability_zone="us-east-1b",
-    tags={"Name": "public-subnet-b"}
-)
-
-# Create Private Subnets in two different AZs
-private_subnet_a = aws.ec2.Subnet(
-    "private-subnet-a",
-    vpc_id=vpc.id,
-    cidr_block=vpc_config["private_subnet_a"],
-    map_public_ip_on_launch=False,
-    availability_zone="us-east-1a",
-    tags={"Name": "private-subnet-a", "kubernetes.io/role/internal-elb": "1"}
-)
-
-private_subnet_b = aws.ec2.Subnet(
-    "private-subnet-b",
-    vpc_id=vpc.id,
-    cidr_block=vpc_config["private_subnet_b"],
-    map_public_ip_on_launch=False,
-    availability_zone="us-east-1b",
-    tags={"Name": "private-subnet-b", "kubernetes.io/role/internal-elb": "1"}
-)
-
-# Internet Gateway for Public Subnet
-igw = aws.ec2.InternetGateway("internet-gateway", vpc_id=vpc.id)
-
-# Route Table for Public Subnet
-public_route_table = aws.ec2.RouteTable(
-    "public-route-table",
-    vpc_id=vpc.id,
-    routes=[aws.ec2.RouteTableRouteArgs(
-        cidr_block="0.0.0.0/0",
-        gateway_id=igw.id
-    )]
-)
-
-# Associate Public Subnets with Public Route Table
-aws.ec2.RouteTableAssociation(
-    "public-subnet-a-association",
-    route_table_id=public_route_table.id,
-    subnet_id=public_subnet_a.id
-)
-
-aws.ec2.RouteTableAssociation(
-    "public-subnet-b-association",
-    route_table_id=public_route_table.id,
-    subnet_id=public_subnet_b.id
-)
-
-# Create an Elastic IP for NAT Gateway
-nat_eip = aws.ec2.Eip("nat-eip", domain="vpc")
-
-# Create NAT Gateway in the Public Subnet
-nat_gateway = aws.ec2.NatGateway(
-    "nat-gateway",
-    subnet_id=public_subnet_a.id,
-    allocation_id=nat_eip.id
-)
-
-# Route Table for Private Subnet with NAT Gateway
-private_route_table = aws.ec2.RouteTable(
-    "private-route-table",
-    vpc_id=vpc.id,
-    routes=[aws.ec2.RouteTableRouteArgs(
-        cidr_block="0.0.0.0/0",
-        nat_gateway_id=nat_gateway.id
-    )]
-)
-
-# Associate Private Subnets with Private Route Table
-aws.ec2.RouteTableAssociation(
-    "private-subnet-a-association",
-    route_table_id=private_route_table.id,
-    subnet_id=private_subnet_a.id
-)
-
-aws.ec2.RouteTableAssociation(
-    "private-subnet-b-association",
-    route_table_id=private_route_table.id,
-    subnet_id=private_subnet_b.id
-)
-
-# Create private hosted zone
-private_zone = aws.route53.Zone("internalZone",
-    name=internal_domain,
-    vpcs=[{
-        "vpcId": vpc.id,
-    }],
-)
-
-# Export resources
-# pulumi.export("vpc_id", vpc.id)
-# pulumi.export("public_subnets", [public_subnet_a.id, public_subnet_b.id])
-# pulumi.export("private_subnets", [private_subnet_a.id, private_subnet_b.id])
\ No newline at end of file
+# AWS services the private subnets reach through interface endpoints when
+# vpc.endpoints.interface is true: image pulls (ecr.api, ecr.dkr), IRSA
+# (sts), External Secrets (secretsmanager) and log shipping (logs).
+INTERFACE_ENDPOINT_SERVICES = ["ecr.api", "ecr.dkr", "sts", "secretsmanager", "logs"]
+
+
+# availability_zones returns the zones the VPC spans: vpc.availability_zones,
+# or the first vpc.zones (default 2) of the region's available zones.
+def availability_zones(vpc_config):
+    if vpc_config.get("availability_zones"):
+        return vpc_config["availability_zones"]
+    zones = invoke_cache.available_zones()
+    count = vpc_config.get("zones", 2)
+    if count > len(zones):
+        raise ValueError(f"vpc.zones is {count} but {aws.config.region} has {len(zones)} available zones")
+    return zones[:count]
+
+
+# zone_suffix returns the letter resources in a zone are named after, e.g. "a"
+# for us-east-1a.
+def zone_suffix(zone):
+    return zone.removeprefix(aws.config.region)
+
+
+# carve_subnets splits cidr_block into subnets of the given prefix lengths, in
+# order, each aligned to its size and skipping the reserved CIDRs.
+def carve_subnets(cidr_block, prefixes, reserved=()):
+    network = ipaddress.ip_network(cidr_block)
+    taken = [ipaddress.ip_network(cidr) for cidr in reserved]
+    subnets = []
+    for prefix in prefixes:
+        for subnet in network.subnets(new_prefix=prefix):
+            if not any(subnet.overlaps(other) for other in taken):
+                break
+        else:
+            raise ValueError(f"{cidr_block} has no room left for another /{prefix} subnet")
+        subnets.append(subnet)
+        taken.append(subnet)
+    return subnets
+
+
+class NetworkLayer(Layer):
+    def __init__(self, name, opts=None):
+        super().__init__("network", name, opts)
+
+        # Load Pulumi configuration and needed variables
+        config = pulumi.Config()
+        vpc_config = config.require_object("vpc")
+        internal_domain = config.require("internal_domain")
+
+        # Create a VPC
+        vpc = aws.ec2.Vpc(
+            "vpc",
+            cidr_block=vpc_config["cidr_block"],
+            enable_dns_hostnames=True,
+            enable_dns_support=True,
+            opts=self.child_opts()
+        )
+
+        # Public and private subnets in each zone, carved out of the VPC CIDR
+        # unless public_subnets/private_subnets list them per zone
+        zones = availability_zones(vpc_config)
+        public_cidrs = (vpc_config.get("public_subnets") or [])[:len(zones)]
+        private_cidrs = (vpc_config.get("private_subnets") or [])[:len(zones)]
+        missing_public = len(zones) - len(public_cidrs)
+        generated = [str(cidr) for cidr in carve_subnets(
+            vpc_config["cidr_block"],
+            [vpc_config.get("public_prefix", 24)] * missing_public
+            + [vpc_config.get("private_prefix", 20)] * (len(zones) - len(private_cidrs)),
+            reserved=public_cidrs + private_cidrs,
+        )]
+        public_cidrs += generated[:missing_public]
+        private_cidrs += generated[missing_public:]
+
+        public_subnets = []
+        private_subnets = []
+        for zone, public_cidr, private_cidr in zip(zones, public_cidrs, private_cidrs):
+            suffix = zone_suffix(zone)
+            public_subnets.append(aws.ec2.Subnet(
+                f"public-subnet-{suffix}",
+                vpc_id=vpc.id,
+                cidr_block=public_cidr,
+                map_public_ip_on_launch=True,
+                availability_zone=zone,
+                # Internet-facing load balancers (see k8s.py) go in these subnets
+                tags={"Name": f"public-subnet-{suffix}", "kubernetes.io/role/elb": "1"},
+                opts=self.child_opts()
+            ))
+            private_subnets.append(aws.ec2.Subnet(
+                f"private-subnet-{suffix}",
+                vpc_id=vpc.id,
+                cidr_block=private_cidr,
+                map_public_ip_on_launch=False,
+                availability_zone=zone,
+                tags={"Name": f"private-subnet-{suffix}", "kubernetes.io/role/internal-elb": "1"},
+                opts=self.child_opts()
+            ))
+
+        # With vpc.pod_cidr_block (e.g. 100.64.0.0/16) pods take their IPs from
+        # a secondary CIDR, split into a pod subnet per zone (see the ENIConfigs
+        # in eks.py), instead of competing with the nodes for the private
+        # subnets' addresses.
+        vpc_cidr_blocks = [vpc.cidr_block]
+        pod_subnets = []
+        pod_cidr_block = vpc_config.get("pod_cidr_block")
+        if pod_cidr_block:
+            pod_cidr = aws.ec2.VpcIpv4CidrBlockAssociation(
+                "pod-cidr",
+                vpc_id=vpc.id,
+                cidr_block=pod_cidr_block,
+                opts=self.child_opts()
+            )
+            vpc_cidr_blocks.append(pod_cidr.cidr_block)
+            pod_cidrs = carve_subnets(pod_cidr_block, [vpc_config.get("pod_prefix", 18)] * len(zones))
+            for zone, pod_cidr_subnet in zip(zones, pod_cidrs):
+                suffix = zone_suffix(zone)
+                pod_subnets.append(aws.ec2.Subnet(
+                    f"pod-subnet-{suffix}",
+                    vpc_id=pod_cidr.vpc_id,  # created once the CIDR is associated
+                    cidr_block=str(pod_cidr_subnet),
+                    map_public_ip_on_launch=False,
+                    availability_zone=zone,
+                    tags={"Name": f"pod-subnet-{suffix}"},
+                    opts=self.child_opts()
+                ))
+
+        # Internet Gateway for Public Subnet
+        igw = aws.ec2.InternetGateway("internet-gateway", vpc_id=vpc.id, opts=self.child_opts())
+
+        # Route Table for Public Subnet
+        public_route_table = aws.ec2.RouteTable(
+            "public-route-table",
+            vpc_id=vpc.id,
+            routes=[aws.ec2.RouteTableRouteArgs(
+                cidr_block="0.0.0.0/0",
+                gateway_id=igw.id
+            )],
+            opts=self.child_opts()
+        )
+
+        # Associate Public Subnets with Public Route Table
+        for zone, public_subnet in zip(zones, public_subnets):
+            aws.ec2.RouteTableAssociation(
+                f"public-subnet-{zone_suffix(zone)}-association",
+                route_table_id=public_route_table.id,
+                subnet_id=public_subnet.id,
+                opts=self.child_opts()
+            )
+
+        # One NAT gateway for the whole VPC, or with nat_gateways: per_az one in
+        # each zone with its own private route table, so a zone's egress
+        # doesn't cross zones and doesn't depend on another zone's gateway.
+        # The first zone keeps the single-NAT names, so switching modes only
+        # adds or removes the other zones' gateways.
+        per_az_nat = vpc_config.get("nat_gateways", "single") == "per_az"
+        private_route_tables = []
+        for index, (zone, public_subnet, private_subnet) in enumerate(zip(zones, public_subnets, private_subnets)):
+            if index == 0 or per_az_nat:
+                suffix = f"-{zone_suffix(zone)}" if index else ""
+
+                # Create an Elastic IP for NAT Gateway
+                nat_eip = aws.ec2.Eip(f"nat-eip{suffix}", domain="vpc", opts=self.child_opts())
+
+                # Create NAT Gateway in the Public Subnet
+                nat_gateway = aws.ec2.NatGateway(
+                    f"nat-gateway{suffix}",
+                    subnet_id=public_subnet.id,
+                    allocation_id=nat_eip.id,
+                    opts=self.child_opts()
+                )
+
+                # Route Table for Private Subnet with NAT Gateway
+                private_route_table = aws.ec2.RouteTable(
+                    f"private-route-table{suffix}",
+                    vpc_id=vpc.id,
+                    routes=[aws.ec2.RouteTableRouteArgs(
+                        cidr_block="0.0.0.0/0",
+                        nat_gateway_id=nat_gateway.id
+                    )],
+                    opts=self.child_opts()
+                )
+                private_route_tables.append(private_route_table)
+
+            # Associate Private Subnet with its zone's Private Route Table
+            aws.ec2.RouteTableAssociation(
+                f"private-subnet-{zone_suffix(zone)}-association",
+                route_table_id=private_route_table.id,
+                subnet_id=private_subnet.id,
+                opts=self.child_opts()
+            )
+            if pod_subnets:
+                aws.ec2.RouteTableAssociation(
+                    f"pod-subnet-{zone_suffix(zone)}-association",
+                    route_table_id=private_route_table.id,
+                    subnet_id=pod_subnets[index].id,
+                    opts=self.child_opts()
+                )
+
+        # VPC endpoints keep AWS API and S3 traffic off the NAT gateway and the
+        # internet gateway, e.g.
+        #   endpoints: {s3: true, interface: true}
+        # or interface: [ecr.api, ecr.dkr] for a subset of the services.
+        endpoints_config = vpc_config.get("endpoints") or {}
+        if endpoints_config.get("s3"):
+            # Gateway endpoints are free and work through route tables: the db
+            # instance's backups (public subnets) and image layers pulled by the
+            # nodes (private subnets) both reach S3 directly.
+            aws.ec2.VpcEndpoint(
+                "s3-endpoint",
+                vpc_id=vpc.id,
+                service_name=f"com.amazonaws.{aws.config.region}.s3",
+                vpc_endpoint_type="Gateway",
+                route_table_ids=[public_route_table.id] + [table.id for table in private_route_tables],
+                tags={"Name": "s3-endpoint"},
+                opts=self.child_opts()
+            )
+
+        interface_services = endpoints_config.get("interface")
+        if interface_services:
+            if interface_services is True:
+                interface_services = INTERFACE_ENDPOINT_SERVICES
+            endpoints_sg = aws.ec2.SecurityGroup(
+                "vpc-endpoints-sg",
+                vpc_id=vpc.id,
+                description="HTTPS from the VPC to the interface endpoints",
+                ingress=[{
+                    "protocol": "tcp",
+                    "from_port": 443,
+                    "to_port": 443,
+                    "cidr_blocks": vpc_cidr_blocks,
+                }],
+                tags={"Name": "vpc-endpoints-sg"},
+                opts=self.child_opts()
+            )
+            # Private DNS resolves the services' regular hostnames to the
+            # endpoints, so clients need no configuration.
+            for service in interface_services:
+                aws.ec2.VpcEndpoint(
+                    f"{service.replace('.', '-')}-endpoint",
+                    vpc_id=vpc.id,
+                    service_name=f"com.amazonaws.{aws.config.region}.{service}",
+                    vpc_endpoint_type="Interface",
+                    private_dns_enabled=True,
+                    subnet_ids=[subnet.id for subnet in private_subnets],
+                    security_group_ids=[endpoints_sg.id],
+                    tags={"Name": f"{service}-endpoint"},
+                    opts=self.child_opts()
+                )
+
+        # Create private hosted zone
+        private_zone = aws.route53.Zone("internalZone",
+            name=internal_domain,
+            vpcs=[{
+                "vpcId": vpc.id,
+            }],
+            opts=self.child_opts()
+        )
+
+        self.export(
+            vpc_id=vpc.id,
+            vpc_cidr_block=vpc.cidr_block,
+            vpc_cidr_blocks=vpc_cidr_blocks,
+            availability_zones=zones,
+            public_subnet_ids=[subnet.id for subnet in public_subnets],
+            private_subnet_ids=[subnet.id for subnet in private_subnets],
+            pod_subnet_ids=[subnet.id for subnet in pod_subnets],
+            private_zone_id=private_zone.id,
+        )
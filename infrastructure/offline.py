@@ -0,0 +1,670 @@
+import argparse
+import builtins
+import contextlib
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+import pulumi
+from stack_config import PROJECT, load_stack_config, partial_config
+
+# offline evaluates the whole Pulumi program in-process against
+# pulumi.runtime.set_mocks, checks the resulting resource graph and records
+# per-module and per-layer evaluation cost, so changes can be checked in seconds without
+# AWS credentials or a `pulumi preview` round trip. It also checks deploy.py's
+# scheduling and stack checks against a fake runner and, when the pulumi CLI
+# is installed, a temporary file backend.
+#
+#   python offline.py                    # evaluate, check and compare against the baseline
+#   python offline.py --update-baseline  # accept the current graph (and record timings locally)
+#   python offline.py --timing           # also fail when evaluation got slower than recorded
+#   python offline.py --json             # print the full report
+#   python offline.py --layers apps      # evaluate some layers, mocking the rest
+#
+# Config overrides evaluate alternatives against the same checks, and
+# comparing against the stack's baseline shows how the graph differs:
+#
+#   python offline.py --config 'database={"engine": "aurora"}'
+#   python offline.py --config 'database={"engine": "ec2", "instance_type": "m7i.xlarge"}'  # looked up, not in pg_tuning's table
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, "offline-baseline.json")
+
+# Evaluation times depend on the machine, so they are recorded next to the
+# checkout rather than in the committed baseline, and only compared with --timing.
+TIMING_PATH = os.path.join(HERE, ".offline-timing.json")
+
+# The modules that make up the program; everything else is attributed to __main__.
+PROGRAM_MODULES = sorted(
+    name[:-3] for name in os.listdir(HERE)
+    if name.endswith(".py") and name not in ("__main__.py", "offline.py")
+)
+
+ACCOUNT_ID = "123456789012"
+
+REGION = "us-east-1"
+
+# Outputs the mocked providers add on top of the resource inputs, keyed by type.
+RESOURCE_OUTPUTS = {
+    "aws:eks/cluster:Cluster": lambda name, inputs: {
+        "name": name,
+        "endpoint": f"https://{name}.gr7.{REGION}.eks.amazonaws.com",
+        "certificateAuthority": {"data": "Y2VydGlmaWNhdGU="},
+        "vpcConfig": {**inputs.get("vpcConfig", {}), "clusterSecurityGroupId": f"sg-{name}"},
+        "identities": [{"oidcs": [{"issuer": f"https://oidc.eks.{REGION}.amazonaws.com/id/{name.upper()}"}]}],
+    },
+    "aws:ec2/instance:Instance": lambda name, inputs: {
+        "availabilityZone": f"{REGION}a",
+        "privateIp": "10.0.1.10",
+        "publicDns": f"ec2-1-2-3-4.compute-1.amazonaws.com",
+    },
+    "aws:ec2/launchTemplate:LaunchTemplate": lambda name, inputs: {
+        "latestVersion": 1,
+    },
+    "aws:ecr/repository:Repository": lambda name, inputs: {
+        "repositoryUrl": f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com/{name}",
+    },
+    "aws:iam/openIdConnectProvider:OpenIdConnectProvider": lambda name, inputs: {
+        "arn": f"arn:aws:iam::{ACCOUNT_ID}:oidc-provider/{inputs.get('url', '').replace('https://', '')}",
+    },
+    "aws:secretsmanager/secret:Secret": lambda name, inputs: {
+        "name": inputs.get("name", name),
+    },
+    "aws:secretsmanager/secretVersion:SecretVersion": lambda name, inputs: {
+        "versionId": f"{name}-version",
+    },
+    "aws:rds/cluster:Cluster": lambda name, inputs: {
+        "endpoint": f"{name}.cluster-abcdefghijkl.{REGION}.rds.amazonaws.com",
+        "readerEndpoint": f"{name}.cluster-ro-abcdefghijkl.{REGION}.rds.amazonaws.com",
+    },
+    "docker-build:index:Image": lambda name, inputs: {
+        "ref": f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com/{name}@sha256:0000",
+    },
+    "random:index/randomPassword:RandomPassword": lambda name, inputs: {
+        "result": "mock-password",
+    },
+    "kubernetes:core/v1:Service": lambda name, inputs: {
+        "status": {"loadBalancer": {"ingress": [{"hostname": f"{name}.elb.{REGION}.amazonaws.com"}]}},
+    },
+    "pulumi:pulumi:StackReference": lambda name, inputs: {
+        "outputs": REMOTE_LAYER_OUTPUTS.get(name.removesuffix("-ref"), {}),
+    },
+}
+
+# Outputs of layers read from other stacks (see layers.RemoteLayer), keyed by
+# layer, for evaluating a subset of the layers with --layers.
+REMOTE_LAYER_OUTPUTS = {
+    "network": {"network": {
+        "vpc_id": "vpc-0123456789abcdef0",
+        "vpc_cidr_block": "10.0.0.0/16",
+        "vpc_cidr_blocks": ["10.0.0.0/16"],
+        "availability_zones": [f"{REGION}a", f"{REGION}b"],
+        "public_subnet_ids": ["subnet-public-1", "subnet-public-2"],
+        "private_subnet_ids": ["subnet-private-1", "subnet-private-2"],
+        "pod_subnet_ids": ["subnet-pod-1", "subnet-pod-2"],
+        "private_zone_id": "Z0123456789ABCDEFGHIJ",
+    }},
+    "db_secret": {"db_secret": {
+        "secret_name": "web-app-postgres",
+        "secret_arn": f"arn:aws:secretsmanager:{REGION}:{ACCOUNT_ID}:secret:web-app-postgres",
+        "secret_version_id": "dbSecretVersion-version",
+    }},
+    "ecr": {"ecr": {
+        "repository_url": f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com/ultratic-redux",
+    }},
+    "eks": {"eks": {
+        "cluster_name": "eks-cluster",
+        "cluster_endpoint": f"https://eks-cluster.gr7.{REGION}.eks.amazonaws.com",
+        "oidc_issuer": f"https://oidc.eks.{REGION}.amazonaws.com/id/EKS-CLUSTER",
+        "node_security_group_id": "sg-0123456789abcdef0",
+        "node_role_arn": f"arn:aws:iam::{ACCOUNT_ID}:role/eks-node-role",
+        "node_role_name": "eks-node-role",
+        "node_subnet_ids": ["subnet-private-1", "subnet-private-2"],
+        "vpc_id": "vpc-0123456789abcdef0",
+        "kubeconfig": "{}",
+    }},
+}
+
+# Results of the data-source invokes the program makes.
+INVOKE_RESULTS = {
+    "aws:index/getCallerIdentity:getCallerIdentity": lambda args: {
+        "accountId": ACCOUNT_ID, "arn": f"arn:aws:iam::{ACCOUNT_ID}:user/offline", "userId": "OFFLINE", "id": ACCOUNT_ID,
+    },
+    "aws:index/getAvailabilityZones:getAvailabilityZones": lambda args: {
+        "id": REGION, "names": [f"{REGION}{zone}" for zone in "abcdef"],
+        "zoneIds": [f"use1-az{index}" for index in range(1, 7)], "groupNames": [REGION] * 6,
+    },
+    "aws:ec2/getInstanceType:getInstanceType": lambda args: {
+        "id": args["instanceType"], "instanceType": args["instanceType"],
+        "defaultVcpus": 4, "memorySize": 16384, "maximumNetworkInterfaces": 4, "maximumIpv4AddressesPerInterface": 15,
+    },
+    "aws:ec2/getAmi:getAmi": lambda args: {"id": "ami-0123456789abcdef0", "imageId": "ami-0123456789abcdef0"},
+    "aws:ecr/getAuthorizationToken:getAuthorizationToken": lambda args: {
+        "authorizationToken": "token", "password": "password", "userName": "AWS",
+        "proxyEndpoint": f"https://{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com", "expiresAt": "", "id": REGION,
+    },
+    "aws:iam/getPolicyDocument:getPolicyDocument": lambda args: {
+        "json": json.dumps({"Version": "2012-10-17", "Statement": args.get("statements", [])}, default=str),
+    },
+    "tls:index/getCertificate:getCertificate": lambda args: {
+        "url": args["url"], "certificates": [{"sha1Fingerprint": "0" * 40}], "id": args["url"],
+    },
+    "aws:secretsmanager/getSecretVersion:getSecretVersion": lambda args: {
+        "arn": args["secretId"], "id": args["secretId"], "secretId": args["secretId"],
+        "versionId": args.get("versionId", ""), "versionStage": "AWSCURRENT", "versionStages": ["AWSCURRENT"],
+        "createdDate": "", "secretBinary": "",
+        "secretString": json.dumps({"username": "ultratic", "password": "mock-password", "host": "db-instance.wiz.internal", "port": 5432, "db": "ultratic"}),
+    },
+    "std:index:replace": lambda args: {
+        "result": args["text"].replace(args["search"], args["replace"]),
+    },
+}
+
+
+class InfraMocks(pulumi.runtime.Mocks):
+    def __init__(self, timer):
+        self.resources = {}
+        self.invokes = []
+        self.timer = timer
+
+    def new_resource(self, args):
+        outputs = dict(args.inputs)
+        extra = RESOURCE_OUTPUTS.get(args.typ)
+        if extra:
+            outputs.update(extra(args.name, args.inputs))
+        outputs.setdefault("arn", f"arn:aws:mock:{REGION}:{ACCOUNT_ID}:{args.name}")
+        self.resources[(args.typ, args.name)] = args.inputs
+        return [f"{args.name}-id", outputs]
+
+    def call(self, args):
+        self.invokes.append((args.token, self.timer.current()))
+        result = INVOKE_RESULTS.get(args.token)
+        return (result(args.args) if result else {}), []
+
+
+# _ImportTimer records the exclusive import time of each program module, and
+# the construction time of each layer, and tracks which one is being
+# evaluated, so resources and invokes can be attributed to it. Work that
+# happens after the imports return (output-form invokes, applies) is
+# attributed to "(async)".
+class _ImportTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.running = False
+        self._stack = []
+        self._import = builtins.__import__
+
+    def current(self):
+        if self._stack:
+            return self._stack[-1][0]
+        return "__main__" if self.running else "(async)"
+
+    def __call__(self, name, *args, **kwargs):
+        if name not in PROGRAM_MODULES or name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        return self.track(name, self._import, name, *args, **kwargs)
+
+    # track calls fn and attributes its exclusive time to name.
+    def track(self, name, fn, *args, **kwargs):
+        self._stack.append([name, 0.0])
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, nested = self._stack.pop()
+            self.seconds[name] += elapsed - nested
+            if self._stack:
+                self._stack[-1][1] += elapsed
+
+
+# evaluate runs __main__.py against the mocks and returns the resource graph
+# with per-module and per-layer cost. Program modules are cached in sys.modules, so a process
+# can only evaluate the program once.
+def evaluate(stack="dev", config_overrides=None):
+    timer = _ImportTimer()
+    mocks = InfraMocks(timer)
+    config = load_stack_config(stack)
+    config[f"{PROJECT}:invoke_cache"] = json.dumps({"enabled": False})
+    # Profile the evaluation too, so check_profile can see how the deploy
+    # profiler classifies the program's resources.
+    profile_path = os.path.join(tempfile.mkdtemp(), "deploy-profile.json")
+    config[f"{PROJECT}:profile"] = json.dumps({"enabled": True, "output": profile_path})
+    # Pin the creation timestamp so resource inputs are reproducible.
+    tags = json.loads(config.get(f"{PROJECT}:tags", "{}"))
+    tags.setdefault("stack_created", "2024-12-01 00:00:00")
+    config[f"{PROJECT}:tags"] = json.dumps(tags)
+    config.update(config_overrides or {})
+    pulumi.runtime.set_all_config(config)
+    pulumi.runtime.set_mocks(mocks, project=PROJECT, stack=stack, preview=False, organization="organization")
+
+    registered = []
+    pulumi.runtime.register_stack_transformation(
+        lambda args: registered.append((args.type_, args.name, timer.current())) or None
+    )
+
+    sys.path.insert(0, HERE)
+    import layers
+    add = layers.LayerSet.add
+    layers.LayerSet.add = lambda self, layer, build: add(self, layer, lambda: timer.track(f"layer:{layer}", build))
+    builtins.__import__ = timer
+    start = time.perf_counter()
+    try:
+        @pulumi.runtime.test
+        def run():
+            timer.running = True
+            runpy.run_path(os.path.join(HERE, "__main__.py"), run_name="__main__")
+            timer.running = False
+        run()
+    finally:
+        builtins.__import__ = timer._import
+        layers.LayerSet.add = add
+    total = time.perf_counter() - start
+    profile = {}
+    if os.path.exists(profile_path):
+        with open(profile_path) as f:
+            profile = json.load(f)
+
+    modules = defaultdict(lambda: {"resources": 0, "invokes": 0, "seconds": 0.0})
+    for _, _, module in registered:
+        modules[module]["resources"] += 1
+    for _, module in mocks.invokes:
+        modules[module]["invokes"] += 1
+    for module, seconds in timer.seconds.items():
+        modules[module]["seconds"] = round(seconds, 4)
+
+    return {
+        "seconds": round(total, 4),
+        "resource_count": len(mocks.resources),
+        "invoke_count": len(mocks.invokes),
+        "types": dict(sorted(Counter(typ for typ, _ in mocks.resources).items())),
+        "inputs": {
+            f"{typ}::{name}": hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()[:16]
+            for (typ, name), inputs in sorted(mocks.resources.items())
+        },
+        "modules": dict(sorted(modules.items())),
+        "resources": mocks.resources,
+        "config": config,
+        "profile": profile,
+    }
+
+
+# Secret inputs reach the mocks wrapped in Pulumi's secret signature.
+SECRET_SIG = "1b47061264138c4ac30d75fd1eb44270"
+
+
+def _unsecret(value):
+    if isinstance(value, dict) and SECRET_SIG in value.values():
+        return value["value"]
+    return value
+
+
+def _find(result, typ, name=None):
+    matches = [
+        inputs for (t, n), inputs in result["resources"].items()
+        if t == typ and (name is None or n == name)
+    ]
+    assert matches, f"no {typ} {name or ''} registered"
+    return matches[0] if name else matches
+
+
+# check_graph asserts the invariants the program must keep, independent of timing.
+def check_graph(result):
+    from taggable import is_taggable
+
+    config = result["config"]
+    tags = json.loads(config[f"{PROJECT}:tags"])
+    web_app = json.loads(config[f"{PROJECT}:web_app"])
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    # Every taggable AWS resource carries the auto tags, merged with its own.
+    for (typ, name), inputs in result["resources"].items():
+        if not is_taggable(typ):
+            continue
+        resource_tags = inputs.get("tags") or {}
+        check(resource_tags.get("user:name") == tags["user_name"], f"{typ} {name} is missing user:name")
+        check(resource_tags.get("user:stack_name") == tags["stack_name"], f"{typ} {name} is missing user:stack_name")
+        check(resource_tags.get("user:stack-created"), f"{typ} {name} is missing user:stack-created")
+
+    # Whatever runs the database, the secret keeps its shape and its host
+    # resolves to the database.
+    secret_version = _find(result, "aws:secretsmanager/secretVersion:SecretVersion", "dbSecretVersion")
+    secret = json.loads(_unsecret(secret_version["secretString"]))
+    check({"username", "password", "host", "port", "db"} <= set(secret), "db secret lost one of username/password/host/port/db")
+    record = _find(result, "aws:route53/record:Record", "myInstanceRecord")
+    check(record["name"] == secret["host"], "db secret host has no DNS record")
+
+    database = json.loads(config.get(f"{PROJECT}:database", "{}"))
+    if database.get("engine", "ec2") == "aurora":
+        cluster = _find(result, "aws:rds/cluster:Cluster", "aurora-cluster")
+        scaling = cluster["serverlessv2ScalingConfiguration"]
+        check(scaling["minCapacity"] <= scaling["maxCapacity"], "aurora min ACUs exceed max ACUs")
+        check(cluster["masterUsername"] == secret["username"], "aurora master user differs from the db secret")
+        check(record["type"] == "CNAME", "db host does not point at the aurora writer endpoint")
+    else:
+        db_instance = _find(result, "aws:ec2/instance:Instance", config[f"{PROJECT}:db_instance"])
+        check(db_instance["tags"].get("Name") == config[f"{PROJECT}:db_instance"], "db instance Name tag differs from db_instance")
+        check(db_instance["instanceType"] == database.get("instance_type", "t3.medium"), "db instance type does not match config")
+        check("postgres_tuning: {" in db_instance["userData"], "db instance bootstrap lost its tuning profile")
+        if database.get("volumes"):
+            volumes = _find(result, "aws:ebs/volume:Volume")
+            check(len(volumes) == 2 and all(volume["type"] == "gp3" for volume in volumes),
+                  "db instance should have gp3 data and WAL volumes")
+            check("postgres-storage.yml" in db_instance["userData"], "db instance bootstrap does not mount its volumes")
+        if database.get("wal_archive"):
+            check("postgres-wal-archive.yml" in db_instance["userData"], "db instance bootstrap does not archive WAL")
+            _find(result, "aws:ssm/association:Association", "db-instance-wal-archive")
+        if database.get("snapshots"):
+            policy = _find(result, "aws:dlm/lifecyclePolicy:LifecyclePolicy", "db-snapshots")
+            check(policy["policyDetails"]["targetTags"].get("Name") == db_instance["tags"].get("Name"),
+                  "db snapshot policy does not target the db instance")
+        replicas = json.loads(config.get(f"{PROJECT}:db_replicas", "{}")).get("count", 0)
+        for index in range(replicas):
+            replica = _find(result, "aws:ec2/instance:Instance", f"{config[f'{PROJECT}:db_instance']}-replica-{index + 1}")
+            check(replica["subnetId"] != db_instance["subnetId"], f"db replica {index + 1} shares the primary's subnet")
+
+    vpc_config = json.loads(config[f"{PROJECT}:vpc"])
+    vpc = _find(result, "aws:ec2/vpc:Vpc", "vpc")
+    check(vpc["cidrBlock"] == vpc_config["cidr_block"], "vpc cidr does not match config")
+    if (vpc_config.get("endpoints") or {}).get("s3"):
+        route_tables = _find(result, "aws:ec2/routeTable:RouteTable")
+        s3_endpoint = _find(result, "aws:ec2/vpcEndpoint:VpcEndpoint", "s3-endpoint")
+        check(len(s3_endpoint["routeTableIds"]) == len(route_tables), "s3 endpoint is missing from some route tables")
+    if (vpc_config.get("endpoints") or {}).get("interface"):
+        for endpoint in _find(result, "aws:ec2/vpcEndpoint:VpcEndpoint"):
+            if endpoint["vpcEndpointType"] == "Interface":
+                check(endpoint.get("privateDnsEnabled"), f"{endpoint['serviceName']} endpoint has no private DNS")
+
+    subnets = _find(result, "aws:ec2/subnet:Subnet")
+    for subnet in subnets:
+        public = subnet.get("mapPublicIpOnLaunch", False)
+        check(public == subnet["tags"]["Name"].startswith("public-"), f"subnet {subnet['tags']['Name']} has the wrong visibility")
+    for kind in ("public", "private", "pod"):
+        zones = [subnet["availabilityZone"] for subnet in subnets if subnet["tags"]["Name"].startswith(f"{kind}-")]
+        check(len(zones) == len(set(zones)), f"{kind} subnets share a zone")
+    cidrs = [ipaddress.ip_network(subnet["cidrBlock"]) for subnet in subnets]
+    check(not any(a.overlaps(b) for i, a in enumerate(cidrs) for b in cidrs[i + 1:]), "subnet cidrs overlap")
+
+    cluster = _find(result, "aws:eks/cluster:Cluster", "eks-cluster")
+    check(len(cluster["vpcConfig"]["subnetIds"]) >= 2, "eks cluster spans fewer than two subnets")
+    if json.loads(config.get(f"{PROJECT}:vpc_cni", "{}")).get("prefix_delegation"):
+        node_group = _find(result, "aws:eks/nodeGroup:NodeGroup", "eks-node-group")
+        check(node_group.get("launchTemplate"), "node group keeps the default max pods under prefix delegation")
+
+    deployment = _find(result, "kubernetes:apps/v1:Deployment", web_app["name"])
+    container = deployment["spec"]["template"]["spec"]["containers"][0]
+    check(container["env"][0]["valueFrom"]["secretKeyRef"]["name"] == "postgres-url-secret",
+          "web app no longer reads DATABASE_URL from postgres-url-secret")
+    if web_app.get("hpa"):
+        # CPU utilization targets are relative to the container's CPU request.
+        check(((container.get("resources") or {}).get("requests") or {}).get("cpu"),
+              "web app has a HorizontalPodAutoscaler but no CPU request")
+
+    if json.loads(config.get(f"{PROJECT}:load_balancer", "{}")).get("controller"):
+        service = _find(result, "kubernetes:core/v1:Service", web_app["name"])
+        check(service["spec"].get("loadBalancerClass") == "service.k8s.aws/nlb", "web app service is left to the in-tree load balancer")
+        check(service["metadata"]["annotations"].get("service.beta.kubernetes.io/aws-load-balancer-nlb-target-type") == "ip",
+              "web app NLB targets nodes instead of pods")
+
+    pgbouncer = json.loads(config.get(f"{PROJECT}:pgbouncer", "{}"))
+    if pgbouncer.get("enabled"):
+        # Leave a few connections for superuser/backup sessions.
+        max_connections = database.get("max_connections", 100)
+        server_connections = pgbouncer.get("default_pool_size", 20) * pgbouncer.get("replicas", 2)
+        check(server_connections <= max_connections - 10,
+              f"pgbouncer pools open {server_connections} server connections, postgres allows {max_connections}")
+
+    return failures
+
+
+# check_profile asserts that the deploy profiler keeps Helm charts and other
+# components in its dependency graph and only leaves out the layers: charts
+# are often what a deploy waits on, e.g. node group -> k8s provider -> chart
+# -> config group -> deployment.
+def check_profile(result):
+    from profiler import build_report
+
+    failures = []
+    events = (result["profile"] or {}).get("traceEvents", [])
+    charts = [event for event in events if event["cat"] == "kubernetes:helm.sh/v4:Chart"]
+    if result["types"].get("kubernetes:helm.sh/v4:Chart") and not charts:
+        failures.append("deploy profile has no Helm charts")
+    if any(event["args"]["layer"] for event in charts):
+        failures.append("deploy profile leaves Helm charts out of the dependencies like layers")
+    if not any(event["args"]["layer"] for event in events if event["cat"].startswith("wiz:layers:")):
+        failures.append("deploy profile keeps the layers in the dependencies")
+
+    def record(name, typ, completed, **deps):
+        return {"urn": name, "type": typ, "name": name, "registered": 0.0, "completed": completed, **deps}
+
+    resources = [
+        {**record("apps", "wiz:layers:apps", 0.01), "layer": True},
+        record("node-group", "aws:eks/nodeGroup:NodeGroup", 300.0),
+        record("provider", "pulumi:providers:kubernetes", 301.0, implicit=["node-group"]),
+        record("chart", "kubernetes:helm.sh/v4:Chart", 420.0, parent="apps", provider="provider"),
+        record("config-group", "kubernetes:yaml/v2:ConfigGroup", 425.0, parent="apps", provider="provider",
+               depends_on=["chart"]),
+        record("deployment", "kubernetes:apps/v1:Deployment", 440.0, parent="apps", provider="provider",
+               depends_on=["config-group"]),
+        record("bucket", "aws:s3/bucket:Bucket", 5.0, parent="apps"),
+    ]
+    path = [entry["urn"] for entry in build_report(resources, 0.0)["summary"]["critical_path"]]
+    if path != ["node-group", "provider", "chart", "config-group", "deployment"]:
+        failures.append(f"deploy profile critical path is {path}, expected it through the chart")
+    return failures
+
+
+# _FakeRunner stands in for deploy.py's runners: it records when each step
+# starts and ends, and fails the given layers.
+class _FakeRunner:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _step(self, action, layer):
+        with self._lock:
+            self.events.append(("start", layer))
+        time.sleep(0.01)
+        if layer in self.failing:
+            raise RuntimeError(f"{layer} failed")
+        with self._lock:
+            self.events.append(("end", layer))
+        return {}
+
+    def refresh(self, layer):
+        return self._step("refresh", layer)
+
+    def up(self, layer):
+        return self._step("up", layer)
+
+
+# check_deploy asserts that deploy.py starts a layer only after the layers it
+# depends on, skips the layers that need a failed one, and refuses to deploy
+# next to the monolithic stack or without the per-layer stacks. With the
+# pulumi CLI installed, the stack checks also run against a file backend.
+def check_deploy(stack):
+    import deploy
+    from layers import DEPENDENCIES, LAYERS
+
+    failures = []
+    runner = _FakeRunner()
+    summary = deploy.run_layers(runner, deploy.plan("up", LAYERS, deploy.IMMUTABLE_LAYERS), 4)
+    events = runner.events
+    for layer, deps in DEPENDENCIES.items():
+        started = events.index(("start", layer))
+        if any(len(events) - events[::-1].index(("end", dep)) > started for dep in deps):
+            failures.append(f"deploy started {layer} before {deps} finished")
+    if any(stats["status"] != "succeeded" for stats in summary["layers"].values()):
+        failures.append("deploy did not finish every layer")
+
+    runner = _FakeRunner(failing=["network"])
+    with contextlib.redirect_stderr(io.StringIO()):
+        summary = deploy.run_layers(runner, deploy.plan("up", LAYERS, []), 4)
+    statuses = {layer: stats["status"] for layer, stats in summary["layers"].items()}
+    if statuses["network"] != "failed" or statuses["eks"] != "skipped" or statuses["apps"] != "skipped":
+        failures.append(f"deploy ran the layers that need a failed one: {statuses}")
+    if statuses["ecr"] != "succeeded":
+        failures.append("deploy skipped layers that don't need the failed one")
+
+    org = "organization"
+    per_layer = {deploy.layer_stack(org, stack, layer): 1 for layer in LAYERS}
+    expected = [
+        (per_layer, ["apps"], False, 0),
+        ({**per_layer, f"{org}/{PROJECT}/{stack}": 120}, ["apps"], False, 1),
+        ({}, ["network"], False, 1),
+        ({}, ["network"], True, 0),
+        ({}, ["apps"], True, 3),
+    ]
+    for stacks, layers, create, count in expected:
+        problems = deploy.stack_problems(org, stack, layers, stacks, create)
+        if len(problems) != count:
+            failures.append(f"deploy stack check of {layers} with {sorted(stacks)}: {problems}")
+
+    if shutil.which("pulumi"):
+        failures += _check_deploy_backend(deploy, stack)
+    return failures
+
+
+# _check_deploy_backend creates stacks on a temporary file backend and checks
+# that deploy.py finds them through the Automation API.
+def _check_deploy_backend(deploy, stack):
+    from pulumi import automation as auto
+
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "Pulumi.yaml"), "w") as f:
+            f.write(f"name: {PROJECT}\nruntime: python\n")
+        os.mkdir(os.path.join(work_dir, "state"))
+        env_vars = {"PULUMI_BACKEND_URL": f"file://{work_dir}/state", "PULUMI_CONFIG_PASSPHRASE": ""}
+        org = "organization"
+        opts = auto.LocalWorkspaceOptions(env_vars=env_vars)
+        auto.create_stack(deploy.layer_stack(org, stack, "network"), work_dir=work_dir, opts=opts)
+        stacks = deploy.stack_resources(org, env_vars, work_dir)
+        if deploy.stack_problems(org, stack, ["eks"], stacks) != [
+                f"{deploy.layer_stack(org, stack, 'eks')} does not exist; pass --create-stacks to create it"]:
+            failures.append(f"deploy stack check on a file backend found {sorted(stacks)}")
+        auto.create_stack(f"{org}/{PROJECT}/{stack}", work_dir=work_dir, opts=opts)
+        if not deploy.stack_problems(org, stack, ["network"], deploy.stack_resources(org, env_vars, work_dir)):
+            failures.append("deploy stack check on a file backend misses the monolithic stack")
+    return failures
+
+
+# compare_baseline checks the resource graph shape and invoke count against a
+# recorded baseline. Type counts and the inputs of existing resources must
+# match exactly, and the program may not make more invokes.
+def compare_baseline(result, baseline):
+    failures = []
+    if result["types"] != baseline["types"]:
+        for typ in sorted(set(result["types"]) | set(baseline["types"])):
+            got, want = result["types"].get(typ, 0), baseline["types"].get(typ, 0)
+            if got != want:
+                failures.append(f"{typ}: {got} resources, baseline has {want}")
+    for key, digest in sorted(baseline.get("inputs", {}).items()):
+        if key in result["inputs"] and result["inputs"][key] != digest:
+            failures.append(f"{key}: inputs changed")
+    if result["invoke_count"] > baseline["invoke_count"]:
+        failures.append(f"{result['invoke_count']} invokes, baseline has {baseline['invoke_count']}")
+    return failures
+
+
+# compare_timing checks evaluation time against the locally recorded one; it
+# may grow by the given tolerance before it counts as a regression.
+def compare_timing(result, timing, tolerance):
+    limit = max(timing["seconds"] * (1 + tolerance), timing["seconds"] + 1.0)
+    if result["seconds"] > limit:
+        return [f"evaluation took {result['seconds']:.2f}s, limit is {limit:.2f}s"]
+    return []
+
+
+def _summary(result):
+    return {key: result[key] for key in ("seconds", "resource_count", "invoke_count", "types", "modules", "inputs")}
+
+
+# _baseline returns the machine-independent part of the summary.
+def _baseline(summary):
+    modules = {
+        module: {"resources": stats["resources"], "invokes": stats["invokes"]}
+        for module, stats in summary["modules"].items()
+    }
+    return {**{key: summary[key] for key in ("resource_count", "invoke_count", "types", "inputs")}, "modules": modules}
+
+
+# _timing returns the evaluation times of the summary.
+def _timing(summary):
+    return {
+        "seconds": summary["seconds"],
+        "modules": {module: stats["seconds"] for module, stats in summary["modules"].items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the Pulumi program offline against mocks.")
+    parser.add_argument("--stack", default="dev")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--timing", action="store_true", help="compare evaluation time with the recorded one")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative growth in evaluation time")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    parser.add_argument("--layers", help="comma-separated layers to evaluate; the rest are mocked stack references")
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=JSON",
+                        help="override a config value, e.g. 'database={\"engine\": \"aurora\"}'")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for override in args.config:
+        key, _, value = override.partition("=")
+        overrides[f"{PROJECT}:{key}"] = value
+    if args.layers:
+        overrides.update(partial_config(args.stack, args.layers.split(",")))
+    result = evaluate(args.stack, overrides)
+    summary = _summary(result)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"evaluated {result['resource_count']} resources and {result['invoke_count']} invokes "
+              f"in {result['seconds']:.2f}s")
+        for module, stats in summary["modules"].items():
+            print(f"  {module:<20} {stats['resources']:>4} resources {stats['invokes']:>3} invokes {stats['seconds']:>8.3f}s")
+
+    if args.layers:
+        # The graph invariants and the baseline cover the whole program.
+        return 0
+
+    failures = check_graph(result) + check_profile(result) + check_deploy(args.stack)
+    if args.update_baseline:
+        for path, recorded in ((args.baseline, _baseline(summary)), (TIMING_PATH, _timing(summary))):
+            with open(path, "w") as f:
+                json.dump(recorded, f, indent=2)
+                f.write("\n")
+        print(f"baseline written to {args.baseline}")
+    else:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                failures += compare_baseline(result, json.load(f))
+        if args.timing and os.path.exists(TIMING_PATH):
+            with open(TIMING_PATH) as f:
+                failures += compare_timing(result, json.load(f), args.tolerance)
+        elif args.timing:
+            print(f"no timings recorded in {TIMING_PATH}; record them with --update-baseline")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import argparse
+import json
+import invoke_cache
+
+# pg_tuning derives postgresql.conf settings for the db instances from their
+# instance type (vCPUs and memory) and volume type, along the lines of pgtune's
+# web/OLTP profile. ec2.py writes the profile into dynamic-vars.yml and
+# postgres-tuning.yml renders it into conf.d/tuning.conf.
+#
+#   python pg_tuning.py t3.medium gp2   # print the profile for a type
+
+# vCPUs and memory (GiB) of the instance types the db is expected to run on.
+# Other types are looked up with ec2:DescribeInstanceTypes.
+INSTANCE_TYPES = {
+    "t3.micro": (2, 1),
+    "t3.small": (2, 2),
+    "t3.medium": (2, 4),
+    "t3.large": (2, 8),
+    "t3.xlarge": (4, 16),
+    "t3.2xlarge": (8, 32),
+    "m6i.large": (2, 8),
+    "m6i.xlarge": (4, 16),
+    "m6i.2xlarge": (8, 32),
+    "m6i.4xlarge": (16, 64),
+    "r6i.large": (2, 16),
+    "r6i.xlarge": (4, 32),
+    "r6i.2xlarge": (8, 64),
+    "r6i.4xlarge": (16, 128),
+}
+
+# Volume types backed by SSDs, where random reads cost about as much as
+# sequential ones.
+SSD_VOLUME_TYPES = {"gp2", "gp3", "io1", "io2"}
+
+
+# instance_resources returns the vCPUs and memory (GiB) of an instance type.
+def instance_resources(instance_type):
+    if instance_type in INSTANCE_TYPES:
+        return INSTANCE_TYPES[instance_type]
+    info = invoke_cache.instance_type_info(instance_type)
+    return info["vcpus"], info["memory_mib"] / 1024
+
+
+def _mb(value):
+    return f"{int(value)}MB"
+
+
+# Settings a hot standby refuses to start with if they are lower than on its
+# primary.
+STANDBY_MINIMUMS = ("max_connections", "max_worker_processes")
+
+
+# tuning_profile returns the settings for an instance and volume type. For a
+# read replica, pass its primary's profile so the replica never runs with less
+# than the primary where a standby must not.
+def tuning_profile(instance_type, volume_type, max_connections=100, primary=None):
+    vcpus, memory_gib = instance_resources(instance_type)
+    memory_mb = memory_gib * 1024
+    shared_buffers = memory_mb / 4
+    parallel_per_gather = max(1, min(4, vcpus // 2))
+    # Each connection can run a few sorts/hashes at once, each using up to
+    # work_mem, in every parallel worker.
+    work_mem = max(4, (memory_mb - shared_buffers) / (max_connections * 3) / parallel_per_gather)
+    ssd = volume_type in SSD_VOLUME_TYPES
+
+    profile = {
+        "max_connections": max_connections,
+        "shared_buffers": _mb(shared_buffers),
+        "effective_cache_size": _mb(memory_mb * 3 / 4),
+        "maintenance_work_mem": _mb(min(memory_mb / 16, 2048)),
+        "work_mem": f"{int(work_mem * 1024)}kB",
+        "wal_buffers": "16MB",
+        "min_wal_size": "1GB",
+        "max_wal_size": "4GB",
+        "checkpoint_timeout": "15min",
+        "checkpoint_completion_target": 0.9,
+        "random_page_cost": 1.1 if ssd else 4.0,
+        "effective_io_concurrency": 200 if ssd else 2,
+        "max_worker_processes": max(8, vcpus),
+        "max_parallel_workers": vcpus,
+        "max_parallel_workers_per_gather": parallel_per_gather,
+        "max_parallel_maintenance_workers": parallel_per_gather,
+    }
+    for setting in STANDBY_MINIMUMS if primary else ():
+        profile[setting] = max(profile[setting], primary[setting])
+    return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the Postgres tuning profile for an instance.")
+    parser.add_argument("instance_type", nargs="?", default="t3.medium")
+    parser.add_argument("volume_type", nargs="?", default="gp2")
+    parser.add_argument("--max-connections", type=int, default=100)
+    args = parser.parse_args(argv)
+    print(json.dumps(tuning_profile(args.instance_type, args.volume_type, args.max_connections), indent=2))
+
+
+if __name__ == "__main__":
+    main()
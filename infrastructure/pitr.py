@@ -0,0 +1,111 @@
+import argparse
+import json
+import sys
+import time
+import boto3
+from stack_config import PROJECT, load_stack_config
+
+# pitr restores the EC2 database from its wal-g archive (database.wal_archive)
+# to a point in time. It runs playbooks/postgres-pitr.yml on the db instance
+# through SSM and streams back the result:
+#
+#   python pitr.py list                                  # base backups
+#   python pitr.py restore --target-time "2024-12-01 13:05:00+00" --yes
+#   python pitr.py restore --backup base_000000010000000000000042 --yes
+#
+# Without --target-time it replays every archived WAL segment. Everything the
+# database wrote after the target is discarded, so restore needs --yes.
+# Promotion starts a new timeline, so read replicas have to be rebuilt
+# afterwards (replace them, e.g. pulumi up --replace).
+
+# The db instance's checkout of git_repo_url (ec2.REPO_DIR)
+REPO_DIR = "/opt/wiz-stack"
+WALG = "/usr/local/bin/wal-g --config /etc/wal-g/walg.json"
+
+
+# find_instance returns the id of the running instance with the given Name tag.
+def find_instance(ec2, name):
+    reservations = ec2.describe_instances(Filters=[
+        {"Name": "tag:Name", "Values": [name]},
+        {"Name": "instance-state-name", "Values": ["running"]},
+    ])["Reservations"]
+    instances = [instance["InstanceId"] for reservation in reservations for instance in reservation["Instances"]]
+    if len(instances) != 1:
+        raise SystemExit(f"expected one running instance named {name}, found {instances or 'none'}")
+    return instances[0]
+
+
+# restore_commands returns the shell commands that run the PITR playbook,
+# cloning the repo again if the instance's checkout is gone. The playbook
+# needs nothing from dynamic-vars.yml, so it runs without it.
+def restore_commands(git_repo_url, target_time=None, backup="LATEST"):
+    extra_vars = {"pitr_confirm": True, "pitr_backup": backup}
+    if target_time:
+        extra_vars["pitr_target_time"] = target_time
+    return [
+        f"[ -d {REPO_DIR}/.git ] || git clone {git_repo_url} {REPO_DIR}",
+        f"cd {REPO_DIR} && git pull",
+        f"cd {REPO_DIR}/playbooks && ansible-playbook -e '{json.dumps(extra_vars)}' postgres-pitr.yml",
+    ]
+
+
+# list_commands returns the shell commands that list the base backups.
+def list_commands():
+    return [f"sudo -u postgres {WALG} backup-list --detail"]
+
+
+# run_commands runs commands on the instance and waits for them, printing
+# their output. It returns whether they succeeded.
+def run_commands(ssm, instance_id, commands, comment, timeout=3600):
+    command_id = ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName="AWS-RunShellScript",
+        Comment=comment,
+        Parameters={"commands": commands, "executionTimeout": [str(timeout)]},
+    )["Command"]["CommandId"]
+    print(f"{comment}: command {command_id} on {instance_id}", file=sys.stderr)
+    while True:
+        time.sleep(5)
+        try:
+            invocation = ssm.get_command_invocation(CommandId=command_id, InstanceId=instance_id)
+        except ssm.exceptions.InvocationDoesNotExist:
+            continue
+        if invocation["Status"] not in ("Pending", "InProgress", "Delayed"):
+            break
+    print(invocation["StandardOutputContent"])
+    if invocation["StandardErrorContent"]:
+        print(invocation["StandardErrorContent"], file=sys.stderr)
+    print(f"{comment}: {invocation['Status']}", file=sys.stderr)
+    return invocation["Status"] == "Success"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Point-in-time recovery of the EC2 database from its WAL archive.")
+    parser.add_argument("action", choices=["list", "restore"])
+    parser.add_argument("--stack", default="dev")
+    parser.add_argument("--instance-id", help="db instance to restore (default: the instance named by db_instance)")
+    parser.add_argument("--target-time", help="recover up to this timestamp (default: end of the archive)")
+    parser.add_argument("--backup", default="LATEST", help="base backup to start from")
+    parser.add_argument("--timeout", type=int, default=3600, help="seconds the restore may take")
+    parser.add_argument("--yes", action="store_true", help="confirm that later writes are discarded")
+    args = parser.parse_args(argv)
+
+    config = load_stack_config(args.stack)
+    if not json.loads(config.get(f"{PROJECT}:database", "{}")).get("wal_archive"):
+        parser.error(f"stack {args.stack} does not archive WAL (database.wal_archive)")
+    if args.action == "restore" and not args.yes:
+        parser.error("restore replaces the database with the archived one; pass --yes")
+
+    session = boto3.session.Session(region_name=config.get("aws:region"))
+    instance_id = args.instance_id or find_instance(session.client("ec2"), config[f"{PROJECT}:db_instance"])
+    ssm = session.client("ssm")
+    if args.action == "list":
+        ok = run_commands(ssm, instance_id, list_commands(), "wal-g backup-list")
+    else:
+        ok = run_commands(ssm, instance_id, restore_commands(config[f"{PROJECT}:git_repo_url"], args.target_time, args.backup),
+                          f"PITR to {args.target_time or 'end of archive'}", args.timeout)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+import pulumi
+from layers import Layer
+
+# The deployment profiler is an opt-in stack transformation that records when
+# each resource is registered by the program and when the engine finishes it
+# (its URN resolves once the create/update step completes), along with its
+# parent, provider, explicit depends_on and implicit (Output-borne)
+# dependencies. At the
+# end of the program it writes a Chrome-trace JSON file with a critical-path
+# summary, so deploys can be opened in chrome://tracing or Perfetto and diffed.
+#
+# infrastructure:profile:
+#   enabled: true
+#   output: deploy-profile.json
+
+
+# register_deploy_profiler registers the profiling transformation. Like auto
+# tags, it only sees resources constructed after it is registered.
+def register_deploy_profiler(output="deploy-profile.json"):
+    profiler = DeployProfiler(output)
+    pulumi.runtime.register_stack_transformation(profiler.transformation)
+    return profiler
+
+
+class DeployProfiler:
+    def __init__(self, output):
+        self.output = output
+        self.started = time.time()
+        self.records = {}
+
+    def transformation(self, args):
+        record = {
+            "type": args.type_,
+            "name": args.name,
+            "registered": time.time(),
+            "layer": isinstance(args.resource, Layer),
+        }
+        parent, provider = args.opts.parent, args.opts.provider
+        depends_on = _as_resources(args.opts.depends_on)
+        loop = asyncio.get_event_loop()
+        record["done"] = loop.create_future()
+        self.records[id(args.resource)] = record
+        # The resource is still being constructed, so its URN does not exist
+        # yet; start tracking once the constructor has returned.
+        loop.call_soon(lambda: asyncio.ensure_future(self._track(args.resource, args.props, parent, provider, depends_on, record)))
+        return None
+
+    # _track waits for the resource's URN, which resolves once the engine has
+    # finished it, and records its dependencies by URN.
+    async def _track(self, resource, props, parent, provider, depends_on, record):
+        try:
+            implicit = await pulumi.Output.from_input(props).resources()
+            record["urn"] = await resource.urn.future()
+            record["completed"] = time.time()
+            record["parent"] = await parent.urn.future() if parent is not None else None
+            record["provider"] = await provider.urn.future() if provider is not None else None
+            record["depends_on"] = await _urns(depends_on)
+            record["implicit"] = await _urns(r for r in implicit if r is not resource)
+        finally:
+            if not record["done"].done():
+                record["done"].set_result(None)
+
+    # write_report writes the trace once every tracked resource has completed.
+    def write_report(self):
+        done = [pulumi.Output.from_input(record["done"]) for record in self.records.values()]
+        pulumi.Output.all(*done).apply(lambda _: self._write())
+
+    def _write(self):
+        resources = [
+            {key: value for key, value in record.items() if key != "done"}
+            for record in self.records.values()
+            if "completed" in record
+        ]
+        report = build_report(resources, self.started)
+        report["preview"] = pulumi.runtime.is_dry_run()
+        with open(self.output, "w") as f:
+            json.dump(report, f, indent=1)
+        pulumi.log.info(
+            f"deploy profile: {len(resources)} resources, critical path "
+            f"{report['summary']['critical_path_seconds']:.1f}s of "
+            f"{report['summary']['makespan_seconds']:.1f}s, written to {self.output}"
+        )
+
+
+# build_report turns profiled resources into a Chrome trace plus a summary of
+# the critical path, time per resource type and parallelism. The layers only
+# group their children: they finish as soon as they are registered, so they
+# are left out of the dependencies. Other components (Helm charts, config
+# groups) finish with their children and stay in.
+def build_report(resources, started):
+    by_urn = {r["urn"]: r for r in resources if not r.get("layer")}
+
+    def deps(record):
+        urns = set(record.get("depends_on", [])) | set(record.get("implicit", []))
+        urns |= {record.get("parent"), record.get("provider")} - {None}
+        return [by_urn[urn] for urn in urns if urn in by_urn]
+
+    # A resource starts once it is registered and all of its dependencies are done.
+    for record in resources:
+        ready = max([record["registered"], *(d["completed"] for d in deps(record))])
+        record["start"] = min(ready, record["completed"])
+        record["seconds"] = record["completed"] - record["start"]
+
+    critical_path = []
+    record = max(by_urn.values(), key=lambda r: r["completed"], default=None)
+    while record is not None:
+        critical_path.append(record)
+        upstream = deps(record)
+        record = max(upstream, key=lambda r: r["completed"]) if upstream else None
+    critical_path.reverse()
+
+    per_type = defaultdict(lambda: {"count": 0, "seconds": 0.0})
+    for record in resources:
+        per_type[record["type"]]["count"] += 1
+        per_type[record["type"]]["seconds"] += record["seconds"]
+
+    end = max((r["completed"] for r in resources), default=started)
+    makespan = end - started
+    busy = sum(r["seconds"] for r in resources)
+
+    return {
+        "traceEvents": _trace_events(resources, started),
+        "displayTimeUnit": "ms",
+        "summary": {
+            "resources": len(resources),
+            "makespan_seconds": round(makespan, 3),
+            "critical_path_seconds": round(sum(r["seconds"] for r in critical_path), 3),
+            "critical_path": [
+                {"urn": r.get("urn"), "type": r["type"], "seconds": round(r["seconds"], 3)}
+                for r in critical_path
+            ],
+            "per_type": {
+                t: {"count": v["count"], "seconds": round(v["seconds"], 3)}
+                for t, v in sorted(per_type.items(), key=lambda item: -item[1]["seconds"])
+            },
+            "average_parallelism": round(busy / makespan, 2) if makespan else 0.0,
+            **_idle_time(resources, started, end),
+        },
+    }
+
+
+# _idle_time sweeps the resource intervals to find how long nothing, or only a
+# single resource, was in flight.
+def _idle_time(resources, started, end):
+    events = sorted([(r["start"], 1) for r in resources] + [(r["completed"], -1) for r in resources])
+    idle = serial = 0.0
+    running, last = 0, started
+    for at, delta in events:
+        if running == 0:
+            idle += at - last
+        elif running == 1:
+            serial += at - last
+        running, last = running + delta, at
+    idle += end - last if running == 0 else 0.0
+    return {"idle_seconds": round(idle, 3), "serial_seconds": round(serial, 3)}
+
+
+# _trace_events lays resources out on lanes so overlapping steps don't share a row.
+def _trace_events(resources, started):
+    lanes, events = [], []
+    for record in sorted(resources, key=lambda r: r["start"]):
+        lane = next((i for i, free_at in enumerate(lanes) if free_at <= record["start"]), len(lanes))
+        if lane == len(lanes):
+            lanes.append(0.0)
+        lanes[lane] = record["completed"]
+        events.append({
+            "name": record["name"],
+            "cat": record["type"],
+            "ph": "X",
+            "ts": round((record["start"] - started) * 1e6),
+            "dur": round(record["seconds"] * 1e6),
+            "pid": 1,
+            "tid": lane,
+            "args": {
+                "urn": record.get("urn"),
+                "registered_ms": round((record["registered"] - started) * 1e3),
+                "layer": record.get("layer", False),
+                "parent": record.get("parent"),
+                "provider": record.get("provider"),
+                "depends_on": record.get("depends_on", []),
+                "implicit": record.get("implicit", []),
+            },
+        })
+    return events
+
+
+async def _urns(resources):
+    return sorted({await resource.urn.future() for resource in resources} - {None})
+
+
+def _as_resources(value):
+    if isinstance(value, pulumi.Resource):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [r for r in value if isinstance(r, pulumi.Resource)]
+    return []
+
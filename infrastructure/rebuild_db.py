@@ -0,0 +1,146 @@
+import argparse
+import json
+import subprocess
+import sys
+import boto3
+import deploy
+from stack_config import PROJECT, load_stack_config
+
+# rebuild_db rebuilds the EC2 database from the EBS snapshots that
+# database.snapshots takes (see ec2.py). It finds the newest complete set of
+# snapshots of the instance, points database.restore at it and deploys the
+# stack that owns the database: the database layer's stack (see deploy.py),
+# or the monolithic stack before it was split, and fails if neither exists.
+# That replaces db_instance: its dedicated data and WAL volumes are created
+# from the snapshots (or, without them, the instance boots from an AMI
+# registered from the root volume snapshot) and myInstanceRecord follows the
+# new instance's address.
+#
+#   python rebuild_db.py --dry-run                 # show the snapshots it would use
+#   python rebuild_db.py                           # the newest snapshots
+#   python rebuild_db.py --timestamp 2024-12-01T03:00:12.345Z
+#
+# Leave database.restore set once the rebuild is done: removing it replaces
+# the instance again, with empty volumes. The snapshots are crash-consistent,
+# so postgres replays its WAL when it starts; anything written after them is
+# lost unless it is recovered from the WAL archive (see pitr.py).
+
+
+# snapshot_sets returns the completed snapshots of the instance grouped by the
+# time DLM took them, as {timestamp: {volume name: snapshot}}.
+def snapshot_sets(ec2, db_instance_name):
+    sets = {}
+    pages = ec2.get_paginator("describe_snapshots").paginate(OwnerIds=["self"], Filters=[
+        {"Name": "tag:SnapshotOf", "Values": [db_instance_name]},
+        {"Name": "status", "Values": ["completed"]},
+    ])
+    for page in pages:
+        for snapshot in page["Snapshots"]:
+            tags = {tag["Key"]: tag["Value"] for tag in snapshot.get("Tags", [])}
+            volume = tags.get("Name", "").removeprefix(f"{db_instance_name}-")
+            if "timestamp" in tags and volume in ("data", "wal", "root"):
+                sets.setdefault(tags["timestamp"], {})[volume] = snapshot
+    return sets
+
+
+# database_stack returns the fully qualified name of the stack that owns the db
+# instance, and whether it is the database layer's own stack.
+def database_stack(org, stack):
+    stacks = deploy.stack_resources(org)
+    layer_stack = deploy.layer_stack(org, stack, "database")
+    if layer_stack in stacks:
+        return layer_stack, True
+    monolithic = f"{org}/{PROJECT}/{stack}"
+    if monolithic in stacks:
+        return monolithic, False
+    raise SystemExit(f"neither {layer_stack} nor {monolithic} exists on the current backend")
+
+
+# choose_set returns the timestamp and snapshots of the set to restore: the
+# given one, or the newest set that holds every volume the instance needs.
+def choose_set(sets, volumes, timestamp=None):
+    needed = {"data", "wal"} if volumes else {"root"}
+    complete = {time: snapshots for time, snapshots in sets.items() if needed <= snapshots.keys()}
+    if timestamp:
+        if timestamp not in complete:
+            raise SystemExit(f"no complete snapshot set at {timestamp}; have {sorted(complete) or 'none'}")
+        return timestamp, complete[timestamp]
+    if not complete:
+        raise SystemExit("no complete snapshot set of the db instance found")
+    latest = max(complete)
+    return latest, complete[latest]
+
+
+# register_root_image registers an AMI that boots from the root volume snapshot
+# and waits for it to become available.
+def register_root_image(ec2, db_instance_name, timestamp, snapshot):
+    name = f"{db_instance_name}-{timestamp.replace(':', '-')}"
+    existing = ec2.describe_images(Owners=["self"], Filters=[{"Name": "name", "Values": [name]}])["Images"]
+    if existing:
+        return existing[0]["ImageId"]
+    image_id = ec2.register_image(
+        Name=name,
+        Description=f"{db_instance_name} restored from {snapshot['SnapshotId']}",
+        Architecture="x86_64",
+        VirtualizationType="hvm",
+        EnaSupport=True,
+        RootDeviceName="/dev/xvda",
+        BlockDeviceMappings=[{
+            "DeviceName": "/dev/xvda",
+            "Ebs": {"SnapshotId": snapshot["SnapshotId"], "VolumeType": "gp2", "DeleteOnTermination": True},
+        }],
+    )["ImageId"]
+    ec2.get_waiter("image_available").wait(ImageIds=[image_id])
+    return image_id
+
+
+# restore_config returns the database.restore config for a snapshot set.
+def restore_config(ec2, db_instance_name, timestamp, snapshots, volumes):
+    config = {"timestamp": timestamp}
+    if volumes:
+        config.update({name: snapshots[name]["SnapshotId"] for name in ("data", "wal")})
+    else:
+        config["ami"] = register_root_image(ec2, db_instance_name, timestamp, snapshots["root"])
+    return config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the EC2 database from its latest EBS snapshots.")
+    parser.add_argument("--stack", default="dev")
+    parser.add_argument("--timestamp", help="snapshot set to restore (default: the newest)")
+    parser.add_argument("--dry-run", action="store_true", help="only show the snapshots that would be used")
+    parser.add_argument("--no-deploy", action="store_true", help="set database.restore but don't deploy")
+    parser.add_argument("--org", default="organization")
+    args = parser.parse_args(argv)
+
+    config = load_stack_config(args.stack)
+    database = json.loads(config.get(f"{PROJECT}:database", "{}"))
+    if not database.get("snapshots"):
+        parser.error(f"stack {args.stack} does not snapshot the db instance (database.snapshots)")
+    db_instance_name = config[f"{PROJECT}:db_instance"]
+    volumes = bool(database.get("volumes"))
+
+    ec2 = boto3.session.Session(region_name=config.get("aws:region")).client("ec2")
+    timestamp, snapshots = choose_set(snapshot_sets(ec2, db_instance_name), volumes, args.timestamp)
+    for name, snapshot in sorted(snapshots.items()):
+        print(f"{name}: {snapshot['SnapshotId']} ({snapshot['VolumeSize']} GiB, started {snapshot['StartTime']})",
+              file=sys.stderr)
+    owner, per_layer = database_stack(args.org, args.stack)
+    print(f"the db instance belongs to {owner}", file=sys.stderr)
+    if args.dry_run:
+        return 0
+
+    # Per-layer stacks take their config from Pulumi.<stack>.yaml too
+    for key, value in restore_config(ec2, db_instance_name, timestamp, snapshots, volumes).items():
+        subprocess.run(["pulumi", "config", "set", "--path", "--stack", owner,
+                        "--config-file", f"Pulumi.{args.stack}.yaml",
+                        f"database.restore.{key}", value], cwd=deploy.HERE, check=True)
+    if args.no_deploy:
+        return 0
+    if per_layer:
+        return deploy.main(["up", "--stack", args.stack, "--org", args.org, "--layers", "database"])
+    return subprocess.run(["pulumi", "up", "--stack", owner], cwd=deploy.HERE).returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,46 +1,71 @@
-import pulumi
 import pulumi_aws as aws
 import json
+from layers import Layer
 
-# Create S3 Bucket
-s3_bucket = aws.s3.Bucket(
-    "wiz-db-backups-for-me",
-    bucket="wiz-db-backups-for-me",
-    force_destroy=True,  # Optional: Allows bucket deletion even if it contains objects
-)
-
-# # Disable Block Public Access settings for the buckekt
-public_access_block = aws.s3.BucketPublicAccessBlock("bucket-public-access-block",
-    bucket=s3_bucket.id,
-    block_public_policy=False,  # Allow public bucket policies
-    block_public_acls=False,   # Allow public ACLs
-    ignore_public_acls=False,   # Optional: Prevent ACLs from being ignored
-    restrict_public_buckets=False  # Allow public access for the bucket
-)
-
-
-# Add a bucket policy for public read access
-s3_bucket_policy = aws.s3.BucketPolicy(
-    "wiz-db-backups-for-me-policy",
-    bucket=s3_bucket.id,
-    policy=s3_bucket.id.apply(
-        lambda bucket_name: json.dumps({
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Principal": "*",
-                    "Action": "s3:GetObject",
-                    "Resource": f"arn:aws:s3:::{bucket_name}/*"
-                },
-                {
-                    "Effect": "Allow",
-                    "Principal": "*",
-                    "Action": "s3:ListBucket",
-                    "Resource": f"arn:aws:s3:::{bucket_name}"
-                }
-            ]
-        })
-    ),
-    opts=pulumi.ResourceOptions(depends_on=public_access_block)
-)
\ No newline at end of file
+
+class BackupsLayer(Layer):
+    def __init__(self, name, opts=None):
+        super().__init__("backups", name, opts)
+
+        # Create S3 Bucket
+        s3_bucket = aws.s3.Bucket(
+            "wiz-db-backups-for-me",
+            bucket="wiz-db-backups-for-me",
+            force_destroy=True,  # Optional: Allows bucket deletion even if it contains objects
+            opts=self.child_opts()
+        )
+
+        # # Disable Block Public Access settings for the buckekt
+        public_access_block = aws.s3.BucketPublicAccessBlock("bucket-public-access-block",
+            bucket=s3_bucket.id,
+            block_public_policy=False,  # Allow public bucket policies
+            block_public_acls=False,   # Allow public ACLs
+            ignore_public_acls=False,   # Optional: Prevent ACLs from being ignored
+            restrict_public_buckets=False,  # Allow public access for the bucket
+            opts=self.child_opts()
+        )
+
+
+        # Add a bucket policy for public read access
+        s3_bucket_policy = aws.s3.BucketPolicy(
+            "wiz-db-backups-for-me-policy",
+            bucket=s3_bucket.id,
+            policy=s3_bucket.id.apply(
+                lambda bucket_name: json.dumps({
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        {
+                            "Effect": "Allow",
+                            "Principal": "*",
+                            "Action": "s3:GetObject",
+                            "Resource": f"arn:aws:s3:::{bucket_name}/*"
+                        },
+                        {
+                            "Effect": "Allow",
+                            "Principal": "*",
+                            "Action": "s3:ListBucket",
+                            "Resource": f"arn:aws:s3:::{bucket_name}"
+                        }
+                    ]
+                })
+            ),
+            opts=self.child_opts(depends_on=public_access_block)
+        )
+
+        # The backup agent aborts failed multipart uploads itself; this catches
+        # the ones left behind when it is killed mid-upload.
+        aws.s3.BucketLifecycleConfigurationV2("wiz-db-backups-for-me-lifecycle",
+            bucket=s3_bucket.id,
+            rules=[{
+                "id": "abort-incomplete-uploads",
+                "status": "Enabled",
+                "filter": {"prefix": ""},
+                "abort_incomplete_multipart_upload": {"days_after_initiation": 1},
+            }],
+            opts=self.child_opts()
+        )
+
+        self.export(
+            bucket_name=s3_bucket.bucket,
+            bucket_arn=s3_bucket.arn,
+        )
@@ -0,0 +1,40 @@
+import json
+import os
+import yaml
+
+# stack_config reads a stack's settings file the way the Pulumi runtime sees
+# it, for the tools that run outside of `pulumi` (offline.py, deploy.py,
+# pitr.py, rebuild_db.py).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECT = "infrastructure"
+
+
+# load_stack_config converts Pulumi.<stack>.yaml into runtime config, skipping
+# secure values, which need the stack's secrets provider to decrypt.
+def load_stack_config(stack):
+    with open(os.path.join(HERE, f"Pulumi.{stack}.yaml")) as f:
+        values = (yaml.safe_load(f) or {}).get("config", {})
+    config = {}
+    for key, value in values.items():
+        if isinstance(value, dict) and "secure" in value:
+            continue
+        if ":" not in key:
+            key = f"{PROJECT}:{key}"
+        config[key] = value if isinstance(value, str) else json.dumps(value)
+    return config
+
+
+# partial_config returns config overrides that build only the given layers and
+# read the layers they depend on from per-layer stacks.
+def partial_config(stack, selected, org="organization"):
+    from layers import DEPENDENCIES
+
+    remote = {
+        dep: f"{org}/{PROJECT}/{stack}-{dep}"
+        for layer in selected for dep in DEPENDENCIES.get(layer, []) if dep not in selected
+    }
+    return {
+        f"{PROJECT}:layers": json.dumps(selected),
+        f"{PROJECT}:layer_stacks": json.dumps(remote),
+    }
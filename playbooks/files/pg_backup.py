@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# pg_backup streams database dumps into multipart S3 uploads and restores them.
+# Memory is bounded: at most --concurrency parts are uploading while the next
+# one is read, each --part-size MiB. If a dump or the compressor fails, the
+# upload is aborted, so only complete backups ever appear in the bucket.
+#
+# Backups come in two formats:
+#
+#   plain      pg_dumpall (or pg_dump --format=custom for one --database)
+#              through zstd/pigz, nothing staged on disk. Restores serially.
+#   directory  pg_dump --format=directory --jobs N of each database into
+#              --work-dir, uploaded as a tar, plus the roles. Costs local
+#              space for one database at a time, but dumps and restores
+#              (pg_restore --jobs N) run N tables at once.
+#
+# --jobs defaults to the instance's cores.
+#
+# s3-backup.yml installs it on the db instance and runs it from cron. The PG*
+# environment variables select the server, and --endpoint-url points it at a
+# local S3 stand-in such as the minio service in docker-compose.yml:
+#
+#   PGHOST=localhost PGUSER=user PGPASSWORD=password \
+#   AWS_ACCESS_KEY_ID=minio AWS_SECRET_ACCESS_KEY=minio-password \
+#   python pg_backup.py backup --bucket backups --endpoint-url http://localhost:9000
+#
+#   python pg_backup.py restore --bucket backups --key pg_backups/pg_backup_<time>/ultraticdb.dir.tar \
+#       --database ultraticdb_restored
+
+COMPRESSORS = {
+    "zstd": (lambda threads, level: ["zstd", "-q", f"-T{threads}", f"-{level}", "-c"], "zst"),
+    "pigz": (lambda threads, level: ["pigz", "-p", str(threads), f"-{level}", "-c"], "gz"),
+}
+
+DECOMPRESSORS = {
+    "zst": ["zstd", "-q", "-dc"],
+    "gz": ["pigz", "-dc"],
+}
+
+MIB = 1024 * 1024
+
+# S3 allows at most this many parts per upload; parts other than the last
+# must be at least 5 MiB.
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * MIB
+
+
+# default_jobs returns the number of cores this process may run on.
+def default_jobs():
+    return len(os.sched_getaffinity(0))
+
+
+# dump_command returns the command that writes a plain-format dump to stdout:
+# every database (with roles) when database is None, otherwise an uncompressed
+# custom-format dump of that database for pg_restore.
+def dump_command(database=None):
+    if database is None:
+        return ["pg_dumpall"]
+    return ["pg_dump", "--format=custom", "--compress=0", database]
+
+
+# directory_dump_command returns the command that dumps database into
+# directory, jobs tables at a time, each file gzip'd by pg_dump.
+def directory_dump_command(database, directory, jobs, level=6):
+    return ["pg_dump", "--format=directory", f"--jobs={jobs}", f"--compress={level}", f"--file={directory}", database]
+
+
+# restore_command returns the command that restores a directory-format dump,
+# jobs tables at a time: into database, which must exist, or when database is
+# None, by recreating the database it was dumped from.
+def restore_command(directory, jobs, database=None):
+    if database is None:
+        return ["pg_restore", f"--jobs={jobs}", "--create", "--clean", "--if-exists", "--dbname=postgres", directory]
+    return ["pg_restore", f"--jobs={jobs}", "--no-owner", f"--dbname={database}", directory]
+
+
+# list_databases returns the databases a directory-format backup covers.
+def list_databases():
+    result = subprocess.run(
+        ["psql", "-AtX", "--dbname=postgres", "-c", "SELECT datname FROM pg_database WHERE NOT datistemplate ORDER BY 1"],
+        check=True, capture_output=True, text=True,
+    )
+    return result.stdout.split()
+
+
+# backup_key returns the object key for a plain-format dump started at started.
+def backup_key(prefix, database, extension, started):
+    stamp = started.strftime("%Y-%m-%dT%H-%M-%SZ")
+    if database is None:
+        return f"{prefix}/pg_backup_{stamp}.sql.{extension}"
+    return f"{prefix}/{database}_{stamp}.dump.{extension}"
+
+
+# backup_folder returns the key prefix of a directory-format backup.
+def backup_folder(prefix, started):
+    return f"{prefix}/pg_backup_{started.strftime('%Y-%m-%dT%H-%M-%SZ')}"
+
+
+def _read_part(stream, size):
+    # Pipe reads return whatever is available, so keep reading up to size.
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+# upload_stream copies stream into a multipart upload of bucket/key and
+# returns the number of bytes and parts uploaded. check is called once the
+# stream is exhausted, before the upload is completed; if it (or any part)
+# raises, the upload is aborted.
+def upload_stream(s3, stream, bucket, key, part_size=32 * MIB, concurrency=4, check=None):
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+    # A slot is taken before a part is read into memory and given back once it
+    # is uploaded, which bounds memory to concurrency + 1 parts.
+    slots = threading.BoundedSemaphore(concurrency + 1)
+    futures = []
+    size = 0
+
+    def upload_part(number, body):
+        try:
+            response = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            while not any(future.done() and future.exception() for future in futures):
+                slots.acquire()
+                body = _read_part(stream, part_size)
+                if not body and futures:
+                    slots.release()
+                    break
+                if len(futures) == MAX_PARTS:
+                    slots.release()
+                    raise RuntimeError(f"backup needs more than {MAX_PARTS} parts; raise --part-size")
+                size += len(body)
+                futures.append(pool.submit(upload_part, len(futures) + 1, body))
+                if len(body) < part_size:
+                    break
+            parts = [future.result() for future in futures]
+        if check:
+            check()
+        s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return size, len(parts)
+
+
+def _check_exits(procs):
+    failed = [f"{cmd[0]} exited with {code}" for cmd, proc in procs if (code := proc.wait())]
+    if failed:
+        raise RuntimeError(", ".join(failed))
+
+
+# run_backup runs dump | compress (or just dump when compress is None) into
+# bucket/key and returns its metrics.
+def run_backup(s3, bucket, key, dump, compress, part_size=32 * MIB, concurrency=4):
+    started = time.monotonic()
+    procs = [(dump, subprocess.Popen(dump, stdout=subprocess.PIPE))]
+    if compress:
+        procs.append((compress, subprocess.Popen(compress, stdin=procs[0][1].stdout, stdout=subprocess.PIPE)))
+        # Only the compressor reads the dump, so it sees EOF (or SIGPIPE) properly.
+        procs[0][1].stdout.close()
+    output = procs[-1][1].stdout
+
+    try:
+        size, parts = upload_stream(s3, output, bucket, key, part_size, concurrency, lambda: _check_exits(procs))
+    finally:
+        output.close()
+        for _, proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+    duration = time.monotonic() - started
+    return {
+        "key": key,
+        "bytes": size,
+        "parts": parts,
+        "duration_seconds": round(duration, 3),
+        "throughput_mib_per_second": round(size / MIB / duration, 3) if duration else 0.0,
+    }
+
+
+# backup_directories dumps each database in directory format, jobs tables at
+# a time, and uploads it as <folder>/<database>.dir.tar next to the roles in
+# <folder>/globals.sql.<extension>. It returns the metrics of each upload.
+def backup_directories(s3, bucket, folder, databases, jobs, work_dir, compress, extension,
+                       part_size=32 * MIB, concurrency=4):
+    results = [run_backup(s3, bucket, f"{folder}/globals.sql.{extension}",
+                          ["pg_dumpall", "--globals-only"], compress, part_size, concurrency)]
+    results[0]["database"] = "globals"
+    for database in databases:
+        scratch = tempfile.mkdtemp(prefix="pg_backup-", dir=work_dir)
+        try:
+            started = time.monotonic()
+            subprocess.run(directory_dump_command(database, os.path.join(scratch, database), jobs), check=True)
+            dump_seconds = time.monotonic() - started
+            # pg_dump already compressed the table files
+            metrics = run_backup(s3, bucket, f"{folder}/{database}.dir.tar",
+                                 ["tar", "-cf", "-", "-C", scratch, database], None, part_size, concurrency)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        metrics.update(database=database, jobs=jobs, dump_seconds=round(dump_seconds, 3))
+        metrics["duration_seconds"] = round(metrics["duration_seconds"] + dump_seconds, 3)
+        results.append(metrics)
+    return results
+
+
+# _download runs commands as a pipeline fed with the object's body.
+def _download(s3, bucket, key, *commands):
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    procs = []
+    for command in commands:
+        stdin = procs[-1][1].stdout if procs else subprocess.PIPE
+        procs.append((command, subprocess.Popen(command, stdin=stdin,
+                                                stdout=subprocess.PIPE if command is not commands[-1] else None)))
+        if len(procs) > 1:
+            procs[-2][1].stdout.close()
+    size = 0
+    try:
+        with procs[0][1].stdin as stdin:
+            for chunk in body.iter_chunks(MIB):
+                stdin.write(chunk)
+                size += len(chunk)
+    except BrokenPipeError:
+        # The pipeline stopped reading; its exit codes say why
+        pass
+    finally:
+        for _, proc in procs:
+            proc.wait()
+    _check_exits(procs)
+    return size
+
+
+# restore restores bucket/key, downloaded without staging except for
+# directory-format dumps, which pg_restore reads from work_dir jobs tables at
+# a time. database restores a single-database dump into that (new) database
+# instead of recreating the original. Returns the restore's metrics.
+def restore(s3, bucket, key, jobs, work_dir, database=None):
+    started = time.monotonic()
+    if key.endswith(".dir.tar"):
+        scratch = tempfile.mkdtemp(prefix="pg_restore-", dir=work_dir)
+        try:
+            size = _download(s3, bucket, key, ["tar", "-xf", "-", "-C", scratch])
+            (dumped,) = os.listdir(scratch)
+            if database:
+                subprocess.run(["createdb", database], check=True)
+            subprocess.run(restore_command(os.path.join(scratch, dumped), jobs, database), check=True)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    else:
+        decompress = DECOMPRESSORS[key.rsplit(".", 1)[1]]
+        if ".dump." in key:
+            if database:
+                subprocess.run(["createdb", database], check=True)
+                load = ["pg_restore", "--no-owner", f"--dbname={database}"]
+            else:
+                load = ["pg_restore", "--create", "--clean", "--if-exists", "--dbname=postgres"]
+        elif database:
+            raise ValueError("--database only applies to single-database backups")
+        else:
+            # Roles and databases that already exist make harmless errors
+            load = ["psql", "-qX", "--dbname=postgres", "-f", "-"]
+        size = _download(s3, bucket, key, decompress, load)
+    return {
+        "key": key,
+        "bytes": size,
+        "jobs": jobs if key.endswith(".dir.tar") else 1,
+        "duration_seconds": round(time.monotonic() - started, 3),
+    }
+
+
+# put_metrics publishes a backup's metrics to CloudWatch.
+def put_metrics(cloudwatch, namespace, metrics, database):
+    dimensions = [{"Name": "Database", "Value": database or "all"}]
+    cloudwatch.put_metric_data(Namespace=namespace, MetricData=[
+        {"MetricName": "BackupDuration", "Dimensions": dimensions, "Value": metrics["duration_seconds"], "Unit": "Seconds"},
+        {"MetricName": "BackupSize", "Dimensions": dimensions, "Value": metrics["bytes"], "Unit": "Bytes"},
+        {"MetricName": "BackupThroughput", "Dimensions": dimensions,
+         "Value": metrics["throughput_mib_per_second"] * MIB, "Unit": "Bytes/Second"},
+    ])
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--bucket", required=True)
+    common.add_argument("--jobs", type=int, default=0, help="tables dumped/restored at once (default: all cores)")
+    common.add_argument("--work-dir", default=tempfile.gettempdir(), help="where directory-format dumps are staged")
+    common.add_argument("--endpoint-url", help="S3 endpoint, e.g. a local stand-in")
+    common.add_argument("--region")
+
+    parser = argparse.ArgumentParser(description="Stream PostgreSQL dumps to S3 and restore them.")
+    actions = parser.add_subparsers(dest="action", required=True)
+    backup = actions.add_parser("backup", parents=[common], help="dump to S3")
+    backup.add_argument("--prefix", default="pg_backups")
+    backup.add_argument("--format", choices=["plain", "directory"], default="plain")
+    backup.add_argument("--database", action="append",
+                        help="database to dump (repeatable; default: pg_dumpall, or every database in directory format)")
+    backup.add_argument("--compressor", choices=sorted(COMPRESSORS), default="zstd")
+    backup.add_argument("--level", type=int, default=3)
+    backup.add_argument("--part-size", type=int, default=32, help="MiB per upload part")
+    backup.add_argument("--concurrency", type=int, default=4, help="parts uploaded at once")
+    backup.add_argument("--metrics-namespace", help="publish metrics to this CloudWatch namespace")
+    restore_parser = actions.add_parser("restore", parents=[common], help="restore a backup from S3")
+    restore_parser.add_argument("--key", required=True, help="object to restore")
+    restore_parser.add_argument("--database", help="restore a single-database dump into this new database")
+    args = parser.parse_args(argv)
+
+    # Imported here so the dump/restore helpers work without boto3 (see
+    # infrastructure/bench_restore.py)
+    import boto3
+    session = boto3.session.Session(region_name=args.region)
+    s3 = session.client("s3", endpoint_url=args.endpoint_url)
+    jobs = args.jobs or default_jobs()
+
+    if args.action == "restore":
+        print(json.dumps(restore(s3, args.bucket, args.key, jobs, args.work_dir, args.database)), flush=True)
+        return
+
+    if args.part_size * MIB < MIN_PART_SIZE:
+        parser.error("--part-size must be at least 5 MiB")
+    if args.format == "plain" and args.database and len(args.database) > 1:
+        parser.error("plain format dumps one --database or all of them")
+
+    command, extension = COMPRESSORS[args.compressor]
+    compress = command(jobs, args.level)
+    started = datetime.datetime.now(datetime.timezone.utc)
+    if args.format == "directory":
+        results = backup_directories(s3, args.bucket, backup_folder(args.prefix, started),
+                                     args.database or list_databases(), jobs, args.work_dir,
+                                     compress, extension, args.part_size * MIB, args.concurrency)
+    else:
+        database = args.database[0] if args.database else None
+        results = [run_backup(s3, args.bucket, backup_key(args.prefix, database, extension, started),
+                              dump_command(database), compress, args.part_size * MIB, args.concurrency)]
+        results[0]["database"] = database
+    for metrics in results:
+        print(json.dumps(metrics), flush=True)
+        if args.metrics_namespace:
+            put_metrics(session.client("cloudwatch"), args.metrics_namespace, metrics, metrics.get("database"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 'use server';
 
 import { cookies, headers } from 'next/headers';
-import { prisma } from '@/lib/prisma'
+import { prisma, prismaRead } from '@/lib/prisma'
 import { BoardValue } from '@/types/board';
 import { connect } from 'http2';
 
@@ -227,8 +227,9 @@ interface FetchRowsResponse {
 
 // Server action to fetch stats with pagination
 export async function fetchStats(page: number = 1, pageSize: number = 10): Promise<FetchRowsResponse> {
-  const totalCount = await prisma.game.count();
-  const rows = await prisma.game.findMany({
+  // Stats tolerate replication lag, so they are read from the replicas
+  const totalCount = await prismaRead.game.count();
+  const rows = await prismaRead.game.findMany({
     include: {
       user: true,
       _count: {
@@ -1,8 +1,9 @@
 import { PrismaClient } from '@prisma/client'
 
-const prismaClientSingleton = () => {
+const prismaClientSingleton = (url?: string) => {
   return new PrismaClient({
     log: ['query', 'info', 'warn', 'error'],
+    ...(url ? { datasources: { db: { url } } } : {}),
   })
 }
 
@@ -10,10 +11,19 @@ type PrismaClientSingleton = ReturnType<typeof prismaClientSingleton>
 
 const globalForPrisma = globalThis as unknown as { 
   prisma: PrismaClientSingleton | undefined 
+  prismaRead: PrismaClientSingleton | undefined
 }
 
 export const prisma = 
   globalForPrisma.prisma ?? 
   prismaClientSingleton()
 
-if (process.env.NODE_ENV !== 'production') globalForPrisma.prisma = prisma
\ No newline at end of file
+// Read-only queries go to the read replicas when DATABASE_READ_URL is set
+export const prismaRead =
+  globalForPrisma.prismaRead ??
+  (process.env.DATABASE_READ_URL ? prismaClientSingleton(process.env.DATABASE_READ_URL) : prisma)
+
+if (process.env.NODE_ENV !== 'production') {
+  globalForPrisma.prisma = prisma
+  globalForPrisma.prismaRead = prismaRead
+}